@@ -1,12 +1,27 @@
+import atexit;
+import os;
 import numpy;
+import wrappers;
 
-NUMLATENT = 2;
+try:
+	import scipy.linalg;
+except ImportError:
+	scipy = None;
+
+NUMLATENT = int(os.environ.get("ALS_NUMLATENT", 2));
 TOLERANCE = 1e-3;
 LAMBDA = 0.01;
 MAX_UPDATES = 10;
 MAXVAL = 1e+100;
 MINVAL = -1e+100;
 REGNORMAL = 1;
+BATCHED = 1;  # build the normal equations of a vertex at once in gather_batch
+PLATEAU = 1e-3;  # stop once validation RMSE improves by less than this fraction
+PATIENCE = 2;    # for this many evaluations in a row
+# "direct" solves the normal equations, "cg" runs CG_STEPS conjugate gradient
+# steps from the previous factor and needs BATCHED
+SOLVER = os.environ.get("ALS_SOLVER", "direct");
+CG_STEPS = int(os.environ.get("ALS_CG_STEPS", 5));
 
 gatherEdges = 3;  # gather and scatter on all edges
 scatterEdges = 3;
@@ -36,6 +51,8 @@ class edgeDataClass:
 class aggregatorClass:
 	XtX = numpy.zeros((NUMLATENT, NUMLATENT));
 	Xy = numpy.zeros(NUMLATENT);
+	X = None;  # with SOLVER "cg": the stacked neighbour factors and observations
+	y = None;
 	is_empty = 1;
 	def __init__(self, X = None, y = None):
 		if (X != None) & (y != None):
@@ -49,31 +66,149 @@ class aggregatorClass:
 			if self.is_empty == 1:
 				self.XtX = other.XtX;
 				self.Xy = other.Xy;
+				self.X = other.X;
+				self.y = other.y;
 				self.is_empty = 0;
+			elif other.X is not None:
+				self.X = numpy.vstack((self.X, other.X));
+				self.y = numpy.concatenate((self.y, other.y));
 			else:
-				self.XtX[indices] += other.XtX[indices];
+				self.XtX += other.XtX;
 				self.Xy += other.Xy;
 
-def parseEdge(file, line):
-	type = 0;
+# Training and validation RMSE are evaluated from the current factors by an
+# edge aggregator before every iteration; see rmse below for the stopping
+# rule.
+def squaredErrors(srcData, targetData, edgeData):
+	# (train squared error, train count, validation squared error, validation
+	# count); None, the identity of the reduction, for predict edges
+	if edgeData.type == 2:
+		return None;
+	errors = numpy.zeros(4);
+	error = edgeData.obs-numpy.dot(srcData.factor, targetData.factor);
+	errors[2*edgeData.type] = error*error;
+	errors[2*edgeData.type+1] = 1;
+	return errors;
+
+rmseCurve = [];  # (train RMSE, validation RMSE) per evaluation of the current run
+rmseRun = None;
+
+def rmse(total):
+	# returning True stops the engine: validation RMSE has not improved by
+	# PLATEAU for PATIENCE evaluations
+	global rmseRun;
+	if rmseRun != wrappers.runId:
+		del rmseCurve[:];
+		rmseRun = wrappers.runId;
+	if total is None:
+		return False;
+	train = numpy.sqrt(total[0]/total[1]) if total[1] > 0 else float("nan");
+	validation = numpy.sqrt(total[2]/total[3]) if total[3] > 0 else float("nan");
+	rmseCurve.append((train, validation));
+	if total[3] == 0 or len(rmseCurve) <= PATIENCE:
+		return False;
+	for i in xrange(len(rmseCurve)-PATIENCE, len(rmseCurve)):
+		if rmseCurve[i][1] < rmseCurve[i-1][1]*(1.0-PLATEAU):
+			return False;
+	if wrappers.procId == 0:
+		print "Validation RMSE plateaued at %g, stopping" % validation;
+	return True;
+
+aggregators = [("rmse", "edge", squaredErrors, rmse, 0.0)];
+
+def reportRmseCurve():
+	if wrappers.procId != 0 or len(rmseCurve) == 0:
+		return;
+	print "evaluation\ttrain RMSE\tvalidation RMSE";
+	for i, (train, validation) in enumerate(rmseCurve):
+		print "%d\t%g\t%g" % (i, train, validation);
+
+atexit.register(reportRmseCurve);
+
+def edgeType(file):
 	if ".train" in file:
-		type = 0;
+		return 0;
 	elif ".validate" in file:
-		type = 1;
+		return 1;
 	elif ".predict" in file:
-		type = 2;
-		
+		return 2;
+	return 0;
+
+def parseEdge(file, line):
 	s = line.split();	
 	srcId = int(s[0]);
 	destId = int(s[1]);
-	edgeVal = edgeDataClass(type, float(s[2]));
+	edgeVal = edgeDataClass(edgeType(file), float(s[2]));
 	return (2*srcId, 2*destId+1, edgeVal);	
 
+def parseEdges(file, chunk):
+	type = edgeType(file);
+	data = numpy.fromstring(chunk, sep=" ").reshape(-1, 3);
+	src = 2*data[:, 0].astype(numpy.int64);
+	dst = 2*data[:, 1].astype(numpy.int64)+1;
+	return (src, dst, [edgeDataClass(type, obs) for obs in data[:, 2]]);
+
+def normalEquations(X, y):
+	agg = aggregatorClass();
+	agg.XtX = numpy.dot(X.T, X);
+	agg.Xy = numpy.dot(X.T, y);
+	agg.is_empty = 0;
+	return agg;
+
+def stackedObservations(X, y):
+	agg = aggregatorClass();
+	agg.X = X;
+	agg.y = y;
+	agg.is_empty = 0;
+	return agg;
+
+def conjugateGradient(X, y, regularization, x0, steps):
+	# approximately solves (X'X + regularization*I) x = X'y starting from x0,
+	# with products by X and X' instead of forming X'X
+	x = x0.copy();
+	r = numpy.dot(X.T, y-numpy.dot(X, x))-regularization*x;
+	p = r.copy();
+	rr = numpy.dot(r, r);
+	for i in xrange(steps):
+		if rr < 1e-20:
+			break;
+		Ap = numpy.dot(X.T, numpy.dot(X, p))+regularization*p;
+		alpha = rr/numpy.dot(p, Ap);
+		x += alpha*p;
+		r -= alpha*Ap;
+		rrNew = numpy.dot(r, r);
+		p = r+(rrNew/rr)*p;
+		rr = rrNew;
+	return x;
+
+def choleskySolve(A, b):
+	# A is symmetric positive definite and overwritten.  Without scipy there
+	# is no triangular solve, and one LU solve beats two on the factors.
+	if scipy is not None:
+		return scipy.linalg.cho_solve(scipy.linalg.cho_factor(A, overwrite_a=True, check_finite=False), b,
+		                              check_finite=False);
+	return numpy.linalg.solve(A, b);
+
+if BATCHED == 1:
+	# XtX and Xy from one product over the stacked factors of the training
+	# neighbours, instead of an aggregator per edge; XtX is the full matrix
+	# rather than the upper triangle built by gather
+	def gather_batch(targetData, neighborDatas, edgeDatas, degrees):
+		train = [i for i in xrange(len(edgeDatas)) if edgeDatas[i].type == 0];
+		if len(train) == 0:
+			return aggregatorClass();
+		X = numpy.array([neighborDatas[i].factor for i in train]);
+		y = numpy.array([edgeDatas[i].obs for i in train]);
+		if SOLVER == "cg":
+			return stackedObservations(X, y);
+		return normalEquations(X, y);
+
 def transformVertex(vertex):
     return vertexDataClass();
 
 def saveVertex(vertexData):
-    return str(vertexData.factor);
+    # written as text by save_graph, as a numpy shard by save_graph_binary
+    return vertexData.factor;
 
 def saveEdge(srcData, targetData, edgeData):
     if edgeData.type == 2:
@@ -92,9 +227,12 @@ def apply(targetData, aggInst, numIn, numOut):
 	targetData.do_gather = 0;
         return targetData;
     else:
+        wasGathering = targetData.do_gather;
    	targetData.do_gather = 1;
     
     if aggInst.is_empty == 1:
+        if (wasGathering == 1) & (targetData.residual == 0.0) & (targetData.num_updates == 0):
+            return None;  # unchanged, not sent to the mirrors
         targetData.residual = 0.0;
         targetData.num_updates = 0;
         return targetData;
@@ -102,12 +240,17 @@ def apply(targetData, aggInst, numIn, numOut):
     regularization = LAMBDA;
     if REGNORMAL == 1:
         regularization *= numOut;
-    for i in range(0, aggInst.XtX.shape[0]):
-        aggInst.XtX[i][i] += regularization;
-
     old_factor = targetData.factor;
-    targetData.factor = numpy.linalg.solve(aggInst.XtX, aggInst.Xy);
-    targetData.residual = numpy.sum(numpy.absolute(targetData.factor-old_factor)) / aggInst.XtX.shape[0];
+    if aggInst.X is not None:
+        targetData.factor = conjugateGradient(aggInst.X, aggInst.y, regularization, old_factor, CG_STEPS);
+    elif BATCHED == 1:
+        aggInst.XtX.flat[::aggInst.XtX.shape[0]+1] += regularization;
+        targetData.factor = choleskySolve(aggInst.XtX, aggInst.Xy);
+    else:
+        for i in range(0, aggInst.XtX.shape[0]):
+            aggInst.XtX[i][i] += regularization;
+        targetData.factor = numpy.linalg.solve(aggInst.XtX, aggInst.Xy);
+    targetData.residual = numpy.sum(numpy.absolute(targetData.factor-old_factor)) / NUMLATENT;
     targetData.num_updates += 1;
 
     return targetData;
@@ -125,3 +268,17 @@ def scatter(srcData, targetData, edgeData, numIn, numOut):
         else:
             return (-1.0, None, None);
 
+
+def should_scatter(vertexData):
+    return vertexData.do_gather != 0;
+
+def scatter_batch(srcData, neighborDatas, edgeDatas, numIn, numOut):
+    # scatter for all edges of the vertex at once
+    if len(neighborDatas) == 0:
+        return -1.0;
+    factors = numpy.array([n.factor for n in neighborDatas]);
+    obs = numpy.array([e.obs for e in edgeDatas]);
+    train = numpy.array([e.type == 0 for e in edgeDatas]);
+    updates = numpy.array([n.num_updates for n in neighborDatas]);
+    priority = numpy.absolute(obs-numpy.dot(factors, srcData.factor))*srcData.residual;
+    return numpy.where(train & (priority > TOLERANCE) & (updates < MAX_UPDATES), priority, -1.0);
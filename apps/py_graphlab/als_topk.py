@@ -0,0 +1,107 @@
+# Top-K recommendations from the factors trained by als.py.
+#
+#   py_graphlab_exec --script als --graph ratings/ --saveprefix factors --save_format npy
+#   python als_topk.py --factors factors --k 10 --out topk
+#
+# reads the vertex shards written by save_graph_binary (users have even and
+# items odd vertex ids, see als.parseEdge), scores every user against the
+# whole item catalog with blocked matrix products and writes
+#   topk.users.npy   user ids, int64
+#   topk.items.npy   item ids of each user's top K, best first, int64
+#   topk.scores.npy  their scores, float32
+# User blocks are scored by a pool of processes; each keeps only the running
+# top K of its block besides one block x item tile of scores.
+
+import argparse;
+import multiprocessing;
+import sys;
+
+import numpy;
+
+# factor matrices, set before the pool forks so that workers share them
+userFactors = None;
+itemFactors = None;
+
+def loadFactors(prefix):
+	# the bridge writes the shards, importing it is only needed to read them
+	import py_graphlab;
+	ids = [];
+	factors = [];
+	shards = py_graphlab.load_shards(prefix);
+	if len(shards) == 0:
+		raise IOError("no vertex shards found for %s" % prefix);
+	for shardIds, shardFactors in shards:
+		if isinstance(shardFactors, tuple):
+			raise IOError("%s holds byte shards, save the factors with --save_format npy" % prefix);
+		# machines without vertices write empty shards
+		if len(shardIds) == 0:
+			continue;
+		ids.append(shardIds);
+		factors.append(shardFactors);
+	if len(ids) == 0:
+		empty = numpy.zeros(0, dtype=numpy.int64);
+		return empty, numpy.zeros((0, 0)), empty, numpy.zeros((0, 0));
+	ids = numpy.concatenate(ids);
+	factors = numpy.concatenate(factors);
+	users = ids % 2 == 0;
+	return ids[users]/2, factors[users], (ids[~users]-1)/2, factors[~users];
+
+def topK(scores, items, k):
+	# the k best columns of each row of scores, best first
+	part = numpy.argpartition(-scores, k-1, axis=1)[:, :k];
+	rows = numpy.arange(scores.shape[0])[:, numpy.newaxis];
+	best = numpy.argsort(-scores[rows, part], axis=1);
+	part = part[rows, best];
+	return items[rows, part], scores[rows, part];
+
+def scoreBlock(args):
+	begin, end, k, itemBlock = args;
+	users = userFactors[begin:end];
+	topItems = numpy.zeros((end-begin, 0), dtype=numpy.int64);
+	topScores = numpy.zeros((end-begin, 0));
+	for itemBegin in xrange(0, itemFactors.shape[0], itemBlock):
+		itemEnd = min(itemBegin+itemBlock, itemFactors.shape[0]);
+		scores = numpy.dot(users, itemFactors[itemBegin:itemEnd].T);
+		tileItems = numpy.arange(itemBegin, itemEnd, dtype=numpy.int64);
+		candidates = numpy.hstack((topScores, scores));
+		candidateItems = numpy.hstack((topItems, numpy.tile(tileItems, (end-begin, 1))));
+		topItems, topScores = topK(candidates, candidateItems, min(k, candidates.shape[1]));
+	return begin, topItems, topScores;
+
+def main(argv):
+	global userFactors, itemFactors;
+	parser = argparse.ArgumentParser(description="top-K recommendations from als.py factors");
+	parser.add_argument("--factors", required=True, help="save prefix of the als.py run (npy shards)");
+	parser.add_argument("--out", required=True, help="output prefix");
+	parser.add_argument("--k", type=int, default=10, help="items per user");
+	parser.add_argument("--procs", type=int, default=multiprocessing.cpu_count(), help="scoring processes");
+	parser.add_argument("--user_block", type=int, default=1024, help="users scored together");
+	parser.add_argument("--item_block", type=int, default=8192, help="items per score tile");
+	args = parser.parse_args(argv);
+
+	userIds, userFactors, itemIds, itemFactors = loadFactors(args.factors);
+	if len(itemIds) == 0 or args.k <= 0:
+		sys.stderr.write("no items to recommend in %s\n" % args.factors);
+		return 1;
+	k = min(args.k, len(itemIds));
+	print "%d users, %d items, top %d" % (len(userIds), len(itemIds), k);
+
+	outItems = numpy.lib.format.open_memmap(args.out + ".items.npy", mode="w+", dtype=numpy.int64,
+	                                        shape=(len(userIds), k));
+	outScores = numpy.lib.format.open_memmap(args.out + ".scores.npy", mode="w+", dtype=numpy.float32,
+	                                         shape=(len(userIds), k));
+	blocks = [(begin, min(begin+args.user_block, len(userIds)), k, args.item_block)
+	          for begin in xrange(0, len(userIds), args.user_block)];
+	pool = multiprocessing.Pool(args.procs);
+	for begin, items, scores in pool.imap_unordered(scoreBlock, blocks):
+		outItems[begin:begin+len(items)] = itemIds[items];
+		outScores[begin:begin+len(items)] = scores;
+	pool.close();
+	pool.join();
+	numpy.save(args.out + ".users.npy", userIds);
+	outItems.flush();
+	outScores.flush();
+	return 0;
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,313 @@
+# Benchmarks for py_graphlab_exec.
+#
+#   python benchmark.py scaling --procs 1,2,4,8
+#   python benchmark.py cache
+#   python benchmark.py callbacks --execs old/py_graphlab_exec,new/py_graphlab_exec
+#   python benchmark.py launch --procs 1,2,4,8
+#   python benchmark.py als_solver --latent 20,100,200
+#   python benchmark.py delta --tolerances 0.01,0.001
+#
+# generates synthetic inputs for simple_pagerank.py and als.py and reports the
+# engine throughput (vertex updates per second) for each process count, or
+# compares simple_pagerank.py with gather caching on and off, or measures
+# Python callbacks per second of one or more py_graphlab_exec builds, or
+# compares py_graphlab.launch with running in the calling process, or the
+# direct and conjugate gradient solvers of als.py, or the updates and error of
+# delta_pagerank.py and simple_pagerank.py.
+
+import argparse;
+import os;
+import random;
+import re;
+import shutil;
+import subprocess;
+import sys;
+import tempfile;
+import time;
+
+HERE = os.path.dirname(os.path.abspath(__file__));
+REFERENCE_ITERATIONS = 200;  # power iterations of the exact PageRank for delta
+
+def writePowerLawGraph(path, numVertices, avgDegree, alpha = 2.1, seed = 1):
+	# out-degrees drawn from a zipf-like distribution, targets uniform
+	rnd = random.Random(seed);
+	f = open(path, "w");
+	for src in xrange(numVertices):
+		degree = min(int(rnd.paretovariate(alpha-1.0)*avgDegree/2.0), numVertices-1);
+		for i in xrange(degree):
+			dst = rnd.randrange(numVertices);
+			if dst != src:
+				f.write("%d\t%d\n" % (src, dst));
+	f.close();
+
+def writeRatings(path, numUsers, numItems, ratingsPerUser, seed = 1):
+	rnd = random.Random(seed);
+	f = open(path, "w");
+	for user in xrange(numUsers):
+		for item in rnd.sample(xrange(numItems), min(ratingsPerUser, numItems)):
+			f.write("%d\t%d\t%.1f\n" % (user, item, rnd.randint(1, 5)));
+	f.close();
+
+def runExec(execPath, script, graph, procs, ncpus, extraArgs = [], env = None):
+	# script is a module name, imported from this directory
+	cmd = [execPath, "--script", script, "--graph", graph,
+	       "--procs", str(procs), "--ncpus", str(ncpus)] + extraArgs;
+	start = time.time();
+	proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=HERE,
+	                        env=None if env is None else dict(os.environ, **env));
+	out = proc.communicate()[0];
+	wall = time.time()-start;
+	if proc.returncode != 0:
+		sys.stderr.write(out);
+		raise RuntimeError("%s exited with %d" % (" ".join(cmd), proc.returncode));
+	result = {"wall": wall, "runtime": None, "updates": None, "profile": {}, "output": out};
+	m = re.search(r"Finished Running engine in ([0-9.eE+-]+) seconds", out);
+	if m:
+		result["runtime"] = float(m.group(1));
+	m = re.search(r"Total updates: (\d+)", out);
+	if m:
+		result["updates"] = int(m.group(1));
+	for name, calls, seconds in re.findall(r"Python profile: (\w+) calls=(\d+) seconds=([0-9.eE+-]+)", out):
+		result["profile"][name] = (int(calls), float(seconds));
+	return result;
+
+def printRow(cells):
+	print "".join(str(c).rjust(14) for c in cells);
+
+def scaling(args):
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		pagerankDir = os.path.join(workdir, "pagerank");
+		alsDir = os.path.join(workdir, "als");
+		os.mkdir(pagerankDir);
+		os.mkdir(alsDir);
+		writePowerLawGraph(os.path.join(pagerankDir, "graph.tsv"), args.vertices, args.degree);
+		writeRatings(os.path.join(alsDir, "ratings.train"), args.vertices, args.vertices/10+1, args.degree);
+
+		for script, graph in [("simple_pagerank", pagerankDir), ("als", alsDir)]:
+			print script;
+			printRow(["procs", "ncpus", "updates", "engine(s)", "wall(s)", "updates/s", "speedup"]);
+			base = None;
+			for procs in args.procs:
+				r = runExec(args.exec_path, script, graph, procs, args.ncpus);
+				rate = r["updates"]/r["runtime"] if r["updates"] and r["runtime"] else 0.0;
+				if base is None:
+					base = rate;
+				printRow([procs, args.ncpus, r["updates"], "%.3f" % r["runtime"],
+				          "%.3f" % r["wall"], "%.1f" % rate, "%.2f" % (rate/base if base else 0.0)]);
+	finally:
+		shutil.rmtree(workdir);
+
+def cache(args):
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		writePowerLawGraph(os.path.join(workdir, "graph.tsv"), args.vertices, args.degree);
+		script = "simple_pagerank";
+		print script;
+		printRow(["engine", "use_cache", "updates", "engine(s)", "wall(s)", "updates/s", "speedup"]);
+		for engine in args.engines:
+			base = None;
+			for useCache in ["false", "true"]:
+				r = runExec(args.exec_path, script, workdir, args.procs, args.ncpus,
+				            ["--engine", engine, "--engine_opts", "use_cache=" + useCache]);
+				if base is None:
+					base = r["runtime"];
+				printRow([engine, useCache, r["updates"], "%.3f" % r["runtime"], "%.3f" % r["wall"],
+				          "%.1f" % (r["updates"]/r["runtime"]), "%.2f" % (base/r["runtime"])]);
+	finally:
+		shutil.rmtree(workdir);
+
+def callbacks(args):
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		writePowerLawGraph(os.path.join(workdir, "graph.tsv"), args.vertices, args.degree);
+		print "simple_pagerank, %d iterations" % args.iterations;
+		printRow(["build", "updates", "engine(s)", "updates/s", "gather/s", "apply/s", "scatter/s"]);
+		for i, execPath in enumerate(args.execs):
+			# builds without --profile only report the update rate
+			extra = ["--engine_opts", "max_iterations=%d" % args.iterations];
+			try:
+				r = runExec(execPath, "simple_pagerank", workdir, 1, 1, extra + ["--profile", "true"]);
+			except RuntimeError:
+				r = runExec(execPath, "simple_pagerank", workdir, 1, 1, extra);
+			rates = [];
+			for name in ("gather", "apply", "scatter"):
+				calls = r["profile"].get(name, (0, 0.0))[0];
+				rates.append("%.0f" % (calls/r["runtime"]) if calls else "-");
+			printRow([i, r["updates"], "%.3f" % r["runtime"], "%.1f" % (r["updates"]/r["runtime"])] + rates);
+	finally:
+		shutil.rmtree(workdir);
+
+def alsSolver(args):
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		writeRatings(os.path.join(workdir, "ratings.train"), args.users, args.items, args.ratings, seed=1);
+		writeRatings(os.path.join(workdir, "ratings.validate"), args.users, args.items, 2, seed=2);
+		print "als, %d iterations" % args.iterations;
+		printRow(["latent", "solver", "iterations", "engine(s)", "s/iteration", "train RMSE", "valid. RMSE"]);
+		for latent in args.latent:
+			for solver in ("direct", "cg"):
+				env = {"ALS_NUMLATENT": str(latent), "ALS_SOLVER": solver, "ALS_CG_STEPS": str(args.cg_steps)};
+				r = runExec(args.exec_path, "als", workdir, args.procs, args.ncpus,
+				            ["--engine_opts", "max_iterations=%d" % args.iterations], env);
+				# the RMSE curve als.py prints at exit, one row per evaluation
+				curve = re.findall(r"^\d+\t(\S+)\t(\S+)$", r["output"], re.M);
+				train, validation = curve[-1] if curve else ("-", "-");
+				iterations = max(len(curve), 1);
+				printRow([latent, solver, len(curve), "%.3f" % r["runtime"],
+				          "%.4f" % (r["runtime"]/iterations), train, validation]);
+	finally:
+		shutil.rmtree(workdir);
+
+def referencePageRank(path, iterations = REFERENCE_ITERATIONS):
+	# power iteration with the update of simple_pagerank.py
+	inEdges = {};
+	numOut = {};
+	for line in open(path):
+		src, dst = [int(x) for x in line.split()];
+		inEdges.setdefault(dst, []).append(src);
+		inEdges.setdefault(src, []);
+		numOut[src] = numOut.get(src, 0)+1;
+	pr = dict.fromkeys(inEdges, 1.0);
+	for i in xrange(iterations):
+		pr = dict((v, 0.15+sum(0.85*pr[u]/numOut[u] for u in inEdges[v])) for v in inEdges);
+	return pr;
+
+def loadRanks(prefix):
+	# the text shards of --saveprefix, "id<tab>pr[:...]" per line
+	pr = {};
+	directory, name = os.path.split(prefix);
+	for f in os.listdir(directory):
+		if f.startswith(name):
+			for line in open(os.path.join(directory, f)):
+				vid, value = line.split("\t");
+				pr[int(vid)] = float(value.split(":")[0]);
+	return pr;
+
+def delta(args):
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		graphDir = os.path.join(workdir, "graph");
+		os.mkdir(graphDir);
+		writePowerLawGraph(os.path.join(graphDir, "graph.tsv"), args.vertices, args.degree);
+		reference = referencePageRank(os.path.join(graphDir, "graph.tsv"));
+		runs = [("simple_pagerank", "synchronous", None, [])];
+		for tolerance in args.tolerances:
+			runs.append(("delta_pagerank", "synchronous", tolerance, []));
+			runs.append(("delta_pagerank", "asynchronous", tolerance, ["--scheduler", "priority"]));
+		print "%d vertices, mean absolute error against %d power iterations" % (len(reference), REFERENCE_ITERATIONS);
+		printRow(["script", "engine", "tolerance", "updates", "engine(s)", "updates/vertex", "mean error"]);
+		for script, engine, tolerance, extra in runs:
+			prefix = os.path.join(workdir, "out", script);
+			if os.path.exists(os.path.dirname(prefix)):
+				shutil.rmtree(os.path.dirname(prefix));
+			os.mkdir(os.path.dirname(prefix));
+			env = None if tolerance is None else {"PAGERANK_TOLERANCE": str(tolerance)};
+			r = runExec(args.exec_path, script, graphDir, args.procs, args.ncpus,
+			            ["--engine", engine, "--saveprefix", prefix] + extra, env);
+			pr = loadRanks(prefix);
+			error = sum(abs(pr.get(v, 0.0)-reference[v]) for v in reference)/len(reference);
+			printRow([script, engine, "-" if tolerance is None else tolerance, r["updates"],
+			          "%.3f" % r["runtime"], "%.2f" % (float(r["updates"])/len(reference)), "%.2e" % error]);
+	finally:
+		shutil.rmtree(workdir);
+
+def launchScaling(args):
+	# the bridge imports the user script from the working directory
+	sys.path.insert(0, HERE);
+	os.chdir(HERE);
+	import py_graphlab;
+
+	def row(procs, stats, wall, base):
+		rate = stats["updates"]/stats["elapsed"];
+		printRow([procs, stats["updates"], "%.3f" % stats["elapsed"], "%.3f" % wall,
+		          "%.1f" % rate, "%.2f" % (rate/base if base else 1.0)]);
+		return rate;
+
+	workdir = tempfile.mkdtemp(prefix="py_graphlab_bench");
+	try:
+		writePowerLawGraph(os.path.join(workdir, "graph.tsv"), args.vertices, args.degree);
+		print "simple_pagerank";
+		printRow(["procs", "updates", "engine(s)", "wall(s)", "updates/s", "speedup"]);
+
+		start = time.time();
+		py_graphlab.set_ncpus(args.ncpus);
+		py_graphlab.init_graph(workdir, "", "simple_pagerank");
+		py_graphlab.transform_graph();
+		stats = py_graphlab.gas_graph("synchronous");
+		py_graphlab.done_graph();
+		base = row("in-process", stats, time.time()-start, None);
+
+		devnull = open(os.devnull, "w");
+		for procs in args.procs:
+			start = time.time();
+			stats = py_graphlab.launch(procs, "simple_pagerank", workdir, ncpus=args.ncpus, log=devnull);
+			row(procs, stats, time.time()-start, base);
+	finally:
+		shutil.rmtree(workdir);
+
+def intList(s):
+	return [int(x) for x in s.split(",")];
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="py_graphlab benchmarks");
+	parser.add_argument("--exec", dest="exec_path", default=os.path.join(HERE, "py_graphlab_exec"),
+	                    help="path to py_graphlab_exec");
+	sub = parser.add_subparsers();
+
+	p = sub.add_parser("scaling", help="throughput of simple_pagerank.py and als.py versus process count");
+	p.add_argument("--procs", type=intList, default=[1, 2, 4, 8], help="comma separated process counts");
+	p.add_argument("--ncpus", type=int, default=1, help="engine threads per process");
+	p.add_argument("--vertices", type=int, default=20000, help="vertices (pagerank) / users (als)");
+	p.add_argument("--degree", type=int, default=10, help="average out degree / ratings per user");
+	p.set_defaults(func=scaling);
+
+	p = sub.add_parser("cache", help="simple_pagerank.py with gather caching on and off");
+	p.add_argument("--engines", type=lambda s: s.split(","), default=["synchronous", "asynchronous"],
+	               help="comma separated engine types");
+	p.add_argument("--procs", type=int, default=1, help="local processes");
+	p.add_argument("--ncpus", type=int, default=1, help="engine threads per process");
+	p.add_argument("--vertices", type=int, default=20000, help="vertices");
+	p.add_argument("--degree", type=int, default=10, help="average out degree");
+	p.set_defaults(func=cache);
+
+	p = sub.add_parser("callbacks", help="Python callbacks per second on simple_pagerank.py");
+	p.add_argument("--execs", type=lambda s: s.split(","), default=[os.path.join(HERE, "py_graphlab_exec")],
+	               help="comma separated py_graphlab_exec builds to compare, e.g. before and after a change");
+	p.add_argument("--iterations", type=int, default=10, help="synchronous iterations");
+	p.add_argument("--vertices", type=int, default=20000, help="vertices");
+	p.add_argument("--degree", type=int, default=10, help="average out degree");
+	p.set_defaults(func=callbacks);
+
+	p = sub.add_parser("als_solver", help="direct versus conjugate gradient solves in als.py");
+	p.add_argument("--latent", type=intList, default=[20, 100, 200], help="comma separated NUMLATENT values");
+	p.add_argument("--cg_steps", type=int, default=5, help="conjugate gradient steps per update");
+	p.add_argument("--iterations", type=int, default=10, help="synchronous iterations");
+	p.add_argument("--procs", type=int, default=1, help="local processes");
+	p.add_argument("--ncpus", type=int, default=1, help="engine threads per process");
+	p.add_argument("--users", type=int, default=5000, help="users");
+	p.add_argument("--items", type=int, default=1000, help="items");
+	p.add_argument("--ratings", type=int, default=20, help="training ratings per user");
+	p.set_defaults(func=alsSolver);
+
+	p = sub.add_parser("delta", help="updates and error of delta_pagerank.py versus simple_pagerank.py");
+	p.add_argument("--tolerances", type=lambda s: [float(x) for x in s.split(",")], default=[0.01, 0.001],
+	               help="comma separated tolerances of delta_pagerank.py");
+	p.add_argument("--procs", type=int, default=1, help="local processes");
+	p.add_argument("--ncpus", type=int, default=1, help="engine threads per process");
+	p.add_argument("--vertices", type=int, default=20000, help="vertices");
+	p.add_argument("--degree", type=int, default=10, help="average out degree");
+	p.set_defaults(func=delta);
+
+	p = sub.add_parser("launch", help="py_graphlab.launch versus the in-process path on simple_pagerank.py");
+	p.add_argument("--procs", type=intList, default=[1, 2, 4, 8], help="comma separated process counts");
+	p.add_argument("--ncpus", type=int, default=1, help="engine threads per process");
+	p.add_argument("--vertices", type=int, default=20000, help="vertices");
+	p.add_argument("--degree", type=int, default=10, help="average out degree");
+	p.set_defaults(func=launchScaling);
+
+	args = parser.parse_args(argv);
+	args.func(args);
+
+if __name__ == "__main__":
+	main(sys.argv[1:]);
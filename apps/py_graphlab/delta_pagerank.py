@@ -0,0 +1,65 @@
+# PageRank that only propagates changes.  Every vertex keeps the change of
+# its rank that it has not told its out-neighbours about yet (residual).  Once
+# that exceeds TOLERANCE it is pushed in one go: scatter posts it into the
+# cached gathers of the neighbours and signals them with the pushed amount as
+# priority, so the full in-edge gather runs only once per vertex.
+#
+#   py_graphlab_exec --script delta_pagerank --graph graph/
+#   py_graphlab_exec --script delta_pagerank --graph graph/ --engine asynchronous --scheduler priority
+#
+# the tolerance can be set with the PAGERANK_TOLERANCE environment variable.
+# The ranks are within TOLERANCE of the fixed point of simple_pagerank.py in
+# the sense that no vertex has more than TOLERANCE left to push.
+
+import os;
+
+DAMPING = 0.85;
+TOLERANCE = float(os.environ.get("PAGERANK_TOLERANCE", 0.01));
+
+engineOptions = {"use_cache": True};
+
+class vertexDataClass:
+	pr = 1.0;
+	residual = 0.0;  # change of pr not yet pushed to the out-neighbours
+	push = 0.0;      # change pushed by the scatter following the last apply
+	def __init__(self, pr_new=1.0, residual_new=0.0, push_new=0.0):
+		self.pr = pr_new;
+		self.residual = residual_new;
+		self.push = push_new;
+
+class aggregatorClass:
+	sum = 0.0;
+	def __init__(self, sum_new=0.0):
+		self.sum = sum_new;
+	def merge(self, x):
+		self.sum += x.sum;
+
+def parseEdge(file, line):
+	s = line.split();
+	return (int(s[0]), int(s[1]), None);
+
+def transformVertex(vertex):
+	return vertexDataClass();
+
+def saveVertex(vertex):
+	return str(vertex.pr);
+
+def gather(srcData, targetData, edgeData, numIn, numOut):
+	# the rank the out-neighbours have been told about
+	return aggregatorClass(DAMPING*(srcData.pr-srcData.residual)/numOut);
+
+def apply(targetData, aggInst, numIn, numOut):
+	newval = aggInst.sum+1-DAMPING;
+	if newval == targetData.pr and targetData.push == 0.0:
+		return None;
+	residual = targetData.residual+newval-targetData.pr;
+	if abs(residual) > TOLERANCE:
+		return vertexDataClass(newval, 0.0, residual);
+	return vertexDataClass(newval, residual, 0.0);
+
+def should_scatter(vertexData):
+	return vertexData.push != 0.0;
+
+def scatter(srcData, targetData, edgeData, numIn, numOut):
+	delta = DAMPING*srcData.push/numOut;
+	return (abs(delta), None, None, aggregatorClass(delta));
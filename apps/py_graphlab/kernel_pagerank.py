@@ -0,0 +1,27 @@
+# simple_pagerank.py with typed vertex records and native kernels: gather,
+# merge, apply and scatter run in C++ and Python is only called to load and
+# save the graph.
+
+DAMPING = 0.85;
+TOLERANCE = 0.01;
+
+vertexDtype = [("pr", "f8"), ("prDelta", "f8")];
+
+kernels = {
+	"gather": "DAMPING*src.pr/numOut",
+	"merge": "sum",
+	"apply": ["prDelta = total+1-DAMPING-target.pr", "pr = total+1-DAMPING"],
+	"scatter": "abs(src.prDelta) > TOLERANCE",
+	# keeps cached gathers up to date with --engine_opts use_cache=true
+	"delta": "DAMPING*src.prDelta/numOut",
+};
+
+def parseEdge(file, line):
+	s = line.split();
+	return (int(s[0]), int(s[1]), None);
+
+def transformVertex(vertex):
+	return (1.0, 0.0);
+
+def saveVertex(vertex):
+	return str(vertex.pr)+":"+str(vertex.prDelta);
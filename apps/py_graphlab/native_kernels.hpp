@@ -0,0 +1,468 @@
+/*
+ * Copyright (c) 2009 Carnegie Mellon University.
+ *     All rights reserved.
+ *
+ *  Licensed under the Apache License, Version 2.0 (the "License");
+ *  you may not use this file except in compliance with the License.
+ *  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *  Unless required by applicable law or agreed to in writing,
+ *  software distributed under the License is distributed on an "AS
+ *  IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+ *  express or implied.  See the License for the specific language
+ *  governing permissions and limitations under the License.
+ *
+ * For more about this software visit:
+ *
+ *      http://www.graphlab.ml.cmu.edu
+ *
+ */
+
+// Small arithmetic expressions over the fields of typed vertex and edge
+// records, used by py_graphlab to run declared gather/merge/apply/scatter
+// kernels without calling into Python.
+//
+// Grammar, with Python precedence:
+//   expr    := or
+//   or      := and ('or' and)*
+//   and     := not ('and' not)*
+//   not     := 'not' not | compare
+//   compare := sum (('<' | '<=' | '>' | '>=' | '==' | '!=') sum)?
+//   sum     := product (('+' | '-') product)*
+//   product := unary (('*' | '/') unary)*
+//   unary   := '-' unary | power
+//   power   := atom ('**' unary)?
+//   atom    := number | name | name '.' field | function '(' expr (',' expr)* ')' | '(' expr ')'
+// with the functions abs, sqrt, exp, log, min, max and pow.  Names are src,
+// target and edge followed by a field, numIn, numOut, total, or one of the
+// constants passed to compile.  Comparisons and logical operators yield 1 or 0.
+
+#ifndef PY_GRAPHLAB_NATIVE_KERNELS_HPP
+#define PY_GRAPHLAB_NATIVE_KERNELS_HPP
+
+#include <algorithm>
+#include <cctype>
+#include <cmath>
+#include <cstdlib>
+#include <cstring>
+#include <map>
+#include <string>
+#include <vector>
+#include <stdint.h>
+
+namespace py_kernels {
+
+// A numeric field of a record: byte offset, numpy kind ('f', 'i', 'u' or 'b')
+// and size in bytes.
+struct field_type {
+  size_t offset;
+  char kind;
+  size_t size;
+};
+
+typedef std::map<std::string, field_type> layout_type;
+
+inline double read_field(const char *record, const field_type &field) {
+  const char *p = record + field.offset;
+  switch (field.kind) {
+    case 'f':
+      return field.size == 4 ? *(const float *)p : *(const double *)p;
+    case 'i':
+      switch (field.size) {
+        case 1: return *(const int8_t *)p;
+        case 2: return *(const int16_t *)p;
+        case 4: return *(const int32_t *)p;
+        default: return *(const int64_t *)p;
+      }
+    case 'u':
+      switch (field.size) {
+        case 1: return *(const uint8_t *)p;
+        case 2: return *(const uint16_t *)p;
+        case 4: return *(const uint32_t *)p;
+        default: return *(const uint64_t *)p;
+      }
+    default:
+      return *(const uint8_t *)p != 0;
+  }
+}
+
+inline void write_field(char *record, const field_type &field, const double value) {
+  char *p = record + field.offset;
+  switch (field.kind) {
+    case 'f':
+      if (field.size == 4) *(float *)p = value; else *(double *)p = value;
+      break;
+    case 'i':
+      switch (field.size) {
+        case 1: *(int8_t *)p = value; break;
+        case 2: *(int16_t *)p = value; break;
+        case 4: *(int32_t *)p = value; break;
+        default: *(int64_t *)p = value; break;
+      }
+      break;
+    case 'u':
+      switch (field.size) {
+        case 1: *(uint8_t *)p = value; break;
+        case 2: *(uint16_t *)p = value; break;
+        case 4: *(uint32_t *)p = value; break;
+        default: *(uint64_t *)p = value; break;
+      }
+      break;
+    default:
+      *(uint8_t *)p = value != 0;
+  }
+}
+
+// Values an expression is evaluated against.  edge may be NULL when the
+// program declares no edge fields.
+struct kernel_args {
+  const char *src;
+  const char *target;
+  const char *edge;
+  double num_in;
+  double num_out;
+  double total;
+};
+
+class expression {
+  public:
+    expression(): root(-1) {}
+
+    bool empty() const { return root < 0; }
+
+    // Parses text.  Fields are looked up in vertex_layout (src, target) and
+    // edge_layout (edge); other bare names in constants.  On failure returns
+    // false and describes the problem in error.
+    bool compile(const std::string &text, const layout_type &vertex_layout,
+                 const layout_type &edge_layout, const std::map<std::string, double> &constants,
+                 std::string &error) {
+      nodes.clear();
+      source = text;
+      pos = 0;
+      vlayout = &vertex_layout;
+      elayout = &edge_layout;
+      consts = &constants;
+      error.clear();
+      err = &error;
+      next_token();
+      root = parse_or();
+      if (error.empty() && !token.empty()) {
+        fail("unexpected '" + token + "'");
+      }
+      if (!error.empty()) {
+        nodes.clear();
+        root = -1;
+        error = "in '" + text + "': " + error;
+        return false;
+      }
+      return true;
+    }
+
+    double eval(const kernel_args &args) const {
+      return eval_node(root, args);
+    }
+
+  private:
+    enum op_type {
+      OP_CONST, OP_SRC, OP_TARGET, OP_EDGE, OP_NUM_IN, OP_NUM_OUT, OP_TOTAL,
+      OP_NEG, OP_NOT, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_POW,
+      OP_LT, OP_LE, OP_GT, OP_GE, OP_EQ, OP_NE, OP_AND, OP_OR,
+      OP_ABS, OP_SQRT, OP_EXP, OP_LOG, OP_MIN, OP_MAX
+    };
+
+    struct node_type {
+      op_type op;
+      double value;
+      field_type field;
+      int lhs, rhs;
+    };
+
+    std::vector<node_type> nodes;
+    int root;
+
+    // parser state, only valid during compile
+    std::string source;
+    size_t pos;
+    std::string token;
+    const layout_type *vlayout, *elayout;
+    const std::map<std::string, double> *consts;
+    std::string *err;
+
+    double eval_node(const int i, const kernel_args &args) const {
+      const node_type &n = nodes[i];
+      switch (n.op) {
+        case OP_CONST: return n.value;
+        case OP_SRC: return read_field(args.src, n.field);
+        case OP_TARGET: return read_field(args.target, n.field);
+        case OP_EDGE: return args.edge == NULL ? 0.0 : read_field(args.edge, n.field);
+        case OP_NUM_IN: return args.num_in;
+        case OP_NUM_OUT: return args.num_out;
+        case OP_TOTAL: return args.total;
+        case OP_NEG: return -eval_node(n.lhs, args);
+        case OP_NOT: return eval_node(n.lhs, args) == 0;
+        case OP_ADD: return eval_node(n.lhs, args) + eval_node(n.rhs, args);
+        case OP_SUB: return eval_node(n.lhs, args) - eval_node(n.rhs, args);
+        case OP_MUL: return eval_node(n.lhs, args) * eval_node(n.rhs, args);
+        case OP_DIV: return eval_node(n.lhs, args) / eval_node(n.rhs, args);
+        case OP_POW: return std::pow(eval_node(n.lhs, args), eval_node(n.rhs, args));
+        case OP_LT: return eval_node(n.lhs, args) < eval_node(n.rhs, args);
+        case OP_LE: return eval_node(n.lhs, args) <= eval_node(n.rhs, args);
+        case OP_GT: return eval_node(n.lhs, args) > eval_node(n.rhs, args);
+        case OP_GE: return eval_node(n.lhs, args) >= eval_node(n.rhs, args);
+        case OP_EQ: return eval_node(n.lhs, args) == eval_node(n.rhs, args);
+        case OP_NE: return eval_node(n.lhs, args) != eval_node(n.rhs, args);
+        case OP_AND: return eval_node(n.lhs, args) != 0 && eval_node(n.rhs, args) != 0;
+        case OP_OR: return eval_node(n.lhs, args) != 0 || eval_node(n.rhs, args) != 0;
+        case OP_ABS: return std::fabs(eval_node(n.lhs, args));
+        case OP_SQRT: return std::sqrt(eval_node(n.lhs, args));
+        case OP_EXP: return std::exp(eval_node(n.lhs, args));
+        case OP_LOG: return std::log(eval_node(n.lhs, args));
+        case OP_MIN: return std::min(eval_node(n.lhs, args), eval_node(n.rhs, args));
+        case OP_MAX: return std::max(eval_node(n.lhs, args), eval_node(n.rhs, args));
+      }
+      return 0.0;
+    }
+
+    void fail(const std::string &message) {
+      if (err->empty()) *err = message;
+    }
+
+    int add_node(op_type op, int lhs = -1, int rhs = -1, double value = 0.0) {
+      node_type n;
+      n.op = op;
+      n.value = value;
+      n.lhs = lhs;
+      n.rhs = rhs;
+      nodes.push_back(n);
+      return nodes.size() - 1;
+    }
+
+    void next_token() {
+      while (pos < source.size() && isspace(source[pos])) pos++;
+      token.clear();
+      if (pos >= source.size()) return;
+
+      const char c = source[pos];
+      if (isdigit(c) || (c == '.' && pos + 1 < source.size() && isdigit(source[pos + 1]))) {
+        char *end;
+        strtod(source.c_str() + pos, &end);
+        const size_t len = end - (source.c_str() + pos);
+        token = source.substr(pos, len);
+        pos += len;
+      } else if (isalpha(c) || c == '_') {
+        size_t end = pos;
+        while (end < source.size() && (isalnum(source[end]) || source[end] == '_')) end++;
+        token = source.substr(pos, end - pos);
+        pos = end;
+      } else {
+        static const char *two_char_ops[] = {"**", "<=", ">=", "==", "!="};
+        for (size_t i = 0; i < sizeof(two_char_ops) / sizeof(two_char_ops[0]); i++) {
+          if (source.compare(pos, 2, two_char_ops[i]) == 0) {
+            token = two_char_ops[i];
+            pos += 2;
+            return;
+          }
+        }
+        token = std::string(1, c);
+        pos++;
+      }
+    }
+
+    bool accept(const char *t) {
+      if (token == t) {
+        next_token();
+        return true;
+      }
+      return false;
+    }
+
+    int parse_or() {
+      int lhs = parse_and();
+      while (accept("or")) lhs = add_node(OP_OR, lhs, parse_and());
+      return lhs;
+    }
+
+    int parse_and() {
+      int lhs = parse_not();
+      while (accept("and")) lhs = add_node(OP_AND, lhs, parse_not());
+      return lhs;
+    }
+
+    int parse_not() {
+      if (accept("not")) return add_node(OP_NOT, parse_not());
+      return parse_compare();
+    }
+
+    int parse_compare() {
+      static const char *ops[] = {"<", "<=", ">", ">=", "==", "!="};
+      static const op_type codes[] = {OP_LT, OP_LE, OP_GT, OP_GE, OP_EQ, OP_NE};
+      int lhs = parse_sum();
+      for (size_t i = 0; i < sizeof(ops) / sizeof(ops[0]); i++) {
+        if (accept(ops[i])) return add_node(codes[i], lhs, parse_sum());
+      }
+      return lhs;
+    }
+
+    int parse_sum() {
+      int lhs = parse_product();
+      while (true) {
+        if (accept("+")) lhs = add_node(OP_ADD, lhs, parse_product());
+        else if (accept("-")) lhs = add_node(OP_SUB, lhs, parse_product());
+        else return lhs;
+      }
+    }
+
+    int parse_product() {
+      int lhs = parse_unary();
+      while (true) {
+        if (accept("*")) lhs = add_node(OP_MUL, lhs, parse_unary());
+        else if (accept("/")) lhs = add_node(OP_DIV, lhs, parse_unary());
+        else return lhs;
+      }
+    }
+
+    int parse_unary() {
+      if (accept("-")) return add_node(OP_NEG, parse_unary());
+      if (accept("+")) return parse_unary();
+      return parse_power();
+    }
+
+    int parse_power() {
+      int lhs = parse_atom();
+      if (accept("**")) return add_node(OP_POW, lhs, parse_unary());
+      return lhs;
+    }
+
+    int parse_atom() {
+      if (token.empty()) {
+        fail("unexpected end of expression");
+        return add_node(OP_CONST);
+      }
+      if (accept("(")) {
+        int e = parse_or();
+        if (!accept(")")) fail("missing ')'");
+        return e;
+      }
+      if (isdigit(token[0]) || token[0] == '.') {
+        const double value = strtod(token.c_str(), NULL);
+        next_token();
+        return add_node(OP_CONST, -1, -1, value);
+      }
+      if (!isalpha(token[0]) && token[0] != '_') {
+        fail("unexpected '" + token + "'");
+        next_token();
+        return add_node(OP_CONST);
+      }
+
+      const std::string name = token;
+      next_token();
+      if (name == "src" || name == "target" || name == "edge") {
+        if (!accept(".")) {
+          fail("expected a field of " + name);
+          return add_node(OP_CONST);
+        }
+        const std::string field = token;
+        next_token();
+        const layout_type &layout = (name == "edge") ? *elayout : *vlayout;
+        layout_type::const_iterator it = layout.find(field);
+        if (it == layout.end()) {
+          fail("unknown field " + name + "." + field);
+          return add_node(OP_CONST);
+        }
+        int n = add_node(name == "src" ? OP_SRC : (name == "target" ? OP_TARGET : OP_EDGE));
+        nodes[n].field = it->second;
+        return n;
+      }
+      if (name == "numIn") return add_node(OP_NUM_IN);
+      if (name == "numOut") return add_node(OP_NUM_OUT);
+      if (name == "total") return add_node(OP_TOTAL);
+
+      static const char *functions[] = {"abs", "sqrt", "exp", "log", "min", "max", "pow"};
+      static const op_type codes[] = {OP_ABS, OP_SQRT, OP_EXP, OP_LOG, OP_MIN, OP_MAX, OP_POW};
+      for (size_t i = 0; i < sizeof(functions) / sizeof(functions[0]); i++) {
+        if (name != functions[i]) continue;
+        if (!accept("(")) {
+          fail("expected '(' after " + name);
+          return add_node(OP_CONST);
+        }
+        int lhs = parse_or();
+        int rhs = -1;
+        if (codes[i] == OP_MIN || codes[i] == OP_MAX || codes[i] == OP_POW) {
+          if (!accept(",")) fail(name + " takes two arguments");
+          rhs = parse_or();
+        }
+        if (!accept(")")) fail("missing ')' after the arguments of " + name);
+        return add_node(codes[i], lhs, rhs);
+      }
+
+      std::map<std::string, double>::const_iterator c = consts->find(name);
+      if (c == consts->end()) {
+        fail("unknown name " + name);
+        return add_node(OP_CONST);
+      }
+      return add_node(OP_CONST, -1, -1, c->second);
+    }
+};
+
+// Splits an apply assignment "field = expr", where the field may also be
+// written target.field.  Returns false when text is not an assignment.
+inline bool split_assignment(const std::string &text, std::string &field, std::string &expr) {
+  const size_t eq = text.find('=');
+  if (eq == std::string::npos || eq == 0 || text.compare(eq, 2, "==") == 0 ||
+      strchr("<>!", text[eq - 1]) != NULL) {
+    return false;
+  }
+  const size_t begin = text.find_first_not_of(" \t");
+  const size_t end = text.find_last_not_of(" \t", eq - 1);
+  if (begin >= eq || end == std::string::npos || end < begin) {
+    return false;
+  }
+  field = text.substr(begin, end - begin + 1);
+  if (field.compare(0, 7, "target.") == 0) {
+    field = field.substr(7);
+  }
+  expr = text.substr(eq + 1);
+  return !field.empty();
+}
+
+// How gathered values are combined.
+enum merge_type { MERGE_NONE, MERGE_SUM, MERGE_MIN, MERGE_MAX };
+
+// Accumulator of natively merged gathers, stored as the aggregator record.
+// count is 0 for an empty accumulator.
+struct accumulator_type {
+  double value;
+  double count;
+};
+
+inline void merge(const merge_type op, accumulator_type &acc, const accumulator_type &other) {
+  if (other.count == 0) return;
+  if (acc.count == 0) {
+    acc = other;
+    return;
+  }
+  switch (op) {
+    case MERGE_MIN: acc.value = std::min(acc.value, other.value); break;
+    case MERGE_MAX: acc.value = std::max(acc.value, other.value); break;
+    default: acc.value += other.value; break;
+  }
+  acc.count += other.count;
+}
+
+// The kernels declared by a user module.  Each part is optional; the bridge
+// falls back to the Python function for the parts that are missing.
+struct gas_kernels {
+  expression gather;
+  merge_type merge;
+  std::vector<std::pair<field_type, expression> > apply;  // target field assignments, in order
+  expression scatter;  // signals the target with this priority when positive
+  expression delta;    // posted to the target's cached gather
+
+  gas_kernels(): merge(MERGE_NONE) {}
+};
+
+} // namespace py_kernels
+
+#endif
@@ -24,10 +24,17 @@
 #include <string>
 #include <fstream>
 
+#include <unistd.h>
+#include <sys/wait.h>
+
 #include <graphlab.hpp>
+#include <graphlab/rpc/dc_init_from_env.hpp>
+#include <graphlab/macros_def.hpp>
 
 #include <Python.h>
 
+#include "native_kernels.hpp"
+
 #define PYFN_TRANSFORMVERTEX 0
 #define PYFN_TRANSFORMEDGE   1
 #define PYFN_SAVEVERTEX      2
@@ -46,6 +53,23 @@
 #define PYFN_LOADAGG         15
 #define PYFN_STOREAGG        16
 #define PYFN_PARSEEDGE       17
+#define PYFN_GATHERBATCH     18
+#define PYFN_PARSEEDGES      19
+#define PYFN_EDGEARRAYS      20
+#define PYFN_VERTEXSHARD     21
+#define PYFN_JOINSHARDS      22
+#define PYFN_NEWOBJ          23
+#define PYFN_STOREOBJ        24
+#define PYFN_LOADOBJ         25
+#define PYFN_COMBINE         26
+#define PYFN_SHOULDSCATTER   27
+#define PYFN_SCATTERBATCH    28
+#define PYFN_GRAPHCACHEKEY   29
+#define PYFN_SAVEVERTEXSHARD 30
+#define PYFN_SAVEEDGESHARD   31
+#define PYFN_VERTEXSHARDVALUES 32
+#define PYFN_EDGESHARDVALUES 33
+#define PYFN_SHARDFORMAT     34
 
 struct {
   const char *fn_name;
@@ -54,155 +78,642 @@ struct {
            {"gatherAgg", NULL}, {"gather", NULL}, {"apply", NULL}, {"scatter", NULL},
            {"newEdge", NULL}, {"loadEdge", NULL}, {"storeEdge", NULL},
            {"newVertex", NULL}, {"loadVertex", NULL}, {"storeVertex", NULL},
-           {"newAgg", NULL}, {"loadAgg", NULL}, {"storeAgg", NULL}, {"parseEdge", NULL}};
+           {"newAgg", NULL}, {"loadAgg", NULL}, {"storeAgg", NULL}, {"parseEdge", NULL},
+           {"gatherBatch", NULL}, {"parseEdges", NULL},
+           {"edgeArrays", NULL}, {"vertexShard", NULL}, {"joinVertexShards", NULL},
+           {"newObj", NULL}, {"storeObj", NULL}, {"loadObj", NULL}, {"combine", NULL},
+           {"shouldScatter", NULL}, {"scatterBatch", NULL}, {"graphCacheKey", NULL},
+           {"saveVertexShard", NULL}, {"saveEdgeShard", NULL},
+           {"vertexShardValues", NULL}, {"edgeShardValues", NULL}, {"shardFormat", NULL}};
 
 #define PYFN_SIZE  (sizeof(PyFn)/sizeof(PyFn[0]))
 
 PyObject *func_initusermodule;
 bool has_edgeclass = false;
+bool has_gather_batch = false;
+bool has_should_scatter = false;
+bool has_scatter_batch = false;
+bool has_parse_edges = false;
+py_kernels::gas_kernels kernels;  // native parts of the vertex program, see init_kernels
+size_t parse_block_size = 64 << 20;  // bytes of text handed to parseEdges per call
+std::string graph_cache_dir;  // snapshots of parsed graphs, see set_graph_cache
+
+// Call counts and times of the PyFn[] functions, indexed like PyFn, and of
+// GIL acquisitions.  Times are in rdtsc ticks.  They are only updated while
+// holding the GIL, which already serializes every Python call.
+struct pyfn_profile_type {
+  size_t calls;
+  unsigned long long ticks;           // spent inside the function
+  unsigned long long gil_wait_ticks;  // spent acquiring the GIL for the call
+} pyfn_profile[PYFN_SIZE];
 
-#ifndef PYSHARED_LIB
+struct {
+  size_t acquisitions;
+  unsigned long long wait_ticks;
+} gil_profile;
+
+// GIL wait of the calling thread not yet charged to a PyFn call
+__thread unsigned long long pending_gil_wait = 0;
+
+// Holds the GIL for the lifetime of the object.  Every call into Python goes
+// through one, engine worker threads included.
 class PythonThreadLocker {
 private:  
   PyGILState_STATE state;
 public:
-  PythonThreadLocker() : state(PyGILState_Ensure()) {}
+  PythonThreadLocker() {
+    const unsigned long long start = graphlab::rdtsc();
+    state = PyGILState_Ensure();
+    if (state == PyGILState_UNLOCKED) {
+      const unsigned long long wait = graphlab::rdtsc() - start;
+      gil_profile.acquisitions++;
+      gil_profile.wait_ticks += wait;
+      pending_gil_wait += wait;
+    }
+  }
   ~PythonThreadLocker() { PyGILState_Release(state); }
 };
+
+// Calls PyFn[index] with pArgs (NULL for no arguments) and records it in
+// pyfn_profile.  Returns a new reference.  The caller must hold the GIL.
+inline PyObject *call_pyfn(const int index, PyObject *pArgs) {
+  const unsigned long long start = graphlab::rdtsc();
+  PyObject *pValue = (pArgs == NULL) ? PyObject_CallObject(PyFn[index].fn, NULL)
+                                     : PyObject_Call(PyFn[index].fn, pArgs, NULL);
+  pyfn_profile[index].calls++;
+  pyfn_profile[index].ticks += graphlab::rdtsc() - start;
+  pyfn_profile[index].gil_wait_ticks += pending_gil_wait;
+  pending_gil_wait = 0;
+  return pValue;
+}
+
+// Argument tuples of the per-edge callbacks are reused by each thread instead
+// of being allocated per call.  A tuple is only reused when the callee kept no
+// reference to it, and its items are released after every call.
+#define MAX_REUSED_ARGS 6
+__thread PyObject *reused_args[MAX_REUSED_ARGS];
+
+// Returns an empty tuple of size n to be filled with PyTuple_SET_ITEM.  The
+// caller must hold the GIL and hand the tuple back to release_args.
+inline PyObject *take_args(const Py_ssize_t n) {
+  PyObject *pArgs = reused_args[n];
+  if (pArgs != NULL) {
+    reused_args[n] = NULL;
+    return pArgs;
+  }
+  return PyTuple_New(n);
+}
+
+inline void release_args(PyObject *pArgs) {
+  const Py_ssize_t n = PyTuple_GET_SIZE(pArgs);
+  if (Py_REFCNT(pArgs) != 1 || reused_args[n] != NULL) {
+    Py_DECREF(pArgs);
+    return;
+  }
+  for (Py_ssize_t i = 0; i < n; i++) {
+    PyObject *item = PyTuple_GET_ITEM(pArgs, i);
+    PyTuple_SET_ITEM(pArgs, i, NULL);
+    Py_XDECREF(item);
+  }
+  reused_args[n] = pArgs;
+}
+
+// Vertex degrees are passed to Python as ints; those below MAX_CACHED_DEGREE
+// are created once in init_python.
+#define MAX_CACHED_DEGREE 4096
+PyObject *cached_degrees[MAX_CACHED_DEGREE];
+
+// Returns a new reference to the int d.  The caller must hold the GIL.
+inline PyObject *degree_int(const size_t d) {
+  if (d < MAX_CACHED_DEGREE && cached_degrees[d] != NULL) {
+    Py_INCREF(cached_degrees[d]);
+    return cached_degrees[d];
+  }
+  return PyInt_FromSize_t(d);
+}
+
+// Releases the GIL held by the calling interpreter while the engine, graph
+// loading or saving runs, so that worker threads can take it in turn.  In
+// py_graphlab_exec the main thread does not hold the GIL and this is a no-op.
+class PythonThreadUnlocker {
+#ifdef PYSHARED_LIB
+private:
+  PyThreadState *state;
+public:
+  PythonThreadUnlocker() : state(PyEval_SaveThread()) {}
+  ~PythonThreadUnlocker() { PyEval_RestoreThread(state); }
 #endif
+};
+
+PyObject *np_frombuffer = NULL;  // numpy.frombuffer and numpy.array, loaded only for typed records
+PyObject *np_array = NULL;
 
 template<int newmethod_index, int storemethod_index, int loadmethod_index>
 class pyobj_class {
   public:
     PyObject *obj;
-
-    pyobj_class() {
-#ifndef PYSHARED_LIB
+    char *record;  // fixed size C++ record, used instead of obj when a dtype is declared
+
+    // Typed storage declared by the user module through vertexDtype/edgeDtype.
+    // record_size is 0 when the values are kept as pickled Python objects.
+    static size_t record_size;
+    static PyObject *record_dtype;
+
+    // Set on a master vertex whose apply left the data unchanged, until the
+    // engine has sent the data to the mirrors.  Such a value is saved as a
+    // marker which loads with keep set, and assigning a value with keep set
+    // leaves the target as it is, so unchanged vertices are neither encoded
+    // nor overwritten on the mirrors.
+    mutable bool unchanged;
+    bool keep;
+
+    pyobj_class(): obj(NULL), record(NULL), unchanged(false), keep(false) {
+      if (record_size > 0) {
+        record = (char *)calloc(1, record_size);
+        return;
+      }
       PythonThreadLocker locker;
-#endif
-      obj = PyObject_CallObject(PyFn[newmethod_index].fn, NULL);
+      obj = call_pyfn(newmethod_index, NULL);
     }
 
-    pyobj_class(PyObject *no): obj(no) {}
+    // Steals the reference to no, as set() does.
+    pyobj_class(PyObject *no): obj(no), record(NULL), unchanged(false), keep(false) {
+      if (record_size > 0) {
+        record = (char *)calloc(1, record_size);
+        obj = NULL;
+        PythonThreadLocker locker;
+        pack(no);
+        Py_XDECREF(no);
+      }
+    }
 
     ~pyobj_class() {
-#ifndef PYSHARED_LIB
+      if (record != NULL) {
+        free(record);
+        record = NULL;
+        return;
+      }
       PythonThreadLocker locker;
-#endif
       Py_XDECREF(obj);
       obj = NULL;
     }
 
-    pyobj_class(const pyobj_class &o) {
-#ifndef PYSHARED_LIB
+    pyobj_class(const pyobj_class &o): obj(NULL), record(NULL), unchanged(o.unchanged), keep(o.keep) {
+      if (o.record != NULL) {
+        record = (char *)malloc(record_size);
+        memcpy(record, o.record, record_size);
+        return;
+      }
       PythonThreadLocker locker;
-#endif
       obj = o.obj;
       Py_XINCREF(obj);
     }
 
     void operator=(const pyobj_class &o) {
-#ifndef PYSHARED_LIB
+      if (o.keep) {
+        return;
+      }
+      if (o.record != NULL) {
+        if (record == NULL) {
+          record = (char *)malloc(record_size);
+        }
+        memcpy(record, o.record, record_size);
+        return;
+      }
       PythonThreadLocker locker;
-#endif
       Py_XDECREF(obj);
       obj = o.obj;
       Py_XINCREF(obj);
     }
 
+    // Returns a new reference to the value for passing into Python.  Typed
+    // records are handed out as numpy.record copies that own their bytes, so
+    // Python may keep them (or their subarray fields) beyond the call and the
+    // engines may move or free the C++ storage meanwhile.  The caller must
+    // hold the GIL.
+    PyObject *get() const {
+      if (record != NULL) {
+        PyObject *buf = PyByteArray_FromStringAndSize((const char *)record, record_size);
+        if (buf == NULL) {
+          PyErr_Print();
+          Py_RETURN_NONE;
+        }
+        PyObject *arr = PyObject_CallFunctionObjArgs(np_frombuffer, buf, record_dtype, NULL);
+        Py_DECREF(buf);
+        if (arr == NULL) {
+          PyErr_Print();
+          Py_RETURN_NONE;
+        }
+        PyObject *copy = PySequence_GetItem(arr, 0);
+        Py_DECREF(arr);
+        return copy;
+      }
+
+      PyObject *o = (obj == NULL) ? Py_None : obj;
+      Py_INCREF(o);
+      return o;
+    }
+
+    // Replaces the value with o and steals the reference.  The caller must
+    // hold the GIL.
+    void set(PyObject *o) {
+      if (record != NULL) {
+        pack(o);
+        Py_XDECREF(o);
+        return;
+      }
+      Py_XDECREF(obj);
+      obj = o;
+    }
+
     void save(graphlab::oarchive &oarc) const {
-#ifndef PYSHARED_LIB
+      if (record != NULL) {
+        oarc << unchanged;
+        if (!unchanged) {
+          oarc.write(record, record_size);
+        }
+        return;
+      }
+
+      // Pickled values are length prefixed so that binary pickle protocols
+      // and user encoders may return arbitrary bytes.
+      if (obj == NULL || unchanged) {
+        oarc << false << unchanged;
+        return;
+      }
       PythonThreadLocker locker;
-#endif
-     
-      if (obj == NULL) {
-        oarc << std::string("<Py_None>"); 
-      } else {
-        Py_XINCREF(obj); // we want to keep ownership, prevent SetItem from stealing
-        PyObject *pArgs = PyTuple_New(1);
-        PyTuple_SetItem(pArgs, 0, obj);       
 
-        PyObject *pValue = PyObject_CallObject(PyFn[storemethod_index].fn, pArgs);
-        Py_DECREF(pArgs);
+      Py_XINCREF(obj); // we want to keep ownership, prevent SetItem from stealing
+      PyObject *pArgs = PyTuple_New(1);
+      PyTuple_SetItem(pArgs, 0, obj);
 
-        if (PyErr_Occurred()) {
-          PyErr_Print();
-        }
+      PyObject *pValue = call_pyfn(storemethod_index, pArgs);
+      Py_DECREF(pArgs);
 
-        oarc << std::string(PyString_AsString(pValue));
-        Py_DECREF(pValue);
-      }     
+      // any object exporting a buffer is written without an intermediate copy
+      const void *data;
+      Py_ssize_t len;
+      if (pValue == NULL || PyObject_AsReadBuffer(pValue, &data, &len) != 0) {
+        PyErr_Print();
+        logstream(LOG_ERROR) << "Python function " << PyFn[storemethod_index].fn_name
+                             << " did not return a buffer" << std::endl;
+        oarc << false;
+      } else {
+        oarc << true << size_t(len);
+        oarc.write((const char *)data, len);
+      }
+      Py_XDECREF(pValue);
     }
 
     void load(graphlab::iarchive &iarc) {
-#ifndef PYSHARED_LIB
+      unchanged = false;
+      if (record != NULL) {
+        iarc >> keep;
+        if (!keep) {
+          iarc.read(record, record_size);
+        }
+        return;
+      }
+
+      bool has_value;
+      iarc >> has_value;
+      if (!has_value) {
+        iarc >> keep;
+        if (!keep) {
+          PythonThreadLocker locker;
+          Py_XDECREF(obj);
+          obj = NULL;
+        }
+        return;
+      }
+      keep = false;
       PythonThreadLocker locker;
-#endif
 
-      std::string s;
-      iarc >> s;
-      
-      if (s == "<Py_None>") {
-        Py_XDECREF(obj);
-        obj = NULL;
-      } else {
-        PyObject *pArgs = PyTuple_New(1);
-        PyTuple_SetItem(pArgs, 0, PyString_FromString(s.c_str()));
-        PyObject *pValue = PyObject_CallObject(PyFn[loadmethod_index].fn, pArgs);
-        if (PyErr_Occurred()) {
-          PyErr_Print();
+      size_t len;
+      iarc >> len;
+      // read straight into the string handed to the load function
+      PyObject *s = PyString_FromStringAndSize(NULL, len);
+      iarc.read(PyString_AS_STRING(s), len);
+
+      PyObject *pArgs = PyTuple_New(1);
+      PyTuple_SetItem(pArgs, 0, s);
+      PyObject *pValue = call_pyfn(loadmethod_index, pArgs);
+      if (PyErr_Occurred()) {
+        PyErr_Print();
+      }
+
+      Py_XDECREF(obj);
+      obj = pValue;
+      Py_DECREF(pArgs);
+    }
+
+  private:
+    // Copies o into the record.  o may be a numpy.record such as the copies
+    // handed out by get(), any object exposing record_size bytes, or a tuple
+    // of field values.  None leaves the record unchanged.
+    void pack(PyObject *o) {
+      if (o == NULL || o == Py_None) {
+        return;
+      }
+
+      const void *data;
+      Py_ssize_t len;
+      if (PyObject_AsReadBuffer(o, &data, &len) == 0 && (size_t)len == record_size) {
+        if (data != record) {
+          memcpy(record, data, record_size);
         }
+        return;
+      }
+      PyErr_Clear();
 
-        Py_XDECREF(obj);
-        obj = pValue;
-        Py_DECREF(pArgs);
+      PyObject *arr = PyObject_CallFunctionObjArgs(np_array, o, record_dtype, NULL);
+      if (arr == NULL || PyObject_AsReadBuffer(arr, &data, &len) != 0 || (size_t)len != record_size) {
+        PyErr_Print();
+        logstream(LOG_ERROR) << "Cannot convert python value into a " << record_size << " byte record" << std::endl;
+      } else {
+        memcpy(record, data, record_size);
       }
+      Py_XDECREF(arr);
     }
 };
 
+template<int newmethod_index, int storemethod_index, int loadmethod_index>
+size_t pyobj_class<newmethod_index, storemethod_index, loadmethod_index>::record_size = 0;
+template<int newmethod_index, int storemethod_index, int loadmethod_index>
+PyObject *pyobj_class<newmethod_index, storemethod_index, loadmethod_index>::record_dtype = NULL;
+
+typedef pyobj_class<PYFN_NEWVERTEX, PYFN_STOREVERTEX, PYFN_LOADVERTEX> vertex_data_type;
+typedef pyobj_class<PYFN_NEWEDGE, PYFN_STOREEDGE, PYFN_LOADEDGE> edge_data_type;
+
+// Arguments collected for a single gather_batch call.  The neighbour and edge
+// pointers hold references which are released when the batch is flushed or
+// destroyed.
+struct gather_batch_type {
+  const vertex_data_type *target;  // vertex being gathered, passed to gather_batch on flush
+  std::vector<PyObject*> neighbors;
+  std::vector<PyObject*> edges;
+  std::vector<long> degrees;  // (numIn, numOut) pairs of the neighbours
+};
+
 class agg_class: public pyobj_class<PYFN_NEWAGG, PYFN_STOREAGG, PYFN_LOADAGG> {
   public:
-    agg_class(): pyobj_class() {}
-    agg_class(PyObject *no): pyobj_class(no) {}
+    // Neighbours gathered for the user's gather_batch hook.  Non NULL only
+    // while a vertex is being gathered, see flush().
+    gather_batch_type *batch;
+
+    agg_class(): pyobj_class(), batch(NULL) {}
+    agg_class(PyObject *no): pyobj_class(no), batch(NULL) {}
+
+    // With a native merge kernel the record holds a py_kernels::accumulator_type
+    // and aggregators are built and combined without Python.
+    static bool native() {
+      return kernels.merge != py_kernels::MERGE_NONE;
+    }
+
+    static agg_class from_value(const double value) {
+      agg_class a;
+      a.accumulator().value = value;
+      a.accumulator().count = 1;
+      return a;
+    }
+
+    py_kernels::accumulator_type &accumulator() const {
+      return *(py_kernels::accumulator_type *)record;
+    }
+
+    // Returns a new reference to the accumulated value as a float, None when
+    // nothing was gathered.  The caller must hold the GIL.
+    PyObject *value() const {
+      if (accumulator().count == 0) {
+        Py_RETURN_NONE;
+      }
+      return PyFloat_FromDouble(accumulator().value);
+    }
+
+    // steals the references to neighbor and edge
+    agg_class(const vertex_data_type *target, PyObject *neighbor, PyObject *edge, long num_in, long num_out):
+      pyobj_class(NULL), batch(new gather_batch_type) {
+      batch->target = target;
+      batch->neighbors.push_back(neighbor);
+      batch->edges.push_back(edge);
+      batch->degrees.push_back(num_in);
+      batch->degrees.push_back(num_out);
+    }
+
+    agg_class(const agg_class &o): pyobj_class(o), batch(NULL) {
+      copy_batch(o);
+    }
+
+    ~agg_class() {
+      clear_batch();
+    }
+
+    void operator=(const agg_class &o) {
+      pyobj_class::operator=(o);
+      clear_batch();
+      copy_batch(o);
+    }
 
     void operator+=(const agg_class& r) {
-#ifndef PYSHARED_LIB
+      if (record != NULL) {
+        py_kernels::merge(kernels.merge, accumulator(), r.accumulator());
+        return;
+      }
       PythonThreadLocker locker;
-#endif
 
-      Py_INCREF(r.obj);  // incref only r.obj and not obj, becuse we'll assign pValue to obj later, prevent SetItem only from stealing r.obj
-      PyObject *pArgs = PyTuple_New(2);
-      PyTuple_SetItem(pArgs, 0, obj);      
-      PyTuple_SetItem(pArgs, 1, r.obj);
+      if (batch != NULL && r.batch != NULL && batch->target == r.batch->target) {
+        // both sides are still collecting neighbours of the same vertex
+        for (size_t i = 0; i < r.batch->neighbors.size(); i++) {
+          Py_INCREF(r.batch->neighbors[i]);
+          Py_INCREF(r.batch->edges[i]);
+          batch->neighbors.push_back(r.batch->neighbors[i]);
+          batch->edges.push_back(r.batch->edges[i]);
+        }
+        batch->degrees.insert(batch->degrees.end(), r.batch->degrees.begin(), r.batch->degrees.end());
+        return;
+      }
 
-      obj = PyObject_CallObject(PyFn[PYFN_GATHERAGG].fn, pArgs);
+      flush();
+      const_cast<agg_class&>(r).flush();
+      merge(r.obj);
+    }
+
+    // Turns the collected neighbours into an aggregator with one call to
+    // gather_batch and merges it into obj.
+    void flush() {
+      if (batch == NULL) {
+        return;
+      }
+      PythonThreadLocker locker;
+
+      const size_t n = batch->neighbors.size();
+      PyObject *neighbors = PyList_New(n);
+      PyObject *edges = PyList_New(n);
+      for (size_t i = 0; i < n; i++) {  // the lists steal the references held by the batch
+        PyList_SET_ITEM(neighbors, i, batch->neighbors[i]);
+        PyList_SET_ITEM(edges, i, batch->edges[i]);
+      }
+
+      PyObject *pArgs = PyTuple_New(4);
+      PyTuple_SetItem(pArgs, 0, batch->target->get());
+      PyTuple_SetItem(pArgs, 1, neighbors);
+      PyTuple_SetItem(pArgs, 2, edges);
+      PyTuple_SetItem(pArgs, 3, PyString_FromStringAndSize((const char *)&batch->degrees[0],
+                                                           batch->degrees.size() * sizeof(long)));
+      delete batch;
+      batch = NULL;
+
+      PyObject *pValue = call_pyfn(PYFN_GATHERBATCH, pArgs);
       Py_DECREF(pArgs);
       if (PyErr_Occurred()) {
         PyErr_Print();
       }
 
+      merge(pValue);
+      Py_XDECREF(pValue);
+    }
+
+    void save(graphlab::oarchive &oarc) const {
+      const_cast<agg_class*>(this)->flush();
+      pyobj_class::save(oarc);
+    }
+
+  private:
+    // merges other into obj, the caller must hold the GIL
+    void merge(PyObject *other) {
+      if (other == NULL) {
+        return;
+      }
+      if (obj == NULL) {
+        Py_INCREF(other);
+        obj = other;
+        return;
+      }
+
+      Py_INCREF(other);  // incref only other and not obj, becuse we'll assign pValue to obj later, prevent SetItem only from stealing other
+      PyObject *pArgs = take_args(2);
+      PyTuple_SET_ITEM(pArgs, 0, obj);
+      PyTuple_SET_ITEM(pArgs, 1, other);
+
+      obj = call_pyfn(PYFN_GATHERAGG, pArgs);
+      release_args(pArgs);
+      if (PyErr_Occurred()) {
+        PyErr_Print();
+      }
+    }
+
+    void copy_batch(const agg_class &o) {
+      if (o.batch == NULL) {
+        return;
+      }
+      PythonThreadLocker locker;
+      batch = new gather_batch_type(*o.batch);
+      for (size_t i = 0; i < batch->neighbors.size(); i++) {
+        Py_INCREF(batch->neighbors[i]);
+        Py_INCREF(batch->edges[i]);
+      }
+    }
+
+    void clear_batch() {
+      if (batch == NULL) {
+        return;
+      }
+      PythonThreadLocker locker;
+      for (size_t i = 0; i < batch->neighbors.size(); i++) {
+        Py_DECREF(batch->neighbors[i]);
+        Py_DECREF(batch->edges[i]);
+      }
+      delete batch;
+      batch = NULL;
+    }
+};
+
+// Result of map-reduce and aggregator functions: any picklable Python value,
+// combined with wrappers.combine (a + b, None being the identity).
+class reduce_class : public pyobj_class<PYFN_NEWOBJ, PYFN_STOREOBJ, PYFN_LOADOBJ> {
+  public:
+    reduce_class() {}
+
+    reduce_class(PyObject *no): pyobj_class(no) {}
+
+    void operator+=(const reduce_class& r) {
+      PythonThreadLocker locker;
+      PyObject *pArgs = PyTuple_New(2);
+      PyTuple_SetItem(pArgs, 0, get());
+      PyTuple_SetItem(pArgs, 1, r.get());
+      PyObject *pValue = call_pyfn(PYFN_COMBINE, pArgs);
+      Py_DECREF(pArgs);
+      if (pValue == NULL) {
+        PyErr_Print();
+        return;
+      }
+      set(pValue);
     }
 };
 
-typedef pyobj_class<PYFN_NEWVERTEX, PYFN_STOREVERTEX, PYFN_LOADVERTEX> vertex_data_type;
-typedef pyobj_class<PYFN_NEWEDGE, PYFN_STOREEDGE, PYFN_LOADEDGE> edge_data_type;
 typedef graphlab::distributed_graph<vertex_data_type, edge_data_type> graph_type;
 
 graph_type *graph;
 graphlab::distributed_control *dc;
 bool graph_initialized = false;
 bool dc_initialized = false;
+bool mpi_initialized = false;
+size_t num_threads = 1;  // engine and loader worker threads per process
+graphlab::graphlab_options py_opts;  // scheduler, engine and graph options from the command line
+PyObject *module_engine_options = NULL;  // engineOptions dict of the user module
+std::vector<size_t> iteration_active;  // applies per synchronous iteration on this machine
+graphlab::simple_spinlock iteration_active_lock;
+// vertices signaled through signal_vertices/signal_where for the next gas_graph
+std::vector<std::pair<graphlab::vertex_set, double> > pending_signals;
 graphlab::edge_dir_type gather_edges_dir = graphlab::IN_EDGES, scatter_edges_dir = graphlab::OUT_EDGES;
 
+// An aggregator run periodically during gas_graph, registered through
+// add_aggregator or the aggregators list of the user module.
+struct py_aggregator_type {
+  std::string name;
+  bool edges;             // map over edges instead of vertices
+  PyObject *map_fn;       // map(vertexData) or map(srcData, targetData, edgeData)
+  PyObject *finalize_fn;  // finalize(total), stops the engine when it returns True
+  float period;           // seconds between runs
+  PyObject *history;      // list of (iteration, total) of the current run
+};
+std::vector<py_aggregator_type> py_aggregators;
+
+// Calls fn on the vertex data, or on the data of both endpoints and of the
+// edge, and returns the result for reduction.
+reduce_class map_vertex_data(PyObject *fn, const graph_type::vertex_type &vertex) {
+  PythonThreadLocker locker;
+  PyObject *pArgs = PyTuple_New(1);
+  PyTuple_SetItem(pArgs, 0, vertex.data().get());
+  PyObject *pValue = PyObject_CallObject(fn, pArgs);
+  Py_DECREF(pArgs);
+  if (pValue == NULL) {
+    PyErr_Print();
+  }
+  return reduce_class(pValue);
+}
+
+reduce_class map_edge_data(PyObject *fn, const graph_type::edge_type &edge) {
+  PythonThreadLocker locker;
+  PyObject *pArgs = PyTuple_New(3);
+  PyTuple_SetItem(pArgs, 0, edge.source().data().get());
+  PyTuple_SetItem(pArgs, 1, edge.target().data().get());
+  PyTuple_SetItem(pArgs, 2, edge.data().get());
+  PyObject *pValue = PyObject_CallObject(fn, pArgs);
+  Py_DECREF(pArgs);
+  if (pValue == NULL) {
+    PyErr_Print();
+  }
+  return reduce_class(pValue);
+}
+
 
 void transform_vertex(graph_type::vertex_type& vertex) { 
-#ifndef PYSHARED_LIB
   PythonThreadLocker locker;
-#endif
 
-  PyObject *pArgs = PyTuple_New(1);  // do not incref, obj will be overwritten
-  PyTuple_SetItem(pArgs, 0, vertex.data().obj); 
-  vertex.data().obj = PyObject_CallObject(PyFn[PYFN_TRANSFORMVERTEX].fn, pArgs);
+  PyObject *pArgs = PyTuple_New(1);
+  PyTuple_SetItem(pArgs, 0, vertex.data().get());
+  vertex.data().set(call_pyfn(PYFN_TRANSFORMVERTEX, pArgs));
   Py_DECREF(pArgs);
   if (PyErr_Occurred()) {
     PyErr_Print();
@@ -210,13 +721,11 @@ void transform_vertex(graph_type::vertex_type& vertex) {
 }
 
 void transform_edge(graph_type::edge_type& edge) {
-#ifndef PYSHARED_LIB
   PythonThreadLocker locker;
-#endif
 
-  PyObject *pArgs = PyTuple_New(1);  // do not incref, obj will be overwritten
-  PyTuple_SetItem(pArgs, 0, edge.data().obj);
-  edge.data().obj = PyObject_CallObject(PyFn[PYFN_TRANSFORMEDGE].fn, pArgs);
+  PyObject *pArgs = PyTuple_New(1);
+  PyTuple_SetItem(pArgs, 0, edge.data().get());
+  edge.data().set(call_pyfn(PYFN_TRANSFORMEDGE, pArgs));
   Py_DECREF(pArgs);
   if (PyErr_Occurred()) {
     PyErr_Print();
@@ -227,51 +736,113 @@ class python_interface:
   public graphlab::ivertex_program<graph_type, agg_class, graphlab::messages::sum_priority>,
   public graphlab::IS_POD_TYPE {
 public:
-  agg_class gather(icontext_type& context, const vertex_type& vertex, edge_type& edge) const {
-#ifndef PYSHARED_LIB
-    PythonThreadLocker locker;
-#endif    
+  python_interface(): scattered(false) {}
 
+  agg_class gather(icontext_type& context, const vertex_type& vertex, edge_type& edge) const {
     vertex_type other_vertex = (edge.source().id() == vertex.id()) ? edge.target() : edge.source();
 
-    Py_XINCREF(other_vertex.data().obj);  // prevent SetItem from stealing references
-    Py_XINCREF(vertex.data().obj);
-    PyObject *edgedata_arg = (edge.data().obj == NULL) ? Py_None : edge.data().obj;
-    Py_XINCREF(edgedata_arg);
+    if (!kernels.gather.empty()) {
+      const py_kernels::kernel_args args = {other_vertex.data().record, vertex.data().record, edge.data().record,
+                                            double(other_vertex.num_in_edges()),
+                                            double(other_vertex.num_out_edges()), 0.0};
+      return agg_class::from_value(kernels.gather.eval(args));
+    }
 
-    PyObject *pArgs = PyTuple_New(5);
-    PyTuple_SetItem(pArgs, 0, other_vertex.data().obj);
-    PyTuple_SetItem(pArgs, 1, vertex.data().obj);
-    PyTuple_SetItem(pArgs, 2, edgedata_arg);
-    PyTuple_SetItem(pArgs, 3, PyInt_FromLong(other_vertex.num_in_edges()));
-    PyTuple_SetItem(pArgs, 4, PyInt_FromLong(other_vertex.num_out_edges()));
+    PythonThreadLocker locker;
 
-    PyObject *pValue = PyObject_CallObject(PyFn[PYFN_GATHER].fn, pArgs);
-    Py_DECREF(pArgs);
+    if (has_gather_batch) {
+      // only collect the neighbour, gather_batch runs once per vertex in flush()
+      return agg_class(&vertex.data(), other_vertex.data().get(), edge.data().get(),
+                       other_vertex.num_in_edges(), other_vertex.num_out_edges());
+    }
+
+    PyObject *pArgs = take_args(5);
+    PyTuple_SET_ITEM(pArgs, 0, other_vertex.data().get());
+    PyTuple_SET_ITEM(pArgs, 1, vertex.data().get());
+    PyTuple_SET_ITEM(pArgs, 2, edge.data().get());
+    PyTuple_SET_ITEM(pArgs, 3, degree_int(other_vertex.num_in_edges()));
+    PyTuple_SET_ITEM(pArgs, 4, degree_int(other_vertex.num_out_edges()));
+
+    PyObject *pValue = call_pyfn(PYFN_GATHER, pArgs);
+    release_args(pArgs);
     if (PyErr_Occurred()) {
       PyErr_Print();
     }
-    
+
+    if (agg_class::native()) {  // gather returns a float
+      const double value = pValue == NULL ? 0.0 : PyFloat_AsDouble(pValue);
+      Py_XDECREF(pValue);
+      return agg_class::from_value(value);
+    }
     return agg_class(pValue);
   }
 
+  void post_local_gather(gather_type& total) const {
+    total.flush();
+  }
+
   void apply(icontext_type& context, vertex_type& vertex, const gather_type& total) {
-#ifndef PYSHARED_LIB
+    // the asynchronous engine has no iterations
+    if (context.iteration() >= 0) {
+      iteration_active_lock.lock();
+      if (iteration_active.size() <= (size_t)context.iteration()) {
+        iteration_active.resize(context.iteration() + 1, 0);
+      }
+      iteration_active[context.iteration()]++;
+      iteration_active_lock.unlock();
+    }
+
+    // Unchanged data is not sent to the mirrors, see pyobj_class::unchanged.
+    // Typed records are compared with their value before apply.
+    vertex_data_type &data = vertex.data();
+    std::vector<char> before;
+    if (data.record != NULL) {
+      before.assign(data.record, data.record + vertex_data_type::record_size);
+    }
+
+    if (!kernels.apply.empty()) {
+      const py_kernels::kernel_args args = {data.record, data.record, NULL, double(vertex.num_in_edges()),
+                                            double(vertex.num_out_edges()), total.accumulator().value};
+      // in order, later assignments see the fields written by earlier ones
+      for (size_t i = 0; i < kernels.apply.size(); i++) {
+        py_kernels::write_field(data.record, kernels.apply[i].first, kernels.apply[i].second.eval(args));
+      }
+      data.unchanged = memcmp(data.record, &before[0], before.size()) == 0;
+      return;
+    }
+
     PythonThreadLocker locker;
-#endif    
 
-    Py_INCREF(total.obj);  // prevent SetItem from stealing total.obj, vertex.obj will be overwriiten
-    PyObject *pArgs = PyTuple_New(4);
-    PyTuple_SetItem(pArgs, 0, vertex.data().obj);
-    PyTuple_SetItem(pArgs, 1, total.obj);
-    PyTuple_SetItem(pArgs, 2, PyInt_FromLong(vertex.num_in_edges()));
-    PyTuple_SetItem(pArgs, 3, PyInt_FromLong(vertex.num_out_edges()));
+    const_cast<gather_type&>(total).flush();  // engines without post_local_gather
 
-    vertex.data().obj = PyObject_CallObject(PyFn[PYFN_APPLY].fn, pArgs);
-    Py_DECREF(pArgs);
+    PyObject *target = data.get();
+    PyObject *pArgs = take_args(4);
+    Py_INCREF(target);
+    PyTuple_SET_ITEM(pArgs, 0, target);
+    PyTuple_SET_ITEM(pArgs, 1, agg_class::native() ? total.value() : total.get());
+    PyTuple_SET_ITEM(pArgs, 2, degree_int(vertex.num_in_edges()));
+    PyTuple_SET_ITEM(pArgs, 3, degree_int(vertex.num_out_edges()));
+
+    PyObject *pValue = call_pyfn(PYFN_APPLY, pArgs);
+    release_args(pArgs);
     if (PyErr_Occurred()) {
       PyErr_Print();
     }
+
+    // returning None keeps the data; a typed record may still have been
+    // modified in place, which is copied back from the record passed in
+    const bool returned_none = pValue == Py_None;
+    if (returned_none) {
+      Py_DECREF(pValue);
+      if (data.record != NULL) {
+        Py_INCREF(target);
+        data.set(target);
+      }
+    } else {
+      data.set(pValue);
+    }
+    Py_DECREF(target);
+    data.unchanged = data.record != NULL ? memcmp(data.record, &before[0], before.size()) == 0 : returned_none;
   }
 
   edge_dir_type gather_edges(icontext_type &context, const vertex_type &vertex) const {
@@ -279,31 +850,64 @@ public:
   };
 
   edge_dir_type scatter_edges(icontext_type &context, const vertex_type &vertex) const {
+    // the engines have sent the data applied on this master to its mirrors
+    vertex.data().unchanged = false;
+
+    if (has_should_scatter && scatter_edges_dir != graphlab::NO_EDGES) {
+      PythonThreadLocker locker;
+      PyObject *pArgs = take_args(1);
+      PyTuple_SET_ITEM(pArgs, 0, vertex.data().get());
+      PyObject *pValue = call_pyfn(PYFN_SHOULDSCATTER, pArgs);
+      release_args(pArgs);
+      if (pValue == NULL) {
+        PyErr_Print();
+      }
+      const bool skip = pValue != NULL && !PyObject_IsTrue(pValue);
+      Py_XDECREF(pValue);
+      if (skip) {
+        return graphlab::NO_EDGES;
+      }
+    }
     return scatter_edges_dir;
   };
 
   void scatter(icontext_type& context, const vertex_type& vertex, edge_type& edge) const {
-#ifndef PYSHARED_LIB
-    PythonThreadLocker locker;
-#endif    
-
     vertex_type other_vertex = (edge.source().id() == vertex.id()) ? edge.target() : edge.source();
 
-    Py_XINCREF(other_vertex.data().obj);  // prevent SetItem from stealing references
-    Py_XINCREF(vertex.data().obj);
-    PyObject *edgedata_arg = (edge.data().obj == NULL) ? Py_None : edge.data().obj;
-    Py_XINCREF(edgedata_arg);
+    if (!kernels.scatter.empty()) {
+      const py_kernels::kernel_args args = {vertex.data().record, other_vertex.data().record, edge.data().record,
+                                            double(vertex.num_in_edges()), double(vertex.num_out_edges()), 0.0};
+      // unlike a Python scatter, 0 does not signal: comparisons yield 1 or 0
+      const double priority = kernels.scatter.eval(args);
+      if (priority > 0) {
+        context.signal(other_vertex, priority);
+      }
+      if (!kernels.delta.empty()) {
+        context.post_delta(other_vertex, agg_class::from_value(kernels.delta.eval(args)));
+      }
+      return;
+    }
+
+    if (has_scatter_batch) {
+      // the first scatter edge of this vertex program handles all of them
+      if (!scattered) {
+        scattered = true;
+        scatter_batch(context, vertex);
+      }
+      return;
+    }
 
+    PythonThreadLocker locker;
 
-    PyObject *pArgs = PyTuple_New(5);
-    PyTuple_SetItem(pArgs, 0, vertex.data().obj);
-    PyTuple_SetItem(pArgs, 1, other_vertex.data().obj);
-    PyTuple_SetItem(pArgs, 2, edgedata_arg);
-    PyTuple_SetItem(pArgs, 3, PyInt_FromLong(vertex.num_in_edges()));
-    PyTuple_SetItem(pArgs, 4, PyInt_FromLong(vertex.num_out_edges()));
+    PyObject *pArgs = take_args(5);
+    PyTuple_SET_ITEM(pArgs, 0, vertex.data().get());
+    PyTuple_SET_ITEM(pArgs, 1, other_vertex.data().get());
+    PyTuple_SET_ITEM(pArgs, 2, edge.data().get());
+    PyTuple_SET_ITEM(pArgs, 3, degree_int(vertex.num_in_edges()));
+    PyTuple_SET_ITEM(pArgs, 4, degree_int(vertex.num_out_edges()));
 
-    PyObject *pValue = PyObject_CallObject(PyFn[PYFN_SCATTER].fn, pArgs);
-    Py_DECREF(pArgs);
+    PyObject *pValue = call_pyfn(PYFN_SCATTER, pArgs);
+    release_args(pArgs);
     if (PyErr_Occurred()) {
       PyErr_Print();
     }
@@ -315,77 +919,199 @@ public:
       
     PyObject *edgedata_result = PyTuple_GetItem(pValue, 1);
     if (edgedata_result != Py_None) {
-      Py_DECREF(edge.data().obj);
       Py_INCREF(edgedata_result);
-      edge.data().obj = edgedata_result;
+      edge.data().set(edgedata_result);
     }
     
     PyObject *vertexdata_result = PyTuple_GetItem(pValue, 2);
     if (vertexdata_result != Py_None) {
-      Py_DECREF(other_vertex.data().obj);
       Py_INCREF(vertexdata_result);
-      other_vertex.data().obj = vertexdata_result;
+      other_vertex.data().set(vertexdata_result);
+    }
+
+    // an optional fourth element is an aggregator added to the cached gather
+    // of other_vertex when the engine runs with use_cache
+    if (PyTuple_Size(pValue) > 3) {
+      PyObject *delta_result = PyTuple_GET_ITEM(pValue, 3);
+      if (delta_result != Py_None) {
+        if (agg_class::native()) {
+          context.post_delta(other_vertex, agg_class::from_value(PyFloat_AsDouble(delta_result)));
+        } else {
+          Py_INCREF(delta_result);
+          context.post_delta(other_vertex, agg_class(delta_result));
+        }
+      }
     }
 
     Py_DECREF(pValue);
   }
-};
-
-struct py_writer {
-  
-  std::string save_vertex(graph_type::vertex_type v) {
-#ifndef PYSHARED_LIB
-    PythonThreadLocker locker;
-#endif
 
-    Py_INCREF(v.data().obj);
-    PyObject *pArgs = PyTuple_New(1);
-    PyTuple_SetItem(pArgs, 0, v.data().obj);
-    PyObject *pValue = PyObject_CallObject(PyFn[PYFN_SAVEVERTEX].fn, pArgs);
-    Py_DECREF(pArgs);
-    if (PyErr_Occurred()) {
-      PyErr_Print();
+private:
+  // Set once scatter_batch ran for the local scatter edges of the vertex.
+  // The engines start every scatter on a fresh or freshly received vertex
+  // program.
+  mutable bool scattered;
+
+  // Calls the user's scatter_batch once with the neighbours and edges of all
+  // local scatter edges of vertex, in the order the engines scatter them,
+  // and signals the neighbours by the returned priorities: one per edge, or
+  // a single priority for all of them.  Negative priorities do not signal.
+  void scatter_batch(icontext_type& context, const vertex_type& vertex) const {
+    graph_type::local_vertex_type local_vertex = graph->l_vertex(vertex.local_id());
+    std::vector<graph_type::local_vertex_type> neighbors;
+    std::vector<graph_type::local_edge_type> edges;
+    if (scatter_edges_dir == graphlab::IN_EDGES || scatter_edges_dir == graphlab::ALL_EDGES) {
+      foreach(graph_type::local_edge_type local_edge, local_vertex.in_edges()) {
+        edges.push_back(local_edge);
+        neighbors.push_back(local_edge.source());
+      }
     }
+    if (scatter_edges_dir == graphlab::OUT_EDGES || scatter_edges_dir == graphlab::ALL_EDGES) {
+      foreach(graph_type::local_edge_type local_edge, local_vertex.out_edges()) {
+        edges.push_back(local_edge);
+        neighbors.push_back(local_edge.target());
+      }
+    }
+
+    std::vector<double> priorities;
+    {
+      PythonThreadLocker locker;
+      PyObject *neighbor_datas = PyList_New(neighbors.size());
+      PyObject *edge_datas = PyList_New(edges.size());
+      for (size_t i = 0; i < edges.size(); i++) {
+        PyList_SET_ITEM(neighbor_datas, i, neighbors[i].data().get());
+        PyList_SET_ITEM(edge_datas, i, edges[i].data().get());
+      }
+
+      PyObject *pArgs = PyTuple_New(5);
+      PyTuple_SET_ITEM(pArgs, 0, vertex.data().get());
+      PyTuple_SET_ITEM(pArgs, 1, neighbor_datas);
+      PyTuple_SET_ITEM(pArgs, 2, edge_datas);
+      PyTuple_SET_ITEM(pArgs, 3, degree_int(vertex.num_in_edges()));
+      PyTuple_SET_ITEM(pArgs, 4, degree_int(vertex.num_out_edges()));
+      PyObject *pValue = call_pyfn(PYFN_SCATTERBATCH, pArgs);
+      Py_DECREF(pArgs);
+      if (pValue == NULL) {
+        PyErr_Print();
+        return;
+      }
 
+      if (!PySequence_Check(pValue)) {
+        priorities.assign(edges.size(), PyFloat_AsDouble(pValue));
+      } else {
+        PyObject *seq = PySequence_Fast(pValue, "scatter_batch must return a number or a sequence");
+        if (seq != NULL && (size_t)PySequence_Fast_GET_SIZE(seq) == edges.size()) {
+          for (size_t i = 0; i < edges.size(); i++) {
+            priorities.push_back(PyFloat_AsDouble(PySequence_Fast_GET_ITEM(seq, i)));
+          }
+        } else if (seq != NULL) {
+          logstream(LOG_ERROR) << "scatter_batch returned " << PySequence_Fast_GET_SIZE(seq)
+                               << " priorities for " << edges.size() << " edges" << std::endl;
+        }
+        Py_XDECREF(seq);
+      }
+      if (PyErr_Occurred()) {
+        PyErr_Print();
+        priorities.clear();
+      }
+      Py_DECREF(pValue);
+    }
+
+    for (size_t i = 0; i < priorities.size(); i++) {
+      if (priorities[i] >= 0) {
+        context.signal(vertex_type(neighbors[i]), priorities[i]);
+      }
+    }
+  }
+};
+
+typedef python_interface::icontext_type icontext_type;
+
+reduce_class aggregate_vertex(PyObject *fn, icontext_type &context, const graph_type::vertex_type &vertex) {
+  return map_vertex_data(fn, vertex);
+}
+
+reduce_class aggregate_edge(PyObject *fn, icontext_type &context, const graph_type::edge_type &edge) {
+  return map_edge_data(fn, edge);
+}
+
+// Runs on every machine with the reduced total of aggregator index.
+void finalize_aggregator(size_t index, icontext_type &context, const reduce_class &total) {
+  PythonThreadLocker locker;
+  py_aggregator_type &aggregator = py_aggregators[index];
+
+  PyObject *value = total.get();
+  PyObject *entry = Py_BuildValue("(iO)", context.iteration(), value);
+  PyList_Append(aggregator.history, entry);
+  Py_DECREF(entry);
+
+  PyObject *pArgs = PyTuple_New(1);
+  PyTuple_SetItem(pArgs, 0, value);
+  PyObject *pValue = PyObject_CallObject(aggregator.finalize_fn, pArgs);
+  Py_DECREF(pArgs);
+  if (pValue == NULL) {
+    PyErr_Print();
+    return;
+  }
+  if (PyObject_IsTrue(pValue) == 1) {
+    dc->cout() << "Aggregator " << aggregator.name << " stopped the engine" << std::endl;
+    context.stop();
+  }
+  Py_DECREF(pValue);
+}
+
+struct py_writer {
+  
+  std::string save_vertex(graph_type::vertex_type v) {
+    PythonThreadLocker locker;
+
+    PyObject *pArgs = PyTuple_New(1);
+    PyTuple_SetItem(pArgs, 0, v.data().get());
+    PyObject *pValue = call_pyfn(PYFN_SAVEVERTEX, pArgs);
+    Py_DECREF(pArgs);
+    if (PyErr_Occurred()) {
+      PyErr_Print();
+    }
+
+    // saveVertex may also return numpy arrays for save_graph_binary
+    PyObject *text = pValue == NULL || PyString_Check(pValue) ? pValue : PyObject_Str(pValue);
     std::stringstream strm;
-    strm << v.id() << "\t" << PyString_AsString(pValue) << "\n";
-    Py_DECREF(pValue);
+    strm << v.id() << "\t" << (text == NULL ? "" : PyString_AsString(text)) << "\n";
+    if (text != pValue) Py_XDECREF(text);
+    Py_XDECREF(pValue);
     return strm.str();
   }
   
   std::string save_edge(graph_type::edge_type e) { 
-#ifndef PYSHARED_LIB
     PythonThreadLocker locker;
-#endif
 
-    Py_INCREF(e.data().obj);
     PyObject *pArgs = PyTuple_New(3);
-    PyTuple_SetItem(pArgs, 0, e.source().data().obj);
-    PyTuple_SetItem(pArgs, 1, e.target().data().obj);
-    PyTuple_SetItem(pArgs, 2, e.data().obj);
-    PyObject *pValue = PyObject_CallObject(PyFn[PYFN_SAVEEDGE].fn, pArgs);
+    PyTuple_SetItem(pArgs, 0, e.source().data().get());
+    PyTuple_SetItem(pArgs, 1, e.target().data().get());
+    PyTuple_SetItem(pArgs, 2, e.data().get());
+    PyObject *pValue = call_pyfn(PYFN_SAVEEDGE, pArgs);
     Py_DECREF(pArgs);
     if (PyErr_Occurred()) {
       PyErr_Print();
     }
 
+    PyObject *text = pValue == NULL || PyString_Check(pValue) ? pValue : PyObject_Str(pValue);
     std::stringstream strm;
-    strm << PyString_AsString(pValue) << "\n";
-    Py_DECREF(pValue);
+    strm << (text == NULL ? "" : PyString_AsString(text)) << "\n";
+    if (text != pValue) Py_XDECREF(text);
+    Py_XDECREF(pValue);
     return strm.str();
   }
 };
 
 inline bool graph_loader(graph_type &graph, const std::string &filename, const std::string &line) {
-#ifndef PYSHARED_LIB
   PythonThreadLocker locker;
-#endif
 
   PyObject *pArgs = PyTuple_New(2);
   PyTuple_SetItem(pArgs, 0, PyString_FromString(filename.c_str()));
   PyTuple_SetItem(pArgs, 1, PyString_FromString(line.c_str()));
 
-  PyObject *pValue = PyObject_CallObject(PyFn[PYFN_PARSEEDGE].fn, pArgs);
+  PyObject *pValue = call_pyfn(PYFN_PARSEEDGE, pArgs);
   Py_DECREF(pArgs);
   if (PyErr_Occurred()) {
     PyErr_Print();
@@ -405,9 +1131,9 @@ inline bool graph_loader(graph_type &graph, const std::string &filename, const s
 //  if (edgedata == Py_None) {
 //    edgedata = NULL;
 //  }
-//  Py_INCREF(edgedata);
 //  Py_DECREF(pValue);
   if (srcId != destId) {
+    Py_XINCREF(edgedata);  // edge_data_type steals the reference, the tuple keeps its own
     graph.add_edge(srcId, destId, edge_data_type(edgedata));
   }
 
@@ -416,6 +1142,372 @@ inline bool graph_loader(graph_type &graph, const std::string &filename, const s
   return true;
 }
 
+// Adds the edges in arrays, a (src, dst, payload) tuple as normalized by
+// wrappers.edgeArrays: src and dst are buffers of int64 vertex ids and payload
+// is None, a list of edge values or, for typed edges, a buffer of packed
+// records.  Only every stride-th edge starting at begin is added, so that each
+// machine can take its share of arrays it holds in full.  Self edges are
+// skipped as in graph_loader.  The caller must hold the GIL.  Returns the
+// number of edges added, or -1 if the arrays are malformed.
+long add_edge_arrays(graph_type &graph, PyObject *arrays, size_t begin = 0, size_t stride = 1) {
+  PyObject *src, *dst, *payload;
+  if (arrays == NULL || !PyArg_ParseTuple(arrays, "OOO", &src, &dst, &payload)) {
+    PyErr_Print();
+    return -1;
+  }
+
+  const void *src_data, *dst_data;
+  Py_ssize_t src_len, dst_len;
+  if (PyObject_AsReadBuffer(src, &src_data, &src_len) != 0 ||
+      PyObject_AsReadBuffer(dst, &dst_data, &dst_len) != 0 ||
+      src_len != dst_len || src_len % sizeof(int64_t) != 0) {
+    PyErr_Clear();
+    logstream(LOG_ERROR) << "src and dst must be int64 arrays of the same length" << std::endl;
+    return -1;
+  }
+  const int64_t *src_ids = (const int64_t *)src_data;
+  const int64_t *dst_ids = (const int64_t *)dst_data;
+  const size_t num_edges = src_len / sizeof(int64_t);
+
+  long num_added = 0;
+  if (payload == Py_None && edge_data_type::record_size == 0) {
+    for (size_t i = begin; i < num_edges; i += stride) {
+      if (src_ids[i] == dst_ids[i]) continue;
+      Py_INCREF(Py_None);
+      graph.add_edge(src_ids[i], dst_ids[i], edge_data_type(Py_None));
+      ++num_added;
+    }
+  } else if (edge_data_type::record_size == 0) {
+    if (!PyList_Check(payload) || (size_t)PyList_GET_SIZE(payload) != num_edges) {
+      logstream(LOG_ERROR) << "Edge payload must hold one value per edge" << std::endl;
+      return -1;
+    }
+    for (size_t i = begin; i < num_edges; i += stride) {
+      if (src_ids[i] == dst_ids[i]) continue;
+      PyObject *edgedata = PyList_GET_ITEM(payload, i);
+      Py_INCREF(edgedata);
+      graph.add_edge(src_ids[i], dst_ids[i], edge_data_type(edgedata));
+      ++num_added;
+    }
+  } else {
+    const void *records = NULL;
+    Py_ssize_t records_len = 0;
+    if (payload != Py_None &&
+        (PyObject_AsReadBuffer(payload, &records, &records_len) != 0 ||
+         (size_t)records_len != num_edges * edge_data_type::record_size)) {
+      PyErr_Clear();
+      logstream(LOG_ERROR) << "Edge payload must hold one " << edge_data_type::record_size
+                           << " byte record per edge" << std::endl;
+      return -1;
+    }
+    // records need no Python, let the other loader threads run meanwhile
+    Py_BEGIN_ALLOW_THREADS
+    for (size_t i = begin; i < num_edges; i += stride) {
+      if (src_ids[i] == dst_ids[i]) continue;
+      edge_data_type edgedata;
+      if (records != NULL) {
+        memcpy(edgedata.record, (const char *)records + i * edge_data_type::record_size,
+               edge_data_type::record_size);
+      }
+      graph.add_edge(src_ids[i], dst_ids[i], edgedata);
+      ++num_added;
+    }
+    Py_END_ALLOW_THREADS
+  }
+  return num_added;
+}
+
+// Hands the block [data, data+len) of filename to the user's parseEdges and
+// adds the returned edges.  The caller must not hold the GIL.
+bool parse_edge_block(graph_type &graph, const std::string &filename, const char *data, size_t len) {
+  PythonThreadLocker locker;
+
+  PyObject *pArgs = PyTuple_New(2);
+  PyTuple_SetItem(pArgs, 0, PyString_FromString(filename.c_str()));
+  PyTuple_SetItem(pArgs, 1, PyString_FromStringAndSize(data, len));
+  PyObject *pValue = call_pyfn(PYFN_PARSEEDGES, pArgs);
+  Py_DECREF(pArgs);
+  if (pValue == NULL) {
+    PyErr_Print();
+    return false;
+  }
+
+  const long num_added = add_edge_arrays(graph, pValue);
+  Py_DECREF(pValue);
+  return num_added >= 0;
+}
+
+// Loads the files matching prefix through the user's parseEdges hook, which
+// receives blocks of about parse_block_size bytes ending on a line boundary.
+// Files are split across machines and loader threads the same way
+// distributed_graph::load_from_posixfs splits them.  Must be called on all
+// machines and without holding the GIL.
+void load_graph_blocks(graph_type &graph, const std::string &prefix) {
+  std::string directory_name;
+  std::string search_prefix;
+  boost::filesystem::path path(prefix);
+  if (boost::filesystem::is_directory(path)) {
+    directory_name = path.native();
+  } else {
+    directory_name = path.parent_path().native();
+    search_prefix = path.filename().native();
+    directory_name = (directory_name.empty() ? "." : directory_name);
+  }
+  std::vector<std::string> graph_files;
+  graphlab::fs_util::list_files_with_prefix(directory_name, search_prefix, graph_files);
+  if (graph_files.size() == 0) {
+    logstream(LOG_WARNING) << "No files found matching " << prefix << std::endl;
+  }
+
+#ifdef _OPENMP
+#pragma omp parallel for
+#endif
+  for (size_t i = 0; i < graph_files.size(); ++i) {
+    if (i % dc->numprocs() != dc->procid()) continue;
+    logstream(LOG_EMPH) << "Loading graph from file: " << graph_files[i] << std::endl;
+    const bool gzip = boost::ends_with(graph_files[i], ".gz");
+    std::ifstream in_file(graph_files[i].c_str(), std::ios_base::in | std::ios_base::binary);
+    boost::iostreams::filtering_stream<boost::iostreams::input> fin;
+    if (gzip) fin.push(boost::iostreams::gzip_decompressor());
+    fin.push(in_file);
+
+    // the tail after the last newline of a block is carried into the next one
+    std::vector<char> block(parse_block_size);
+    size_t carried = 0;
+    bool success = true;
+    while (success && fin.good()) {
+      if (carried == block.size()) block.resize(2 * block.size());  // a line longer than a block
+      fin.read(&block[carried], block.size() - carried);
+      const size_t len = carried + fin.gcount();
+      if (len == 0) break;
+      size_t cut = len;
+      if (fin.good()) {
+        while (cut > 0 && block[cut - 1] != '\n') --cut;
+        if (cut == 0) {
+          carried = len;
+          continue;
+        }
+      }
+      success = parse_edge_block(graph, graph_files[i], &block[0], cut);
+      carried = len - cut;
+      memmove(&block[0], &block[cut], carried);
+    }
+    if (!success) {
+      logstream(LOG_FATAL) << "\n\tError parsing file: " << graph_files[i] << std::endl;
+    }
+    fin.pop();
+    if (gzip) fin.pop();
+  }
+  dc->full_barrier();
+}
+
+// Switches data_type to fixed size records when the wrapper module exposes a
+// record dtype under dtype_name.  The caller must hold the GIL.
+template<typename data_type>
+int init_record_storage(PyObject *pModuleWrap, const char *dtype_name) {
+  PyObject *dtype = PyObject_GetAttrString(pModuleWrap, dtype_name);
+  if (dtype == NULL || dtype == Py_None) {
+    PyErr_Clear();
+    Py_XDECREF(dtype);
+    return EXIT_SUCCESS;
+  }
+
+  if (np_frombuffer == NULL) {
+    PyObject *numpy = PyImport_ImportModule("numpy");
+    if (numpy == NULL) {
+      PyErr_Print();
+      dc->cout() << "numpy is required for " << dtype_name << "\n";
+      Py_DECREF(dtype);
+      return EXIT_FAILURE;
+    }
+    np_frombuffer = PyObject_GetAttrString(numpy, "frombuffer");
+    np_array = PyObject_GetAttrString(numpy, "array");
+    Py_DECREF(numpy);
+  }
+
+  PyObject *itemsize = PyObject_GetAttrString(dtype, "itemsize");
+  data_type::record_size = PyInt_AsLong(itemsize);
+  data_type::record_dtype = dtype;  // keeps the reference
+  Py_XDECREF(itemsize);
+  if (PyErr_Occurred() || data_type::record_size == 0) {
+    PyErr_Print();
+    dc->cout() << "Invalid " << dtype_name << "\n";
+    data_type::record_size = 0;
+    return EXIT_FAILURE;
+  }
+
+  dc->cout() << "Storing " << dtype_name << " records of " << data_type::record_size << " bytes" << std::endl;
+  return EXIT_SUCCESS;
+}
+
+// Registers a periodic aggregator for the following gas_graph runs.  kind is
+// "vertex" or "edge" and selects the signature of map_fn.  Must be called on
+// all machines in the same order.
+int add_aggregator(const char *name, const char *kind, PyObject *map_fn, PyObject *finalize_fn,
+                   const float period) {
+  if (strcmp(kind, "vertex") != 0 && strcmp(kind, "edge") != 0) {
+    dc->cout() << "Aggregator kind must be vertex or edge\n";
+    return EXIT_FAILURE;
+  }
+  PythonThreadLocker locker;
+  py_aggregator_type aggregator;
+  aggregator.name = name;
+  aggregator.edges = strcmp(kind, "edge") == 0;
+  aggregator.map_fn = map_fn;
+  aggregator.finalize_fn = finalize_fn;
+  aggregator.period = period;
+  aggregator.history = PyList_New(0);
+  Py_INCREF(map_fn);
+  Py_INCREF(finalize_fn);
+  py_aggregators.push_back(aggregator);
+  return EXIT_SUCCESS;
+}
+
+// Reads the numeric fields of a record dtype through wrappers.recordLayout.
+// The caller must hold the GIL.
+int get_record_layout(PyObject *pModuleWrap, PyObject *dtype, py_kernels::layout_type &layout) {
+  PyObject *fields = PyObject_CallMethod(pModuleWrap, (char *)"recordLayout", (char *)"(O)", dtype);
+  if (fields == NULL) {
+    PyErr_Print();
+    return EXIT_FAILURE;
+  }
+  for (Py_ssize_t i = 0; i < PySequence_Size(fields); i++) {
+    PyObject *entry = PySequence_GetItem(fields, i);
+    const char *name, *kind;
+    long offset, size;
+    if (!PyArg_ParseTuple(entry, "slsl", &name, &offset, &kind, &size)) {
+      PyErr_Print();
+      Py_DECREF(entry);
+      Py_DECREF(fields);
+      return EXIT_FAILURE;
+    }
+    py_kernels::field_type field;
+    field.offset = offset;
+    field.kind = kind[0];
+    field.size = size;
+    layout[name] = field;
+    Py_DECREF(entry);
+  }
+  Py_DECREF(fields);
+  return EXIT_SUCCESS;
+}
+
+// Compiles the kernels dict of the user module: gather, scatter and delta
+// expressions, a merge of "sum", "min" or "max", and a list of "field = expr"
+// assignments for apply.  The caller must hold the GIL.
+int init_kernels(PyObject *pModuleWrap) {
+  PyObject *spec = PyObject_GetAttrString(pModuleWrap, "kernels");
+  if (spec == NULL || spec == Py_None) {
+    PyErr_Clear();
+    Py_XDECREF(spec);
+    return EXIT_SUCCESS;
+  }
+  if (!PyDict_Check(spec) || vertex_data_type::record_size == 0) {
+    dc->cout() << "kernels must be a dict and requires vertexDtype\n";
+    Py_DECREF(spec);
+    return EXIT_FAILURE;
+  }
+
+  py_kernels::layout_type vertex_layout, edge_layout;
+  if (get_record_layout(pModuleWrap, vertex_data_type::record_dtype, vertex_layout) ||
+      (edge_data_type::record_size > 0 &&
+       get_record_layout(pModuleWrap, edge_data_type::record_dtype, edge_layout))) {
+    Py_DECREF(spec);
+    return EXIT_FAILURE;
+  }
+
+  std::map<std::string, double> constants;
+  PyObject *constants_res = PyObject_CallMethod(pModuleWrap, (char *)"kernelConstants", NULL);
+  if (constants_res == NULL || !PyDict_Check(constants_res)) {
+    PyErr_Print();
+  } else {
+    Py_ssize_t pos = 0;
+    PyObject *key, *value;
+    while (PyDict_Next(constants_res, &pos, &key, &value)) {
+      constants[PyString_AsString(key)] = PyFloat_AsDouble(value);
+    }
+  }
+  Py_XDECREF(constants_res);
+
+  int ret = EXIT_SUCCESS;
+  std::string error;
+  Py_ssize_t pos = 0;
+  PyObject *key, *value;
+  while (ret == EXIT_SUCCESS && PyDict_Next(spec, &pos, &key, &value)) {
+    const std::string name = PyString_Check(key) ? PyString_AsString(key) : "";
+    if (name == "apply" && PySequence_Check(value) && !PyString_Check(value)) {
+      for (Py_ssize_t i = 0; i < PySequence_Size(value) && ret == EXIT_SUCCESS; i++) {
+        PyObject *item = PySequence_GetItem(value, i);
+        const std::string text = PyString_Check(item) ? PyString_AsString(item) : "";
+        Py_DECREF(item);
+        std::string field, expr;
+        py_kernels::layout_type::const_iterator it;
+        py_kernels::expression e;
+        if (!py_kernels::split_assignment(text, field, expr)) {
+          error = "apply expects \"field = expression\", got '" + text + "'";
+        } else if ((it = vertex_layout.find(field)) == vertex_layout.end()) {
+          error = "apply assigns the unknown field " + field;
+        } else if (e.compile(expr, vertex_layout, edge_layout, constants, error)) {
+          kernels.apply.push_back(std::make_pair(it->second, e));
+        }
+        ret = error.empty() ? EXIT_SUCCESS : EXIT_FAILURE;
+      }
+      continue;
+    }
+    if (!PyString_Check(value)) {
+      error = "kernel " + name + " must be a string";
+      ret = EXIT_FAILURE;
+      continue;
+    }
+
+    const std::string text = PyString_AsString(value);
+    if (name == "merge") {
+      if (text == "sum") kernels.merge = py_kernels::MERGE_SUM;
+      else if (text == "min") kernels.merge = py_kernels::MERGE_MIN;
+      else if (text == "max") kernels.merge = py_kernels::MERGE_MAX;
+      else error = "merge must be sum, min or max";
+    } else if (name == "gather") {
+      kernels.gather.compile(text, vertex_layout, edge_layout, constants, error);
+    } else if (name == "scatter") {
+      kernels.scatter.compile(text, vertex_layout, edge_layout, constants, error);
+    } else if (name == "delta") {
+      kernels.delta.compile(text, vertex_layout, edge_layout, constants, error);
+    } else {
+      error = "unknown kernel " + name;
+    }
+    ret = error.empty() ? EXIT_SUCCESS : EXIT_FAILURE;
+  }
+  Py_DECREF(spec);
+
+  if (ret == EXIT_SUCCESS && kernels.merge == py_kernels::MERGE_NONE &&
+      (!kernels.gather.empty() || !kernels.apply.empty() || !kernels.delta.empty())) {
+    error = "gather, apply and delta kernels require a merge kernel";
+    ret = EXIT_FAILURE;
+  }
+  if (ret == EXIT_SUCCESS && !kernels.delta.empty() && kernels.scatter.empty()) {
+    error = "a delta kernel requires a scatter kernel";
+    ret = EXIT_FAILURE;
+  }
+  if (ret != EXIT_SUCCESS) {
+    dc->cout() << "Invalid kernels: " << error << "\n";
+    kernels = py_kernels::gas_kernels();
+    return EXIT_FAILURE;
+  }
+
+  if (agg_class::native()) {
+    agg_class::record_size = sizeof(py_kernels::accumulator_type);
+    if (has_gather_batch) {
+      dc->cout() << "gather_batch is ignored with a merge kernel\n";
+      has_gather_batch = false;
+    }
+  }
+  dc->cout() << "Native kernels:" << (kernels.gather.empty() ? "" : " gather")
+             << (agg_class::native() ? " merge" : "") << (kernels.apply.empty() ? "" : " apply")
+             << (kernels.scatter.empty() ? "" : " scatter") << (kernels.delta.empty() ? "" : " delta")
+             << std::endl;
+  return EXIT_SUCCESS;
+}
+
 int init_python(const char *python_script) {
 #ifndef PYSHARED_LIB
   // Initialize Python
@@ -431,9 +1523,7 @@ int init_python(const char *python_script) {
 #endif
 
 {
-#ifndef PYSHARED_LIB
   PythonThreadLocker locker;
-#endif
 
   PyRun_SimpleString("import sys");
   PyRun_SimpleString("sys.path.append('')");
@@ -448,15 +1538,15 @@ int init_python(const char *python_script) {
     return EXIT_FAILURE;
   }
 
-  func_initusermodule = PyObject_GetAttrString(pModuleWrap, "initUserModule");
+  // for user modules, e.g. to report only on machine 0
+  PyObject *procid = PyInt_FromLong(dc->procid());
+  PyObject *numprocs = PyInt_FromLong(dc->numprocs());
+  PyObject_SetAttrString(pModuleWrap, "procId", procid);
+  PyObject_SetAttrString(pModuleWrap, "numProcs", numprocs);
+  Py_DECREF(procid);
+  Py_DECREF(numprocs);
 
-  for (int i = 0; i < PYFN_SIZE; i++) {
-    PyFn[i].fn = PyObject_GetAttrString(pModuleWrap, PyFn[i].fn_name);
-    if (PyFn[i].fn == Py_None || PyFn[i].fn == NULL) {
-      dc->cout() << "Cannot load python function " << PyFn[i].fn_name << " from wrapper module\n";
-      return EXIT_FAILURE;
-    }
-  }
+  func_initusermodule = PyObject_GetAttrString(pModuleWrap, "initUserModule");
 
   PyObject *pArgs = PyTuple_New(1);
   PyTuple_SetItem(pArgs, 0, PyString_FromString(python_script));
@@ -469,6 +1559,82 @@ int init_python(const char *python_script) {
   has_edgeclass = pValue == Py_True;
   Py_DECREF(pValue);
 
+  // look the functions up only now, initUserModule may rebind some of them
+  for (int i = 0; i < PYFN_SIZE; i++) {
+    PyFn[i].fn = PyObject_GetAttrString(pModuleWrap, PyFn[i].fn_name);
+    if (PyFn[i].fn == Py_None || PyFn[i].fn == NULL) {
+      dc->cout() << "Cannot load python function " << PyFn[i].fn_name << " from wrapper module\n";
+      return EXIT_FAILURE;
+    }
+  }
+
+  for (size_t d = 0; d < MAX_CACHED_DEGREE; d++) {
+    if (cached_degrees[d] == NULL) cached_degrees[d] = PyInt_FromSize_t(d);
+  }
+
+  if (init_record_storage<vertex_data_type>(pModuleWrap, "vertexDtype") ||
+      init_record_storage<edge_data_type>(pModuleWrap, "edgeDtype")) {
+    return EXIT_FAILURE;
+  }
+
+  PyObject *gather_batch_res = PyObject_GetAttrString(pModuleWrap, "hasGatherBatch");
+  if (gather_batch_res != NULL) {
+    has_gather_batch = PyObject_IsTrue(gather_batch_res);
+    Py_DECREF(gather_batch_res);
+  }
+
+  if (init_kernels(pModuleWrap)) {
+    return EXIT_FAILURE;
+  }
+
+  PyObject *should_scatter_res = PyObject_GetAttrString(pModuleWrap, "hasShouldScatter");
+  if (should_scatter_res != NULL) {
+    has_should_scatter = PyObject_IsTrue(should_scatter_res);
+    Py_DECREF(should_scatter_res);
+  }
+
+  PyObject *scatter_batch_res = PyObject_GetAttrString(pModuleWrap, "hasScatterBatch");
+  if (scatter_batch_res != NULL) {
+    has_scatter_batch = PyObject_IsTrue(scatter_batch_res);
+    Py_DECREF(scatter_batch_res);
+  }
+
+  PyObject *parse_edges_res = PyObject_GetAttrString(pModuleWrap, "hasParseEdges");
+  if (parse_edges_res != NULL) {
+    has_parse_edges = PyObject_IsTrue(parse_edges_res);
+    Py_DECREF(parse_edges_res);
+  }
+
+  PyObject *block_size_res = PyObject_GetAttrString(pModuleWrap, "parseBlockSize");
+  if (block_size_res != Py_None && block_size_res != NULL) {
+    parse_block_size = PyInt_AsLong(block_size_res);
+  }
+  Py_XDECREF(block_size_res);
+
+  PyObject *engine_options_res = PyObject_GetAttrString(pModuleWrap, "engineOptions");
+  if (engine_options_res != Py_None && engine_options_res != NULL) {
+    module_engine_options = engine_options_res;
+  } else {
+    Py_XDECREF(engine_options_res);
+  }
+
+  PyObject *aggregators_res = PyObject_GetAttrString(pModuleWrap, "aggregators");
+  if (aggregators_res != NULL && PySequence_Check(aggregators_res)) {
+    for (Py_ssize_t i = 0; i < PySequence_Size(aggregators_res); i++) {
+      PyObject *spec = PySequence_GetItem(aggregators_res, i);
+      const char *name, *kind;
+      PyObject *map_fn, *finalize_fn;
+      float period;
+      if (!PyArg_ParseTuple(spec, "ssOOf", &name, &kind, &map_fn, &finalize_fn, &period) ||
+          add_aggregator(name, kind, map_fn, finalize_fn, period)) {
+        PyErr_Print();
+        dc->cout() << "Invalid aggregator, expected (name, kind, map, finalize, period)\n";
+      }
+      Py_DECREF(spec);
+    }
+  }
+  PyErr_Clear();
+  Py_XDECREF(aggregators_res);
 
   PyObject *gather_edges_res = PyObject_GetAttrString(pModuleWrap, "gatherEdges");
   if (gather_edges_res != Py_None && gather_edges_res != NULL) {
@@ -486,22 +1652,135 @@ int init_python(const char *python_script) {
   return EXIT_SUCCESS;
 }
 
+// Returns a dict of this process's Python call statistics: for each PyFn
+// function that was called, {"calls", "seconds", "gil_wait_seconds"}, and
+// under "GIL" the total number of acquisitions and the time spent waiting.
+PyObject *get_profile() {
+  const double ticks_per_second = graphlab::estimate_ticks_per_second();
+  PythonThreadLocker locker;
+
+  PyObject *profile = PyDict_New();
+  for (size_t i = 0; i < PYFN_SIZE; i++) {
+    if (pyfn_profile[i].calls == 0) continue;
+    PyObject *entry = Py_BuildValue("{s:n,s:d,s:d}",
+                                    "calls", (Py_ssize_t)pyfn_profile[i].calls,
+                                    "seconds", pyfn_profile[i].ticks / ticks_per_second,
+                                    "gil_wait_seconds", pyfn_profile[i].gil_wait_ticks / ticks_per_second);
+    PyDict_SetItemString(profile, PyFn[i].fn_name, entry);
+    Py_DECREF(entry);
+  }
+  PyObject *gil = Py_BuildValue("{s:n,s:d}",
+                                "acquisitions", (Py_ssize_t)gil_profile.acquisitions,
+                                "wait_seconds", gil_profile.wait_ticks / ticks_per_second);
+  PyDict_SetItemString(profile, "GIL", gil);
+  Py_DECREF(gil);
+  return profile;
+}
+
+// Prints the call profile of this process, one line per function.
+void print_profile() {
+  const double ticks_per_second = graphlab::estimate_ticks_per_second();
+  std::stringstream strm;
+  for (size_t i = 0; i < PYFN_SIZE; i++) {
+    if (pyfn_profile[i].calls == 0) continue;
+    strm << "Python profile: " << PyFn[i].fn_name
+         << " calls=" << pyfn_profile[i].calls
+         << " seconds=" << pyfn_profile[i].ticks / ticks_per_second
+         << " gil_wait=" << pyfn_profile[i].gil_wait_ticks / ticks_per_second << std::endl;
+  }
+  strm << "Python profile: GIL acquisitions=" << gil_profile.acquisitions
+       << " wait=" << gil_profile.wait_ticks / ticks_per_second << std::endl;
+  dc->cout() << strm.str();
+}
+
+void reset_profile() {
+  PythonThreadLocker locker;
+  memset(pyfn_profile, 0, sizeof(pyfn_profile));
+  memset(&gil_profile, 0, sizeof(gil_profile));
+}
+
+// metrics server page with the same numbers as get_profile, for machine 0
+std::pair<std::string, std::string> py_profile_page(std::map<std::string, std::string> &varmap) {
+  const double ticks_per_second = graphlab::estimate_ticks_per_second();
+  std::stringstream strm;
+  strm << "{\n  \"procid\": " << dc->procid() << ",\n  \"functions\": [";
+  bool first = true;
+  for (size_t i = 0; i < PYFN_SIZE; i++) {
+    if (pyfn_profile[i].calls == 0) continue;
+    strm << (first ? "\n" : ",\n")
+         << "    {\"name\": \"" << PyFn[i].fn_name << "\", "
+         << "\"calls\": " << pyfn_profile[i].calls << ", "
+         << "\"seconds\": " << pyfn_profile[i].ticks / ticks_per_second << ", "
+         << "\"gil_wait_seconds\": " << pyfn_profile[i].gil_wait_ticks / ticks_per_second << "}";
+    first = false;
+  }
+  strm << "\n  ],\n  \"gil\": {\"acquisitions\": " << gil_profile.acquisitions
+       << ", \"wait_seconds\": " << gil_profile.wait_ticks / ticks_per_second << "}\n}\n";
+  return std::make_pair(std::string("text/plain"), strm.str());
+}
+
+void launch_metrics() {
+  graphlab::launch_metric_server();
+}
+
+void stop_metrics() {
+  graphlab::stop_metric_server();
+}
+
 void init() {
   if (dc_initialized) {
     dc->cout() << "DC already initialized\n";
     return;
   }
 
-  int argc = 0;
-  char **argv = NULL;
-  
-  // Initialize control plain using mpi
-  graphlab::mpi_tools::init(argc, argv);
-  dc = new graphlab::distributed_control();
+#ifdef PYSHARED_LIB
+  // Worker threads take the GIL through PyGILState, which needs the
+  // interpreter's thread support switched on.
+  PyEval_InitThreads();
+#endif
+
+  // Processes started by spawn_local_procs (or rpcexec.py) describe the
+  // cluster in SPAWNID/SPAWNNODES; otherwise initialize control plain using mpi
+  graphlab::dc_init_param param;
+  if (graphlab::init_param_from_env(param)) {
+    dc = new graphlab::distributed_control(param);
+  } else {
+    int argc = 0;
+    char **argv = NULL;
+    graphlab::mpi_tools::init(argc, argv);
+    mpi_initialized = true;
+    dc = new graphlab::distributed_control();
+  }
   global_logger().set_log_level(LOG_INFO);
+  graphlab::add_metric_server_callback("py_profile.json", py_profile_page);
   dc_initialized = true;
 }
 
+// Makes init_graph keep a binary snapshot of each graph it parses in
+// cache_dir and load the snapshot instead when the same inputs are loaded
+// again by the same scripts on the same number of machines.  An empty
+// cache_dir disables the cache.
+void set_graph_cache(const char *cache_dir) {
+  graph_cache_dir = cache_dir;
+}
+
+// Returns the save_binary prefix of the snapshot of graph_dir in the graph
+// cache, "" when the graph cannot be cached.
+std::string graph_cache_prefix(const char *graph_dir, const char *format) {
+  PythonThreadLocker locker;
+  PyObject *pArgs = Py_BuildValue("(ssn)", graph_dir, format, (Py_ssize_t)dc->numprocs());
+  PyObject *pValue = call_pyfn(PYFN_GRAPHCACHEKEY, pArgs);
+  Py_DECREF(pArgs);
+  std::string prefix;
+  if (pValue == NULL) {
+    PyErr_Print();
+  } else if (PyString_Check(pValue)) {
+    prefix = graph_cache_dir + "/" + PyString_AsString(pValue) + ".";
+  }
+  Py_XDECREF(pValue);
+  return prefix;
+}
+
 int init_graph(const char *graph_dir, const char *format, const char *python_script) {
   if (!dc_initialized) {                      
     dc->cout() << "DC not initialized\n";
@@ -522,22 +1801,120 @@ int init_graph(const char *graph_dir, const char *format, const char *python_scr
     return EXIT_FAILURE;
   }
 
-  graphlab::command_line_options clopts("Python algorithm.");
-  clopts.set_ncpus(1);
+  graphlab::graphlab_options clopts = py_opts;
+  clopts.set_ncpus(num_threads);
+
+  std::string cache_prefix = graph_cache_dir.empty() ? "" : graph_cache_prefix(graph_dir, format);
 
   // Build the graph ----------------------------------------------------------
   graph = new graph_type(*dc, clopts);
 
-  if (strlen(format) > 0) {
-    dc->cout() << "Loading graph in format: "<< format << std::endl;
-    graph->load_format(std::string(graph_dir), std::string(format));
-  } else {
-    dc->cout() << "Loading graph using parseEdge function" << std::endl;
-    graph->load(std::string(graph_dir), graph_loader);
+  {
+    PythonThreadUnlocker unlocker;
+
+    // a snapshot is only complete once its .done file exists, and is used
+    // when every machine computed the same key and has its part
+    bool cached = false;
+    if (!graph_cache_dir.empty()) {
+      std::vector<std::string> prefixes(dc->numprocs());
+      prefixes[dc->procid()] = cache_prefix;
+      dc->all_gather(prefixes);
+      if (std::count(prefixes.begin(), prefixes.end(), cache_prefix) != (long)prefixes.size()) {
+        dc->cout() << "Machines disagree on the graph cache key, not caching the graph" << std::endl;
+        cache_prefix.clear();
+      }
+    }
+    if (!cache_prefix.empty()) {
+      const std::string done_file = cache_prefix + graphlab::tostr(dc->procid()) + ".done";
+      std::vector<int> hits(dc->numprocs(), 0);
+      hits[dc->procid()] = access(done_file.c_str(), F_OK) == 0;
+      dc->all_gather(hits);
+      cached = std::count(hits.begin(), hits.end(), 0) == 0;
+    }
+
+    if (cached) {
+      dc->cout() << "Loading graph from cache " << cache_prefix << "*" << std::endl;
+      graph->load_binary(cache_prefix);
+    } else if (strlen(format) > 0) {
+      dc->cout() << "Loading graph in format: "<< format << std::endl;
+      graph->load_format(std::string(graph_dir), std::string(format));
+    } else if (has_parse_edges && !boost::starts_with(std::string(graph_dir), "hdfs://")) {
+      dc->cout() << "Loading graph using parseEdges function" << std::endl;
+      dc->full_barrier();
+      load_graph_blocks(*graph, std::string(graph_dir));
+    } else {
+      dc->cout() << "Loading graph using parseEdge function" << std::endl;
+      graph->load(std::string(graph_dir), graph_loader);
+    }
+
+    // must call finalize before querying the graph
+    graph->finalize();
+
+    if (!cached && !cache_prefix.empty()) {
+      dc->cout() << "Saving graph to cache " << cache_prefix << "*" << std::endl;
+      boost::filesystem::create_directories(graph_cache_dir);
+      graph->save_binary(cache_prefix);
+      std::ofstream done_file((cache_prefix + graphlab::tostr(dc->procid()) + ".done").c_str());
+    }
+  }
+  dc->cout() << "#vertices: " << graph->num_vertices() << " #edges: " << graph->num_edges() << std::endl;
+  graph_initialized = true;
+
+  return EXIT_SUCCESS;
+}
+
+// Builds the graph from parallel arrays of source and destination ids, with
+// an optional edge_payload of one value (or typed record) per edge.  Every
+// machine is expected to pass the same arrays and adds every numprocs-th edge
+// starting at its procid; the graph's configured ingress method places them.
+int init_graph_from_arrays(PyObject *src, PyObject *dst, const char *python_script, PyObject *edge_payload) {
+  if (!dc_initialized) {
+    dc->cout() << "DC not initialized\n";
+    return EXIT_FAILURE;
+  }
+  if (graph_initialized) {
+    dc->cout() << "Graph already initialized\n";
+    return EXIT_SUCCESS;
   }
 
-  // must call finalize before querying the graph
-  graph->finalize();
+  if (init_python(python_script)) {
+    dc->cout() << "Python initialization failure.";
+    return EXIT_FAILURE;
+  }
+
+  graphlab::graphlab_options clopts = py_opts;
+  clopts.set_ncpus(num_threads);
+
+  // Build the graph ----------------------------------------------------------
+  graph = new graph_type(*dc, clopts);
+
+  long num_added;
+  {
+    PythonThreadLocker locker;
+    PyObject *pArgs = PyTuple_Pack(3, src, dst, edge_payload == NULL ? Py_None : edge_payload);
+    PyObject *arrays = call_pyfn(PYFN_EDGEARRAYS, pArgs);
+    Py_DECREF(pArgs);
+    num_added = add_edge_arrays(*graph, arrays, dc->procid(), dc->numprocs());
+    Py_XDECREF(arrays);
+  }
+
+  {
+    PythonThreadUnlocker unlocker;
+    // every machine drops the graph if any of them got invalid arrays, so
+    // that a corrected call can build it again
+    std::vector<int> valid(dc->numprocs(), 0);
+    valid[dc->procid()] = num_added >= 0;
+    dc->all_gather(valid);
+    if (std::count(valid.begin(), valid.end(), 0) > 0) {
+      dc->full_barrier();
+      delete graph;
+      graph = NULL;
+      dc->cout() << "Invalid edge arrays\n";
+      return EXIT_FAILURE;
+    }
+    // must call finalize before querying the graph
+    graph->finalize();
+  }
   dc->cout() << "#vertices: " << graph->num_vertices() << " #edges: " << graph->num_edges() << std::endl;
   graph_initialized = true;
 
@@ -554,31 +1931,467 @@ int transform_graph() {
     return EXIT_FAILURE;
   }
 
+  PythonThreadUnlocker unlocker;
 //  graph->transform_edges(transform_edge);
   graph->transform_vertices(transform_vertex);
   return EXIT_SUCCESS;
 }
 
-int gas_graph(const char *exec_type) {
+// Copies the entries of the options dict into opts: "ncpus" and "scheduler"
+// set the thread count and scheduler type, every other key is passed on as
+// an engine option (max_iterations, timeout, use_cache, nfibers, ...).
+int set_engine_options(graphlab::graphlab_options &opts, PyObject *options) {
+  if (options == NULL || options == Py_None) {
+    return EXIT_SUCCESS;
+  }
+  PythonThreadLocker locker;
+  if (!PyDict_Check(options)) {
+    dc->cout() << "Engine options must be a dict\n";
+    return EXIT_FAILURE;
+  }
+
+  PyObject *key, *value;
+  Py_ssize_t pos = 0;
+  while (PyDict_Next(options, &pos, &key, &value)) {
+    PyObject *str = PyObject_Str(value);
+    if (!PyString_Check(key) || str == NULL) {
+      PyErr_Clear();
+      Py_XDECREF(str);
+      dc->cout() << "Invalid engine option\n";
+      return EXIT_FAILURE;
+    }
+    const std::string opt(PyString_AS_STRING(key));
+    // options_map only recognizes lower case booleans
+    const std::string val(PyBool_Check(value) ? (value == Py_True ? "true" : "false")
+                                              : PyString_AS_STRING(str));
+    Py_DECREF(str);
+
+    if (opt == "ncpus") {
+      opts.set_ncpus(atoi(val.c_str()) > 0 ? atoi(val.c_str()) : 1);
+    } else if (opt == "scheduler") {
+      opts.set_scheduler_type(val);
+    } else {
+      opts.get_engine_args().set_option_str(opt, val);
+    }
+  }
+  return EXIT_SUCCESS;
+}
+
+// Adds the master vertices among ids to the frontier of the next gas_graph
+// with the given priority.  Must be called on all machines with the same ids.
+int signal_vertices(PyObject *ids, const double priority) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    return EXIT_FAILURE;
+  }
+
+  graphlab::vertex_set vset(false);
+  vset.make_explicit(*graph);
+  {
+    PythonThreadLocker locker;
+    PyObject *id_seq = PySequence_Fast(ids, "ids must be a sequence");
+    if (id_seq == NULL) {
+      PyErr_Print();
+      return EXIT_FAILURE;
+    }
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(id_seq); ++i) {
+      const graph_type::vertex_id_type gvid = PyInt_AsLong(PySequence_Fast_GET_ITEM(id_seq, i));
+      if (graph->is_master(gvid)) vset.set_lvid(graph->local_vid(gvid));
+    }
+    Py_DECREF(id_seq);
+  }
+  pending_signals.push_back(std::make_pair(vset, priority));
+  return EXIT_SUCCESS;
+}
+
+// Adds the vertices whose data satisfies predicate(vertexData) to the
+// frontier of the next gas_graph with the given priority.  Must be called on
+// all machines.
+int signal_where(PyObject *predicate, const double priority) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    return EXIT_FAILURE;
+  }
+
+  graphlab::vertex_set vset(false);
+  vset.make_explicit(*graph);
+  {
+    PythonThreadLocker locker;
+    for (graphlab::lvid_type lvid = 0; lvid < graph->num_local_vertices(); ++lvid) {
+      if (!graph->l_is_master(lvid)) continue;
+      PyObject *pArgs = PyTuple_New(1);
+      PyTuple_SetItem(pArgs, 0, graph->l_vertex(lvid).data().get());
+      PyObject *pValue = PyObject_CallObject(predicate, pArgs);
+      Py_DECREF(pArgs);
+      if (pValue == NULL) {
+        PyErr_Print();
+        continue;
+      }
+      if (PyObject_IsTrue(pValue) == 1) vset.set_lvid(lvid);
+      Py_DECREF(pValue);
+    }
+  }
+  pending_signals.push_back(std::make_pair(vset, priority));
+  return EXIT_SUCCESS;
+}
+
+// Appends edges to the finalized graph.  The arrays follow the conventions of
+// init_graph_from_arrays and every machine must pass the same ones.  Existing
+// vertex data is kept, new vertices are initialized with transformVertex, and
+// the endpoints of the new edges are added to the frontier of the next
+// gas_graph.  Relies on the dynamic local graph (USE_DYNAMIC_LOCAL_GRAPH).
+int add_edges(PyObject *src, PyObject *dst, PyObject *edge_payload) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    return EXIT_FAILURE;
+  }
+
+  const size_t old_num_local_vertices = graph->num_local_vertices();
+  PyObject *arrays;
+  long num_added;
+  {
+    PythonThreadLocker locker;
+    PyObject *pArgs = PyTuple_Pack(3, src, dst, edge_payload == NULL ? Py_None : edge_payload);
+    arrays = call_pyfn(PYFN_EDGEARRAYS, pArgs);
+    Py_DECREF(pArgs);
+    num_added = add_edge_arrays(*graph, arrays, dc->procid(), dc->numprocs());
+  }
+
+  graphlab::vertex_set new_vset(false);
+  {
+    PythonThreadUnlocker unlocker;
+    graph->finalize();
+
+    // only vertices new to the whole graph get new local masters
+    new_vset.make_explicit(*graph);
+    for (graphlab::lvid_type lvid = old_num_local_vertices; lvid < graph->num_local_vertices(); ++lvid) {
+      if (graph->l_is_master(lvid)) {
+        graph_type::vertex_type vertex(graph->l_vertex(lvid));
+        transform_vertex(vertex);
+        new_vset.set_lvid(lvid);
+      }
+    }
+    graph->synchronize(new_vset);
+  }
+  dc->cout() << "#vertices: " << graph->num_vertices() << " #edges: " << graph->num_edges() << std::endl;
+
+  graphlab::vertex_set touched(false);
+  touched.make_explicit(*graph);
+  {
+    PythonThreadLocker locker;
+    const void *src_data, *dst_data;
+    Py_ssize_t len;
+    if (num_added >= 0 &&
+        PyObject_AsReadBuffer(PyTuple_GET_ITEM(arrays, 0), &src_data, &len) == 0 &&
+        PyObject_AsReadBuffer(PyTuple_GET_ITEM(arrays, 1), &dst_data, &len) == 0) {
+      for (size_t i = 0; i < len / sizeof(int64_t); ++i) {
+        const graph_type::vertex_id_type ids[2] = {((const int64_t *)src_data)[i], ((const int64_t *)dst_data)[i]};
+        for (size_t j = 0; j < 2; ++j) {
+          if (graph->is_master(ids[j])) touched.set_lvid(graph->local_vid(ids[j]));
+        }
+      }
+    }
+    PyErr_Clear();
+    Py_XDECREF(arrays);
+  }
+  pending_signals.push_back(std::make_pair(touched, 1.0));
+
+  if (num_added < 0) {
+    dc->cout() << "Invalid edge arrays\n";
+    return EXIT_FAILURE;
+  }
+  return EXIT_SUCCESS;
+}
+
+// Runs the engine from the vertices signaled since the last run, or from all
+// vertices if there are none.  options is an optional dict handled by
+// set_engine_options and takes precedence over the engineOptions dict of the
+// user module.  Returns a dict with the elapsed seconds, the number of
+// updates, the number of iterations (None for the asynchronous engine) and the
+// number of vertices applied in each iteration, or None on failure.
+PyObject *gas_graph(const char *exec_type, PyObject *options = NULL) {
   if (!dc_initialized) {                      
     dc->cout() << "DC not initialized\n";
-    return EXIT_FAILURE;
+    Py_RETURN_NONE;
   }
   if (!graph_initialized) {
     dc->cout() << "Graph not initialized\n";
-    return EXIT_FAILURE;
+    Py_RETURN_NONE;
   }
 
   // Running The Engine -------------------------------------------------------
-  graphlab::command_line_options clopts("Python algorithm.");
-  clopts.set_ncpus(1);
+  // command line options, overridden by the module's engineOptions and then by options
+  graphlab::graphlab_options clopts = py_opts;
+  clopts.set_ncpus(num_threads);
+  if (set_engine_options(clopts, module_engine_options) || set_engine_options(clopts, options)) {
+    Py_RETURN_NONE;
+  }
 
-  graphlab::omni_engine<python_interface> engine(*dc, *graph, std::string(exec_type), clopts);
-  engine.signal_all();
-  engine.start();
-  const float runtime = engine.elapsed_seconds();
-  dc->cout() << "Finished Running engine in " << runtime << " seconds." << std::endl;
-  return EXIT_SUCCESS;
+  // lets scatter skip building gather deltas that no cache will receive
+  bool use_cache = false;
+  clopts.get_engine_args().get_option("use_cache", use_cache);
+  static long run_id = 0;
+  {
+    PythonThreadLocker locker;
+    PyObject *wrappers = PyImport_AddModule("wrappers");
+    PyObject_SetAttrString(wrappers, "useCache", use_cache ? Py_True : Py_False);
+    // e.g. for aggregators to reset statistics kept across finalize calls
+    PyObject *run = PyInt_FromLong(++run_id);
+    PyObject_SetAttrString(wrappers, "runId", run);
+    Py_DECREF(run);
+  }
+
+  float runtime;
+  size_t num_updates;
+  int iterations;
+  std::vector<size_t> active;
+  {
+    PythonThreadUnlocker unlocker;
+    iteration_active.clear();
+    graphlab::omni_engine<python_interface> engine(*dc, *graph, std::string(exec_type), clopts);
+    for (size_t i = 0; i < py_aggregators.size(); ++i) {
+      {
+        PythonThreadLocker locker;
+        PyList_SetSlice(py_aggregators[i].history, 0, PyList_GET_SIZE(py_aggregators[i].history), NULL);
+      }
+      if (py_aggregators[i].edges) {
+        engine.add_edge_aggregator<reduce_class>(
+            py_aggregators[i].name,
+            boost::function<reduce_class(icontext_type&, const graph_type::edge_type&)>(
+                boost::bind(aggregate_edge, py_aggregators[i].map_fn, _1, _2)),
+            boost::function<void(icontext_type&, const reduce_class&)>(
+                boost::bind(finalize_aggregator, i, _1, _2)));
+      } else {
+        engine.add_vertex_aggregator<reduce_class>(
+            py_aggregators[i].name,
+            boost::function<reduce_class(icontext_type&, const graph_type::vertex_type&)>(
+                boost::bind(aggregate_vertex, py_aggregators[i].map_fn, _1, _2)),
+            boost::function<void(icontext_type&, const reduce_class&)>(
+                boost::bind(finalize_aggregator, i, _1, _2)));
+      }
+      engine.aggregate_periodic(py_aggregators[i].name, py_aggregators[i].period);
+    }
+    if (pending_signals.empty()) {
+      engine.signal_all();
+    }
+    for (size_t i = 0; i < pending_signals.size(); ++i) {
+      engine.signal_vset(pending_signals[i].first, graphlab::messages::sum_priority(pending_signals[i].second));
+    }
+    pending_signals.clear();
+    engine.start();
+    runtime = engine.elapsed_seconds();
+    num_updates = engine.num_updates();
+    iterations = engine.iteration();
+    dc->cout() << "Finished Running engine in " << runtime << " seconds." << std::endl;
+    dc->cout() << "Total updates: " << num_updates << " ("
+               << num_updates / runtime << " updates/s)" << std::endl;
+
+    std::vector<std::vector<size_t> > all_active(dc->numprocs());
+    all_active[dc->procid()] = iteration_active;
+    dc->all_gather(all_active);
+    for (size_t i = 0; i < all_active.size(); ++i) {
+      if (active.size() < all_active[i].size()) active.resize(all_active[i].size(), 0);
+      for (size_t j = 0; j < all_active[i].size(); ++j) active[j] += all_active[i][j];
+    }
+  }
+
+  PythonThreadLocker locker;
+  PyObject *active_list = PyList_New(active.size());
+  for (size_t i = 0; i < active.size(); ++i) {
+    PyList_SET_ITEM(active_list, i, PyInt_FromSize_t(active[i]));
+  }
+  PyObject *stats = PyDict_New();
+  PyObject *value;
+  PyDict_SetItemString(stats, "elapsed", value = PyFloat_FromDouble(runtime));
+  Py_DECREF(value);
+  PyDict_SetItemString(stats, "updates", value = PyInt_FromSize_t(num_updates));
+  Py_DECREF(value);
+  if (iterations >= 0) {
+    PyDict_SetItemString(stats, "iterations", value = PyInt_FromLong(iterations));
+    Py_DECREF(value);
+  } else {
+    PyDict_SetItemString(stats, "iterations", Py_None);
+  }
+  PyDict_SetItemString(stats, "active_per_iteration", active_list);
+  Py_DECREF(active_list);
+  PyObject *histories = PyDict_New();
+  for (size_t i = 0; i < py_aggregators.size(); ++i) {
+    PyObject *history = PyList_GetSlice(py_aggregators[i].history, 0, PyList_GET_SIZE(py_aggregators[i].history));
+    PyDict_SetItemString(histories, py_aggregators[i].name.c_str(), history);
+    Py_DECREF(history);
+  }
+  PyDict_SetItemString(stats, "aggregators", histories);
+  Py_DECREF(histories);
+  return stats;
+}
+
+// Collects the data of the master vertices in gvids (all local masters when
+// gvids is NULL) from every machine and hands the shards to
+// wrappers.joinVertexShards together with ids and field_names.  Each machine
+// packs its shard through wrappers.vertexShard; typed records are passed to it
+// as one packed buffer.  With a root machine only that one receives the shards
+// and the others return None, otherwise (root < 0) every machine joins all of
+// them.  Must be called on all machines; the caller must hold the GIL when
+// running inside Python.  Returns a new reference.
+PyObject *collect_vertex_data(const std::vector<graph_type::vertex_id_type> *gvids,
+                              PyObject *ids, PyObject *field_names, const int root = -1) {
+  std::vector<graphlab::lvid_type> lvids;
+  if (gvids == NULL) {
+    for (graphlab::lvid_type lvid = 0; lvid < graph->num_local_vertices(); ++lvid) {
+      if (graph->l_is_master(lvid)) lvids.push_back(lvid);
+    }
+  } else {
+    for (size_t i = 0; i < gvids->size(); ++i) {
+      if (graph->is_master((*gvids)[i])) lvids.push_back(graph->local_vid((*gvids)[i]));
+    }
+  }
+
+  std::vector<std::string> shards(dc->numprocs());
+  {
+    PythonThreadLocker locker;
+    std::vector<int64_t> shard_ids(lvids.size());
+    for (size_t i = 0; i < lvids.size(); ++i) shard_ids[i] = graph->global_vid(lvids[i]);
+
+    PyObject *datas;
+    if (vertex_data_type::record_size > 0) {
+      const size_t record_size = vertex_data_type::record_size;
+      datas = PyString_FromStringAndSize(NULL, lvids.size() * record_size);
+      for (size_t i = 0; i < lvids.size(); ++i) {
+        memcpy(PyString_AS_STRING(datas) + i * record_size, graph->l_vertex(lvids[i]).data().record, record_size);
+      }
+    } else {
+      datas = PyList_New(lvids.size());
+      for (size_t i = 0; i < lvids.size(); ++i) {
+        PyList_SET_ITEM(datas, i, graph->l_vertex(lvids[i]).data().get());
+      }
+    }
+    PyObject *id_buf = PyString_FromStringAndSize(shard_ids.empty() ? NULL : (const char *)&shard_ids[0],
+                                                  shard_ids.size() * sizeof(int64_t));
+    PyObject *pArgs = PyTuple_Pack(3, id_buf, datas, field_names);
+    PyObject *shard = call_pyfn(PYFN_VERTEXSHARD, pArgs);
+    Py_DECREF(pArgs);
+    Py_DECREF(id_buf);
+    Py_DECREF(datas);
+    if (shard == NULL || !PyString_Check(shard)) {
+      PyErr_Print();
+      logstream(LOG_ERROR) << "vertexShard did not return a str" << std::endl;
+    } else {
+      shards[dc->procid()].assign(PyString_AS_STRING(shard), PyString_GET_SIZE(shard));
+    }
+    Py_XDECREF(shard);
+  }
+
+  {
+    PythonThreadUnlocker unlocker;
+    if (root < 0) {
+      dc->all_gather(shards);
+    } else {
+      dc->gather(shards, root);
+    }
+  }
+
+  PythonThreadLocker locker;
+  if (root >= 0 && dc->procid() != (graphlab::procid_t)root) {
+    Py_RETURN_NONE;
+  }
+  PyObject *shard_list = PyList_New(shards.size());
+  for (size_t i = 0; i < shards.size(); ++i) {
+    PyList_SET_ITEM(shard_list, i, PyString_FromStringAndSize(shards[i].data(), shards[i].size()));
+    std::string().swap(shards[i]);
+  }
+  PyObject *pArgs = PyTuple_Pack(3, shard_list, ids, field_names);
+  PyObject *result = call_pyfn(PYFN_JOINSHARDS, pArgs);
+  Py_DECREF(pArgs);
+  Py_DECREF(shard_list);
+  if (result == NULL) {
+    PyErr_Print();
+    Py_RETURN_NONE;
+  }
+  return result;
+}
+
+// Returns a dict with an "id" array holding every vertex id in ascending
+// order and one array per name in field_names with the matching field values,
+// all fields of the vertexDtype when field_names is None.  The dict is built
+// on machine root only, the others get None; root -1 builds it everywhere.
+PyObject *vertex_data_to_arrays(PyObject *field_names, const int root) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    Py_RETURN_NONE;
+  }
+  if (root < -1 || root >= (int)dc->numprocs()) {
+    dc->cout() << "Invalid root machine " << root << "\n";
+    Py_RETURN_NONE;
+  }
+  if (field_names == NULL || field_names == Py_None) {
+    if (vertex_data_type::record_size == 0) {
+      dc->cout() << "field_names is required without a vertexDtype\n";
+      Py_RETURN_NONE;
+    }
+    PyObject *names;
+    {
+      PythonThreadLocker locker;
+      names = PyObject_GetAttrString(vertex_data_type::record_dtype, "names");
+    }
+    PyObject *result = collect_vertex_data(NULL, Py_None, names, root);
+    PythonThreadLocker locker;
+    Py_XDECREF(names);
+    return result;
+  }
+  return collect_vertex_data(NULL, Py_None, field_names, root);
+}
+
+// Returns a list with the data of each vertex in ids, None for unknown ids.
+// Every machine must pass the same ids.
+PyObject *get_vertex_data(PyObject *ids) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    Py_RETURN_NONE;
+  }
+
+  PyObject *id_seq = PySequence_Fast(ids, "ids must be a sequence");
+  if (id_seq == NULL) {
+    PyErr_Print();
+    Py_RETURN_NONE;
+  }
+  std::vector<graph_type::vertex_id_type> gvids(PySequence_Fast_GET_SIZE(id_seq));
+  for (size_t i = 0; i < gvids.size(); ++i) {
+    gvids[i] = PyInt_AsLong(PySequence_Fast_GET_ITEM(id_seq, i));
+  }
+  Py_DECREF(id_seq);
+  return collect_vertex_data(&gvids, ids, Py_None);
+}
+
+// Maps every vertex through map_fn(vertexData) and returns the sum of the
+// results over the whole graph.  Must be called on all machines.
+PyObject *map_reduce_vertices(PyObject *map_fn) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    Py_RETURN_NONE;
+  }
+  reduce_class total;
+  {
+    PythonThreadUnlocker unlocker;
+    total = graph->map_reduce_vertices<reduce_class>(boost::bind(map_vertex_data, map_fn, _1));
+  }
+  PythonThreadLocker locker;
+  return total.get();
+}
+
+// Maps every edge through map_fn(srcData, targetData, edgeData) and returns
+// the sum of the results over the whole graph.  Must be called on all machines.
+PyObject *map_reduce_edges(PyObject *map_fn) {
+  if (!dc_initialized || !graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    Py_RETURN_NONE;
+  }
+  reduce_class total;
+  {
+    PythonThreadUnlocker unlocker;
+    total = graph->map_reduce_edges<reduce_class>(boost::bind(map_edge_data, map_fn, _1));
+  }
+  PythonThreadLocker locker;
+  return total.get();
 }
 
 int save_graph(const char *save_prefix, const int use_gzip, const int save_vertices, const int save_edges) {
@@ -591,10 +2404,143 @@ int save_graph(const char *save_prefix, const int use_gzip, const int save_verti
     return EXIT_FAILURE;
   }
 
+  PythonThreadUnlocker unlocker;
   graph->save(std::string(save_prefix), py_writer(), use_gzip, save_vertices, save_edges);  
   return EXIT_SUCCESS;
 }
 
+// Writes the shard at path with save_fn (saveVertexShard or saveEdgeShard)
+// once every machine has described its values with shardFormat, so that the
+// shards of all machines are either stacked .npy files of one shape and dtype
+// or .bin files.  Takes the reference to values, which is NULL when making
+// them failed on this machine.
+int save_shard(const int save_fn, const std::string &path, const std::vector<int64_t> &ids, PyObject *values) {
+  std::vector<std::string> formats(dc->numprocs());
+  {
+    PythonThreadLocker locker;
+    if (values != NULL) {
+      PyObject *pArgs = PyTuple_Pack(1, values);
+      PyObject *format = call_pyfn(PYFN_SHARDFORMAT, pArgs);
+      Py_DECREF(pArgs);
+      if (format == NULL || !PyString_Check(format)) {
+        PyErr_Print();
+        logstream(LOG_ERROR) << "shardFormat did not return a str" << std::endl;
+        Py_CLEAR(values);
+      } else {
+        formats[dc->procid()].assign(PyString_AS_STRING(format), PyString_GET_SIZE(format));
+      }
+      Py_XDECREF(format);
+    }
+  }
+
+  {
+    PythonThreadUnlocker unlocker;
+    dc->all_gather(formats);
+  }
+
+  PythonThreadLocker locker;
+  if (values == NULL) {
+    return EXIT_FAILURE;
+  }
+  PyObject *format_list = PyList_New(formats.size());
+  for (size_t i = 0; i < formats.size(); ++i) {
+    PyList_SET_ITEM(format_list, i, PyString_FromStringAndSize(formats[i].data(), formats[i].size()));
+  }
+  const char *id_bytes = ids.empty() ? "" : (const char *)&ids[0];
+  PyObject *pArgs = Py_BuildValue("(ss#NN)", path.c_str(), id_bytes, (Py_ssize_t)(ids.size() * sizeof(int64_t)),
+                                  values, format_list);
+  PyObject *pValue = call_pyfn(save_fn, pArgs);
+  Py_DECREF(pArgs);
+  if (pValue == NULL) {
+    PyErr_Print();
+    return EXIT_FAILURE;
+  }
+  Py_DECREF(pValue);
+  return EXIT_SUCCESS;
+}
+
+// Saves the graph as numpy shards which can be memory mapped, one set per
+// machine: save_prefix.vertices.<procid> with the vertices this machine
+// masters and save_prefix.edges.<procid> with its edges, see
+// wrappers.saveShard for the files.  saveVertex and saveEdge may return
+// numpy arrays or bytes; the machines agree on the format, see save_shard.
+int save_graph_binary(const char *save_prefix, const int save_vertices, const int save_edges) {
+  if (!dc_initialized) {
+    dc->cout() << "DC not initialized\n";
+    return EXIT_FAILURE;
+  }
+  if (!graph_initialized) {
+    dc->cout() << "Graph not initialized\n";
+    return EXIT_FAILURE;
+  }
+
+  const std::string shard = graphlab::tostr(dc->procid());
+  int ret = EXIT_SUCCESS;
+  if (save_vertices) {
+    std::vector<int64_t> ids;
+    PyObject *values;
+    {
+      PythonThreadLocker locker;
+      PyObject *datas = PyList_New(0);
+      for (graphlab::lvid_type lvid = 0; lvid < graph->num_local_vertices(); ++lvid) {
+        if (!graph->l_is_master(lvid)) continue;
+        ids.push_back(graph->global_vid(lvid));
+        PyObject *data = graph->l_vertex(lvid).data().get();
+        PyList_Append(datas, data);
+        Py_DECREF(data);
+      }
+      PyObject *pArgs = PyTuple_Pack(1, datas);
+      Py_DECREF(datas);
+      values = call_pyfn(PYFN_VERTEXSHARDVALUES, pArgs);
+      Py_DECREF(pArgs);
+      if (values == NULL) {
+        PyErr_Print();
+      }
+    }
+    if (save_shard(PYFN_SAVEVERTEXSHARD, std::string(save_prefix) + ".vertices." + shard, ids, values)
+        != EXIT_SUCCESS) {
+      ret = EXIT_FAILURE;
+    }
+  }
+
+  if (save_edges) {
+    std::vector<int64_t> ids;
+    PyObject *values;
+    {
+      PythonThreadLocker locker;
+      PyObject *src_datas = PyList_New(0);
+      PyObject *target_datas = PyList_New(0);
+      PyObject *edge_datas = PyList_New(0);
+      for (graphlab::lvid_type lvid = 0; lvid < graph->num_local_vertices(); ++lvid) {
+        foreach(graph_type::local_edge_type local_edge, graph->l_vertex(lvid).out_edges()) {
+          ids.push_back(local_edge.source().global_id());
+          ids.push_back(local_edge.target().global_id());
+          PyObject *datas[3] = {local_edge.source().data().get(), local_edge.target().data().get(),
+                                local_edge.data().get()};
+          PyList_Append(src_datas, datas[0]);
+          PyList_Append(target_datas, datas[1]);
+          PyList_Append(edge_datas, datas[2]);
+          for (size_t i = 0; i < 3; i++) Py_DECREF(datas[i]);
+        }
+      }
+      PyObject *pArgs = Py_BuildValue("(NNN)", src_datas, target_datas, edge_datas);
+      values = call_pyfn(PYFN_EDGESHARDVALUES, pArgs);
+      Py_DECREF(pArgs);
+      if (values == NULL) {
+        PyErr_Print();
+      }
+    }
+    if (save_shard(PYFN_SAVEEDGESHARD, std::string(save_prefix) + ".edges." + shard, ids, values)
+        != EXIT_SUCCESS) {
+      ret = EXIT_FAILURE;
+    }
+  }
+
+  PythonThreadUnlocker unlocker;
+  dc->full_barrier();
+  return ret;
+}
+
 int done_graph() {
   if (!dc_initialized) {                      
     dc->cout() << "DC not initialized\n";
@@ -619,11 +2565,53 @@ void done() {
     dc->cout() << "Graph still initialized\n";
     return;
   }
-  graphlab::mpi_tools::finalize();
+  if (mpi_initialized) {
+    graphlab::mpi_tools::finalize();
+    mpi_initialized = false;
+  }
   delete dc;
   dc_initialized = false;
 }
 
+void set_ncpus(const int ncpus) {
+  num_threads = ncpus > 0 ? ncpus : 1;
+}
+
+// Re-executes this binary nprocs times on the local machine, one process per
+// core, with SPAWNID/SPAWNNODES set so that init() builds the distributed
+// control from the environment instead of mpi.  Returns once all children exit.
+int spawn_local_procs(const size_t nprocs, char **argv) {
+  std::string nodes = "localhost";
+  for (size_t i = 1; i < nprocs; ++i) nodes += ",localhost";
+
+  std::vector<pid_t> children;
+  for (size_t i = 0; i < nprocs; ++i) {
+    pid_t pid = fork();
+    if (pid < 0) {
+      logstream(LOG_ERROR) << "Unable to fork worker process " << i << std::endl;
+      break;
+    }
+    if (pid == 0) {
+      setenv("SPAWNNODES", nodes.c_str(), 1);
+      setenv("SPAWNID", graphlab::tostr(i).c_str(), 1);
+      execv("/proc/self/exe", argv);
+      logstream(LOG_ERROR) << "Unable to exec worker process " << i << std::endl;
+      _exit(EXIT_FAILURE);
+    }
+    children.push_back(pid);
+  }
+
+  int ret = children.size() == nprocs ? EXIT_SUCCESS : EXIT_FAILURE;
+  for (size_t i = 0; i < children.size(); ++i) {
+    int status = 0;
+    if (waitpid(children[i], &status, 0) < 0 || !WIFEXITED(status) ||
+        WEXITSTATUS(status) != EXIT_SUCCESS) {
+      ret = EXIT_FAILURE;
+    }
+  }
+  return ret;
+}
+
 int main(int argc, char **argv) {
   graphlab::command_line_options clopts("Python algorithm.");
 
@@ -632,6 +2620,11 @@ int main(int argc, char **argv) {
   std::string format = "";
   std::string exec_type = "synchronous";
   std::string save_prefix = "";
+  std::string graph_cache = "";
+  std::string save_format = "tsv";
+  size_t nprocs = 1;
+  bool metrics = false;
+  bool profile = false;
 
   clopts.attach_option("script", python_script, "Python script. Required ");
   clopts.attach_option("graph", graph_dir, "The graph file. Required ");
@@ -641,20 +2634,63 @@ int main(int argc, char **argv) {
   clopts.attach_option("saveprefix", save_prefix,
                        "If set, will save the resultant pagerank to a "
                        "sequence of files with prefix saveprefix");
-
+  clopts.attach_option("save_format", save_format,
+                       "tsv writes the saveVertex strings as text, npy writes "
+                       "numpy shards with an id index per machine");
+  clopts.attach_option("graph_cache", graph_cache,
+                       "If set, a directory keeping binary snapshots of parsed "
+                       "graphs, which later runs on the same inputs load instead "
+                       "of parsing them again");
+  clopts.attach_option("procs", nprocs,
+                       "Number of local processes to start, one per core. "
+                       "Python callbacks are serialized by the GIL within a "
+                       "process, so this is the way to use several cores.");
+  clopts.attach_option("metrics", metrics,
+                       "If set, serve the metrics pages, including py_profile.json "
+                       "with the Python call profile, while running");
+  clopts.attach_option("profile", profile,
+                       "If set, print the Python call profile of the engine run");
+
+  // python callbacks hold the GIL, so one worker thread per process is the default
+  clopts.set_ncpus(1);
   if(!clopts.parse(argc, argv)) {
-    dc->cout() << "Error in parsing command line arguments." << std::endl;
+    std::cerr << "Error in parsing command line arguments." << std::endl;
     return EXIT_FAILURE;
   }
+  set_ncpus(clopts.get_ncpus());
+  py_opts = clopts;
+
+  if (nprocs > 1 && getenv("SPAWNID") == NULL) {
+    return spawn_local_procs(nprocs, argv);
+  }
 
   init();
+  if (metrics) launch_metrics();
+  set_graph_cache(graph_cache.c_str());
   init_graph(graph_dir.c_str(), format.c_str(), python_script.c_str());
   transform_graph();
-  gas_graph(exec_type.c_str());
-  save_graph(save_prefix.c_str(), 0, 1, 0);
+  reset_profile();
+  PyObject *stats = gas_graph(exec_type.c_str());
+  if (profile) print_profile();
+  {
+    PythonThreadLocker locker;
+    Py_XDECREF(stats);
+  }
+  if (save_format == "npy") {
+    if (!save_prefix.empty()) save_graph_binary(save_prefix.c_str(), 1, 0);
+  } else {
+    save_graph(save_prefix.c_str(), 0, 1, 0);
+  }
+  if (metrics) stop_metrics();
   done_graph();
   done();
 
+  // runs the atexit handlers of the Python modules
+  if (Py_IsInitialized()) {
+    PyGILState_Ensure();
+    Py_Finalize();
+  }
+
   return EXIT_SUCCESS;
 } 
 
@@ -3,11 +3,28 @@
 %{
 void init();
 int init_graph(const char *graph_dir, const char *format, const char *python_script);
+int init_graph_from_arrays(PyObject *src, PyObject *dst, const char *python_script, PyObject *edge_payload = Py_None);
 int transform_graph();
-int gas_graph(const char *exec_type);
+PyObject *gas_graph(const char *exec_type, PyObject *options = NULL);
+int signal_vertices(PyObject *ids, const double priority = 1.0);
+int signal_where(PyObject *predicate, const double priority = 1.0);
+int add_edges(PyObject *src, PyObject *dst, PyObject *edge_payload = Py_None);
+int add_aggregator(const char *name, const char *kind, PyObject *map_fn, PyObject *finalize_fn,
+                   const float period);
+PyObject *map_reduce_vertices(PyObject *map_fn);
+PyObject *map_reduce_edges(PyObject *map_fn);
 int save_graph(const char *save_prefix, const int use_gzip, const int save_vertices, const int save_edges);
+int save_graph_binary(const char *save_prefix, const int save_vertices, const int save_edges);
 int done_graph();
 void done();
+void set_ncpus(const int ncpus);
+void set_graph_cache(const char *cache_dir);
+PyObject *vertex_data_to_arrays(PyObject *field_names = Py_None, const int root = 0);
+PyObject *get_vertex_data(PyObject *ids);
+PyObject *get_profile();
+void reset_profile();
+void launch_metrics();
+void stop_metrics();
 %}
 
 %init %{
@@ -17,9 +34,145 @@ void done();
 
 void init();
 int init_graph(const char *graph_dir, const char *format, const char *python_script);
+int init_graph_from_arrays(PyObject *src, PyObject *dst, const char *python_script, PyObject *edge_payload = Py_None);
 int transform_graph();
-int gas_graph(const char *exec_type);
+PyObject *gas_graph(const char *exec_type, PyObject *options = NULL);
+int signal_vertices(PyObject *ids, const double priority = 1.0);
+int signal_where(PyObject *predicate, const double priority = 1.0);
+int add_edges(PyObject *src, PyObject *dst, PyObject *edge_payload = Py_None);
+int add_aggregator(const char *name, const char *kind, PyObject *map_fn, PyObject *finalize_fn,
+                   const float period);
+PyObject *map_reduce_vertices(PyObject *map_fn);
+PyObject *map_reduce_edges(PyObject *map_fn);
 int save_graph(const char *save_prefix, const int use_gzip, const int save_vertices, const int save_edges);
+int save_graph_binary(const char *save_prefix, const int save_vertices, const int save_edges);
 int done_graph();
 void done();
+void set_ncpus(const int ncpus);
+void set_graph_cache(const char *cache_dir);
+PyObject *vertex_data_to_arrays(PyObject *field_names = Py_None, const int root = 0);
+PyObject *get_vertex_data(PyObject *ids);
+PyObject *get_profile();
+void reset_profile();
+void launch_metrics();
+void stop_metrics();
 
+%pythoncode %{
+import os as _os
+import sys as _sys
+import subprocess as _subprocess
+import tempfile as _tempfile
+import threading as _threading
+import time as _time
+import cPickle as _cPickle
+
+# Run by each worker process of launch().  Importing py_graphlab connects the
+# worker to the others through SPAWNID/SPAWNNODES.
+_LAUNCH_WORKER = """
+import cPickle, os, sys
+import py_graphlab
+params = cPickle.load(open(sys.argv[1], "rb"))
+py_graphlab.set_ncpus(params["ncpus"])
+py_graphlab.set_graph_cache(params["graph_cache"] or "")
+if py_graphlab.init_graph(params["graph"], params["format"], params["script"]) != 0:
+    sys.exit(1)
+py_graphlab.transform_graph()
+result = py_graphlab.gas_graph(params["engine"], params["options"])
+if result is None:
+    sys.exit(1)
+if params["fields"] is not None:
+    result["vertices"] = py_graphlab.vertex_data_to_arrays(params["fields"])
+if params["save_prefix"] and params["save_format"] == "npy":
+    py_graphlab.save_graph_binary(params["save_prefix"], 1, 0)
+elif params["save_prefix"]:
+    py_graphlab.save_graph(params["save_prefix"], 0, 1, 0)
+py_graphlab.done_graph()
+if os.environ["SPAWNID"] == "0":
+    cPickle.dump(result, open(sys.argv[2], "wb"), cPickle.HIGHEST_PROTOCOL)
+"""
+
+def _stream_log(procid, pipe, out):
+    for line in iter(pipe.readline, ""):
+        out.write("[%d] %s" % (procid, line))
+        out.flush()
+    pipe.close()
+
+def launch(nprocs, script, graph, engine="synchronous", options=None, ncpus=1,
+           fields=None, save_prefix=None, save_format="tsv", format="", graph_cache=None,
+           log=None):
+    """Runs script on graph in nprocs local worker processes and returns the
+    gas_graph statistics of the run.
+
+    The workers connect to each other through SPAWNID/SPAWNNODES, as under
+    scripts/rpcexec.py, and use ports 10000 to 10000+nprocs-1.  Their output
+    is written to log (sys.stdout by default) prefixed with the process id.
+    With fields, the result also holds vertex_data_to_arrays(fields) under
+    "vertices".  With save_prefix the vertices are saved as text
+    (save_format "tsv") or numpy shards ("npy").  graph_cache is passed to set_graph_cache.  Raises
+    RuntimeError when a worker fails.
+    """
+    out = _sys.stdout if log is None else log
+    workdir = _tempfile.mkdtemp(prefix="py_graphlab_launch")
+    paramsPath = _os.path.join(workdir, "params")
+    resultPath = _os.path.join(workdir, "result")
+    params = {"script": script, "graph": graph, "format": format, "engine": engine,
+              "options": options, "ncpus": ncpus, "fields": fields, "save_prefix": save_prefix,
+              "save_format": save_format, "graph_cache": graph_cache}
+    _cPickle.dump(params, open(paramsPath, "wb"), _cPickle.HIGHEST_PROTOCOL)
+
+    env = dict(_os.environ)
+    env["SPAWNNODES"] = ",".join(["localhost"] * nprocs)
+    # workers import this module and the user script as the caller does
+    env["PYTHONPATH"] = _os.pathsep.join([_os.path.dirname(_os.path.abspath(__file__)), _os.getcwd()] +
+                                         [p for p in _sys.path if p])
+    procs = []
+    loggers = []
+    try:
+        for i in range(nprocs):
+            env["SPAWNID"] = str(i)
+            proc = _subprocess.Popen([_sys.executable, "-c", _LAUNCH_WORKER, paramsPath, resultPath],
+                                     env=dict(env), stdout=_subprocess.PIPE, stderr=_subprocess.STDOUT)
+            procs.append(proc)
+            logger = _threading.Thread(target=_stream_log, args=(i, proc.stdout, out))
+            logger.daemon = True
+            logger.start()
+            loggers.append(logger)
+        # a failed worker would leave the others waiting for it, stop them all
+        codes = [None] * nprocs
+        while None in codes and not any(codes):
+            _time.sleep(0.1)
+            codes = [proc.poll() for proc in procs]
+        if any(codes):
+            raise RuntimeError("py_graphlab workers exited with %s" % codes)
+        for logger in loggers:
+            logger.join()
+        return _cPickle.load(open(resultPath, "rb"))
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        for path in (paramsPath, resultPath):
+            if _os.path.exists(path):
+                _os.remove(path)
+        _os.rmdir(workdir)
+
+def load_shards(prefix, kind="vertices"):
+    """Returns (ids, values) of each shard written by save_graph_binary for
+    prefix, in machine order.  kind is "vertices" or "edges".  Arrays are
+    memory mapped; byte values are returned as (data, offsets) arrays."""
+    import glob
+    import numpy
+    shards = []
+    for idsPath in sorted(glob.glob("%s.%s.*.ids.npy" % (prefix, kind)),
+                          key=lambda p: int(p[:-len(".ids.npy")].rsplit(".", 1)[1])):
+        path = idsPath[:-len(".ids.npy")]
+        ids = numpy.load(idsPath, mmap_mode="r")
+        if _os.path.exists(path + ".npy"):
+            values = numpy.load(path + ".npy", mmap_mode="r")
+        else:
+            values = (numpy.memmap(path + ".bin", dtype=numpy.uint8, mode="r")
+                      if _os.path.getsize(path + ".bin") > 0 else numpy.zeros(0, dtype=numpy.uint8),
+                      numpy.load(path + ".offsets.npy", mmap_mode="r"))
+        shards.append((ids, values))
+    return shards
+%}
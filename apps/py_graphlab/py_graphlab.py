@@ -76,6 +76,10 @@ def init_graph(*args):
   return _py_graphlab.init_graph(*args)
 init_graph = _py_graphlab.init_graph
 
+def init_graph_from_arrays(*args):
+  return _py_graphlab.init_graph_from_arrays(*args)
+init_graph_from_arrays = _py_graphlab.init_graph_from_arrays
+
 def transform_graph():
   return _py_graphlab.transform_graph()
 transform_graph = _py_graphlab.transform_graph
@@ -84,10 +88,38 @@ def gas_graph(*args):
   return _py_graphlab.gas_graph(*args)
 gas_graph = _py_graphlab.gas_graph
 
+def signal_vertices(*args):
+  return _py_graphlab.signal_vertices(*args)
+signal_vertices = _py_graphlab.signal_vertices
+
+def signal_where(*args):
+  return _py_graphlab.signal_where(*args)
+signal_where = _py_graphlab.signal_where
+
+def add_edges(*args):
+  return _py_graphlab.add_edges(*args)
+add_edges = _py_graphlab.add_edges
+
+def add_aggregator(*args):
+  return _py_graphlab.add_aggregator(*args)
+add_aggregator = _py_graphlab.add_aggregator
+
+def map_reduce_vertices(*args):
+  return _py_graphlab.map_reduce_vertices(*args)
+map_reduce_vertices = _py_graphlab.map_reduce_vertices
+
+def map_reduce_edges(*args):
+  return _py_graphlab.map_reduce_edges(*args)
+map_reduce_edges = _py_graphlab.map_reduce_edges
+
 def save_graph(*args):
   return _py_graphlab.save_graph(*args)
 save_graph = _py_graphlab.save_graph
 
+def save_graph_binary(*args):
+  return _py_graphlab.save_graph_binary(*args)
+save_graph_binary = _py_graphlab.save_graph_binary
+
 def done_graph():
   return _py_graphlab.done_graph()
 done_graph = _py_graphlab.done_graph
@@ -95,6 +127,157 @@ done_graph = _py_graphlab.done_graph
 def done():
   return _py_graphlab.done()
 done = _py_graphlab.done
+
+def set_ncpus(*args):
+  return _py_graphlab.set_ncpus(*args)
+set_ncpus = _py_graphlab.set_ncpus
+
+def set_graph_cache(*args):
+  return _py_graphlab.set_graph_cache(*args)
+set_graph_cache = _py_graphlab.set_graph_cache
+
+def vertex_data_to_arrays(*args):
+  return _py_graphlab.vertex_data_to_arrays(*args)
+vertex_data_to_arrays = _py_graphlab.vertex_data_to_arrays
+
+def get_vertex_data(*args):
+  return _py_graphlab.get_vertex_data(*args)
+get_vertex_data = _py_graphlab.get_vertex_data
+
+def get_profile():
+  return _py_graphlab.get_profile()
+get_profile = _py_graphlab.get_profile
+
+def reset_profile():
+  return _py_graphlab.reset_profile()
+reset_profile = _py_graphlab.reset_profile
+
+def launch_metrics():
+  return _py_graphlab.launch_metrics()
+launch_metrics = _py_graphlab.launch_metrics
+
+def stop_metrics():
+  return _py_graphlab.stop_metrics()
+stop_metrics = _py_graphlab.stop_metrics
+
+import os as _os
+import sys as _sys
+import subprocess as _subprocess
+import tempfile as _tempfile
+import threading as _threading
+import time as _time
+import cPickle as _cPickle
+
+# Run by each worker process of launch().  Importing py_graphlab connects the
+# worker to the others through SPAWNID/SPAWNNODES.
+_LAUNCH_WORKER = """
+import cPickle, os, sys
+import py_graphlab
+params = cPickle.load(open(sys.argv[1], "rb"))
+py_graphlab.set_ncpus(params["ncpus"])
+py_graphlab.set_graph_cache(params["graph_cache"] or "")
+if py_graphlab.init_graph(params["graph"], params["format"], params["script"]) != 0:
+    sys.exit(1)
+py_graphlab.transform_graph()
+result = py_graphlab.gas_graph(params["engine"], params["options"])
+if result is None:
+    sys.exit(1)
+if params["fields"] is not None:
+    result["vertices"] = py_graphlab.vertex_data_to_arrays(params["fields"])
+if params["save_prefix"] and params["save_format"] == "npy":
+    py_graphlab.save_graph_binary(params["save_prefix"], 1, 0)
+elif params["save_prefix"]:
+    py_graphlab.save_graph(params["save_prefix"], 0, 1, 0)
+py_graphlab.done_graph()
+if os.environ["SPAWNID"] == "0":
+    cPickle.dump(result, open(sys.argv[2], "wb"), cPickle.HIGHEST_PROTOCOL)
+"""
+
+def _stream_log(procid, pipe, out):
+    for line in iter(pipe.readline, ""):
+        out.write("[%d] %s" % (procid, line))
+        out.flush()
+    pipe.close()
+
+def launch(nprocs, script, graph, engine="synchronous", options=None, ncpus=1,
+           fields=None, save_prefix=None, save_format="tsv", format="", graph_cache=None,
+           log=None):
+    """Runs script on graph in nprocs local worker processes and returns the
+    gas_graph statistics of the run.
+
+    The workers connect to each other through SPAWNID/SPAWNNODES, as under
+    scripts/rpcexec.py, and use ports 10000 to 10000+nprocs-1.  Their output
+    is written to log (sys.stdout by default) prefixed with the process id.
+    With fields, the result also holds vertex_data_to_arrays(fields) under
+    "vertices".  With save_prefix the vertices are saved as text
+    (save_format "tsv") or numpy shards ("npy").  graph_cache is passed to set_graph_cache.  Raises
+    RuntimeError when a worker fails.
+    """
+    out = _sys.stdout if log is None else log
+    workdir = _tempfile.mkdtemp(prefix="py_graphlab_launch")
+    paramsPath = _os.path.join(workdir, "params")
+    resultPath = _os.path.join(workdir, "result")
+    params = {"script": script, "graph": graph, "format": format, "engine": engine,
+              "options": options, "ncpus": ncpus, "fields": fields, "save_prefix": save_prefix,
+              "save_format": save_format, "graph_cache": graph_cache}
+    _cPickle.dump(params, open(paramsPath, "wb"), _cPickle.HIGHEST_PROTOCOL)
+
+    env = dict(_os.environ)
+    env["SPAWNNODES"] = ",".join(["localhost"] * nprocs)
+    # workers import this module and the user script as the caller does
+    env["PYTHONPATH"] = _os.pathsep.join([_os.path.dirname(_os.path.abspath(__file__)), _os.getcwd()] +
+                                         [p for p in _sys.path if p])
+    procs = []
+    loggers = []
+    try:
+        for i in range(nprocs):
+            env["SPAWNID"] = str(i)
+            proc = _subprocess.Popen([_sys.executable, "-c", _LAUNCH_WORKER, paramsPath, resultPath],
+                                     env=dict(env), stdout=_subprocess.PIPE, stderr=_subprocess.STDOUT)
+            procs.append(proc)
+            logger = _threading.Thread(target=_stream_log, args=(i, proc.stdout, out))
+            logger.daemon = True
+            logger.start()
+            loggers.append(logger)
+        # a failed worker would leave the others waiting for it, stop them all
+        codes = [None] * nprocs
+        while None in codes and not any(codes):
+            _time.sleep(0.1)
+            codes = [proc.poll() for proc in procs]
+        if any(codes):
+            raise RuntimeError("py_graphlab workers exited with %s" % codes)
+        for logger in loggers:
+            logger.join()
+        return _cPickle.load(open(resultPath, "rb"))
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        for path in (paramsPath, resultPath):
+            if _os.path.exists(path):
+                _os.remove(path)
+        _os.rmdir(workdir)
+
+def load_shards(prefix, kind="vertices"):
+    """Returns (ids, values) of each shard written by save_graph_binary for
+    prefix, in machine order.  kind is "vertices" or "edges".  Arrays are
+    memory mapped; byte values are returned as (data, offsets) arrays."""
+    import glob
+    import numpy
+    shards = []
+    for idsPath in sorted(glob.glob("%s.%s.*.ids.npy" % (prefix, kind)),
+                          key=lambda p: int(p[:-len(".ids.npy")].rsplit(".", 1)[1])):
+        path = idsPath[:-len(".ids.npy")]
+        ids = numpy.load(idsPath, mmap_mode="r")
+        if _os.path.exists(path + ".npy"):
+            values = numpy.load(path + ".npy", mmap_mode="r")
+        else:
+            values = (numpy.memmap(path + ".bin", dtype=numpy.uint8, mode="r")
+                      if _os.path.getsize(path + ".bin") > 0 else numpy.zeros(0, dtype=numpy.uint8),
+                      numpy.load(path + ".offsets.npy", mmap_mode="r"))
+        shards.append((ids, values))
+    return shards
+
 # This file is compatible with both classic and new-style classes.
 
 
@@ -1,3 +1,5 @@
+import wrappers;
+
 class vertexDataClass:
 	pr = 1.0;
 	prDelta = 0.0;
@@ -33,8 +35,11 @@ def apply(targetData, aggInst, numIn, numOut):
 	return vertexDataClass(newval, delta);
 
 def scatter(srcData, targetData, edgeData, numIn, numOut):
+    # the change of this vertex's contribution keeps a cached gather of the
+    # target up to date when running with --engine_opts use_cache=true
+    delta = aggregatorClass(0.85*srcData.prDelta/numOut) if wrappers.useCache else None;
     if abs(srcData.prDelta) > 0.01:
-        return (1.0, None, None);
+        return (1.0, None, None, delta);
     else:
-        return (-1.0, None, None);
+        return (-1.0, None, None, delta);
 
@@ -1,13 +1,60 @@
 import cPickle;
+import array;
+import hashlib;
+import os;
+import sys;
+
+try:
+	import numpy;
+except ImportError:
+	numpy = None;
 
 usermod = None;
+procId = 0;    # this machine and the number of machines, set by the bridge
+numProcs = 1;
 
 gatherEdges = 1;  # by default: gather on incoming edges
 scatterEdges = 2; # by default: scatter on outgoing edges
+hasGatherBatch = False;  # the user module defines gather_batch
+hasShouldScatter = False;  # the user module defines should_scatter
+hasScatterBatch = False;   # the user module defines scatter_batch
+hasParseEdges = False;   # the user module defines parseEdges
+parseBlockSize = None;   # bytes per parseEdges block, None keeps the bridge default
+engineOptions = None;    # default engine options for gas_graph, e.g. {"use_cache": True}
+useCache = False;        # the current gas_graph runs with use_cache, set by the bridge
+runId = 0;               # number of the current gas_graph run in this process, set by the bridge
+aggregators = [];        # periodic aggregators, (name, "vertex"|"edge", map, finalize, seconds)
+
+# Typed storage: when the user module declares a numpy structured dtype as
+# vertexDtype/edgeDtype, the bridge keeps the data in fixed size C++ records
+# and user functions receive numpy.record copies with attribute access to the
+# fields, which may be kept after the call.  A function stores changes by
+# returning the record or a tuple of field values; apply may also modify its
+# target in place and return None.
+vertexDtype = None;
+edgeDtype = None;
+
+# Native kernels: with typed storage the user module may declare parts of the
+# vertex program as expressions over record fields, which the bridge compiles
+# and runs without calling into Python, e.g.
+#   kernels = {"gather": "DAMPING*src.pr/numOut", "merge": "sum",
+#              "apply": ["prDelta = total+0.15-target.pr", "pr = total+0.15"],
+#              "scatter": "abs(src.prDelta) > TOLERANCE",
+#              "delta": "DAMPING*src.prDelta/numOut"};
+# Gather and scatter see src, target and edge fields and the degrees of src;
+# apply sees the target fields, its degrees and the merged total.  A scatter
+# value above 0 signals the target with that priority, so that a comparison
+# (1 or 0) can be used directly; unlike a Python scatter, which signals at 0
+# or more, a scatter kernel of 0 does not signal.  Numeric globals of the
+# user module may be used by name.  Missing parts run in Python; with a merge
+# kernel Python gather and apply exchange plain floats.
+kernels = None;
 
 def initUserModule(name):
 	global usermod;
 	usermod = __import__(name);
+	# start from the defaults, a previous user module may have replaced them
+	globals().update(_moduleDefaults);
 
 	global gatherEdges;
 	if "gatherEdges" in dir(usermod):
@@ -16,8 +63,107 @@ def initUserModule(name):
 	global scatterEdges;
 	if "scatterEdges" in dir(usermod):
 		scatterEdges = usermod.scatterEdges;
+
+	global hasGatherBatch;
+	hasGatherBatch = "gather_batch" in dir(usermod);
+
+	global hasShouldScatter;
+	hasShouldScatter = "should_scatter" in dir(usermod);
+
+	global hasScatterBatch;
+	hasScatterBatch = "scatter_batch" in dir(usermod);
+
+	global hasParseEdges;
+	hasParseEdges = "parseEdges" in dir(usermod);
+
+	global parseBlockSize;
+	if "parseBlockSize" in dir(usermod):
+		parseBlockSize = usermod.parseBlockSize;
+
+	global engineOptions;
+	if "engineOptions" in dir(usermod):
+		engineOptions = usermod.engineOptions;
+
+	global aggregators;
+	if "aggregators" in dir(usermod):
+		aggregators = usermod.aggregators;
+
+	global kernels;
+	if "kernels" in dir(usermod):
+		kernels = usermod.kernels;
+
+	global vertexDtype;
+	if "vertexDtype" in dir(usermod):
+		vertexDtype = recordDtype(usermod.vertexDtype);
+
+	global edgeDtype;
+	if "edgeDtype" in dir(usermod):
+		edgeDtype = recordDtype(usermod.edgeDtype);
+
+	# user supplied encoders replace pickling, they must return a str or
+	# another object exporting a buffer
+	for fnName in ("storeVertex", "loadVertex", "storeEdge", "loadEdge", "storeAgg", "loadAgg"):
+		if fnName in dir(usermod):
+			globals()[fnName] = getattr(usermod, fnName);
+
+	# the bridge calls user functions directly rather than through the
+	# forwarding functions below, saving a Python frame per call
+	for fnName in ("transformVertex", "transformEdge", "saveVertex", "saveEdge",
+	             "gather", "apply", "scatter", "parseEdge"):
+		if fnName in dir(usermod):
+			globals()[fnName] = getattr(usermod, fnName);
+	for fnName, userName in (("shouldScatter", "should_scatter"), ("scatterBatch", "scatter_batch")):
+		if userName in dir(usermod):
+			globals()[fnName] = getattr(usermod, userName);
 	return "edgeDataClass" in dir(usermod);
 
+def recordDtype(dtype):
+	return numpy.dtype((numpy.record, numpy.dtype(dtype)));
+
+def recordLayout(dtype):
+	# (name, offset, kind, itemsize) of the scalar numeric fields usable in kernels
+	layout = [];
+	for name in dtype.names:
+		fieldType, offset = dtype.fields[name][:2];
+		if fieldType.shape != () or not fieldType.isnative or fieldType.kind not in "fiub":
+			continue;
+		if fieldType.kind == "f" and fieldType.itemsize not in (4, 8):
+			continue;
+		layout.append((name, offset, fieldType.kind, fieldType.itemsize));
+	return layout;
+
+def kernelConstants():
+	return dict((name, float(value)) for name, value in vars(usermod).items()
+	            if isinstance(value, (int, long, float)) and not name.startswith("_"));
+
+def moduleSource(mod):
+	path = mod.__file__;
+	if path.endswith(".pyc") or path.endswith(".pyo"):
+		path = path[:-1];
+	return open(path, "rb").read();
+
+def graphCacheKey(prefix, format, numProcs):
+	# identifies a parsed graph by the names, sizes and modification times of
+	# the files matching prefix, the source of the user module and of this
+	# module, the record dtypes, the format and the number of machines, which
+	# must not change between saving and loading a snapshot
+	if prefix.startswith("hdfs://"):
+		return None;
+	if os.path.isdir(prefix):
+		directory, search = prefix, "";
+	else:
+		directory, search = os.path.dirname(prefix) or ".", os.path.basename(prefix);
+	h = hashlib.sha1();
+	for name in sorted(os.listdir(directory)):
+		path = os.path.join(directory, name);
+		if name.startswith(search) and os.path.isfile(path):
+			st = os.stat(path);
+			h.update("%s %d %r\n" % (os.path.abspath(path), st.st_size, st.st_mtime));
+	h.update(moduleSource(usermod));
+	h.update(moduleSource(sys.modules[__name__]));
+	h.update(repr((vertexDtype, edgeDtype, format, numProcs)));
+	return h.hexdigest();
+
 def newVertex():
 	return usermod.vertexDataClass();
 
@@ -25,7 +171,7 @@ def loadVertex(vertexWrap):
 	return cPickle.loads(vertexWrap);
 
 def storeVertex(vertex):
-	return cPickle.dumps(vertex);
+	return cPickle.dumps(vertex, cPickle.HIGHEST_PROTOCOL);
 
 def newEdge():
 	return usermod.edgeDataClass();
@@ -34,7 +180,7 @@ def loadEdge(edgeWrap):
 	return cPickle.loads(edgeWrap);
 
 def storeEdge(edge):
-	return cPickle.dumps(edge);
+	return cPickle.dumps(edge, cPickle.HIGHEST_PROTOCOL);
 
 def newAgg():
 	return usermod.aggregatorClass();
@@ -43,7 +189,24 @@ def loadAgg(aggWrap):
 	return cPickle.loads(aggWrap);
 
 def storeAgg(agg):
-	return cPickle.dumps(agg);
+	return cPickle.dumps(agg, cPickle.HIGHEST_PROTOCOL);
+
+def newObj():
+	return None;
+
+def loadObj(objWrap):
+	return cPickle.loads(objWrap);
+
+def storeObj(obj):
+	return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL);
+
+def combine(a, b):
+	# reduction of map-reduce and aggregator results, None is the identity
+	if a is None:
+		return b;
+	if b is None:
+		return a;
+	return a + b;
 
 def gatherAgg(agg1, agg2):
 	agg1.merge(agg2);
@@ -61,14 +224,207 @@ def saveVertex(vertex):
 def saveEdge(src, target, edge):
 	return usermod.saveEdge(src, target, edge);
 
+def savedValue(data):
+	# value saved in binary shards without a saveVertex/saveEdge: typed
+	# records as they are, other data pickled
+	if isinstance(data, numpy.generic):
+		return data;
+	return cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL);
+
+def defaultData(dtype, className):
+	# a fresh vertex or edge value, None if the module declares neither
+	if dtype is not None:
+		return numpy.zeros(1, dtype=dtype)[0];
+	if className in dir(usermod):
+		return getattr(usermod, className)();
+	return None;
+
+def shardFormat(values):
+	# How saveShard could store values on their own: "" without values, "bin"
+	# when they are bytes, None or of several shapes or dtypes, else their
+	# pickled (shape, dtype).  The bridge gathers the format of every
+	# machine's shard so that all of them are written alike, see shardKind.
+	if len(values) == 0:
+		return "";
+	if any(v is None or isinstance(v, basestring) for v in values):
+		return "bin";
+	kinds = set((numpy.shape(v), numpy.asarray(v).dtype) for v in values);
+	if len(kinds) > 1 or kinds.pop()[1].hasobject:
+		return "bin";
+	a = numpy.asarray(values[0]);
+	return cPickle.dumps((a.shape, a.dtype), cPickle.HIGHEST_PROTOCOL);
+
+def shardKind(formats, emptyValue = None):
+	# the (shape, dtype) all shards are stacked with given the shardFormat of
+	# each, None when they are written as bytes.  Without any values the kind
+	# comes from emptyValue, float64 numbers when that is None.
+	formats = set(f for f in formats if f != "");
+	if len(formats) == 0:
+		if emptyValue is None:
+			return ((), numpy.dtype(numpy.float64));
+		formats.add(shardFormat([emptyValue]));
+	if "bin" in formats:
+		return None;
+	kinds = set(cPickle.loads(f) for f in formats);
+	return kinds.pop() if len(kinds) == 1 else None;
+
+def saveShard(path, ids, values, kind):
+	# Writes path.ids.npy and the values, one per id.  With a kind of
+	# (shape, dtype) from shardKind the values are stacked in path.npy.
+	# Otherwise each value is written as bytes to path.bin, value i in
+	# [offsets[i], offsets[i+1]) of the int64 offsets in path.offsets.npy,
+	# with no bytes for None; other Python objects raise a TypeError.
+	numpy.save(path + ".ids.npy", ids);
+	if kind is not None:
+		shape, dtype = kind;
+		numpy.save(path + ".npy", numpy.array(values, dtype=dtype) if values else numpy.empty((0,) + shape, dtype=dtype));
+		return;
+	offsets = numpy.zeros(len(values)+1, dtype=numpy.int64);
+	f = open(path + ".bin", "wb");
+	for i, v in enumerate(values):
+		if v is None:
+			v = "";
+		elif not isinstance(v, basestring):
+			a = numpy.asarray(v);
+			if a.dtype.hasobject:
+				f.close();
+				raise TypeError("cannot save %r in a binary shard, return a str or a numeric array" % (v,));
+			v = a.tostring();
+		f.write(v);
+		offsets[i+1] = offsets[i]+len(v);
+	f.close();
+	numpy.save(path + ".offsets.npy", offsets);
+
+def vertexShardValues(datas):
+	# the values saveVertexShard writes for datas
+	save = usermod.saveVertex if "saveVertex" in dir(usermod) else savedValue;
+	return [save(d) for d in datas];
+
+def edgeShardValues(srcDatas, targetDatas, edgeDatas):
+	# the values saveEdgeShard writes for the edges
+	if "saveEdge" in dir(usermod):
+		save = lambda src, target, edge: usermod.saveEdge(src, target, edge);
+	else:
+		save = lambda src, target, edge: savedValue(edge);
+	return [save(*d) for d in zip(srcDatas, targetDatas, edgeDatas)];
+
+def saveVertexShard(path, ids, values, formats):
+	# ids holds the int64 ids of the vertices of values, formats the
+	# shardFormat of the vertex shard of every machine
+	emptyValue = None;
+	if not any(formats):
+		data = defaultData(vertexDtype, "vertexDataClass");
+		emptyValue = None if data is None else vertexShardValues([data])[0];
+	saveShard(path, numpy.frombuffer(ids, dtype=numpy.int64), values, shardKind(formats, emptyValue));
+
+def saveEdgeShard(path, ids, values, formats):
+	# ids holds int64 (source, target) pairs
+	emptyValue = None;
+	if not any(formats):
+		vertex = defaultData(vertexDtype, "vertexDataClass");
+		edge = defaultData(edgeDtype, "edgeDataClass");
+		emptyValue = None if edge is None else edgeShardValues([vertex], [vertex], [edge])[0];
+	ids = numpy.frombuffer(ids, dtype=numpy.int64).reshape(-1, 2);
+	saveShard(path, ids, values, shardKind(formats, emptyValue));
+
 def gather(srcData, targetData, edgeData, numIn, numOut):
 	return usermod.gather(srcData, targetData, edgeData, numIn, numOut);
 
+def gatherBatch(targetData, neighborDatas, edgeDatas, degrees):
+	# degrees arrives as packed (numIn, numOut) C longs, one pair per neighbour
+	if numpy is not None:
+		degrees = numpy.frombuffer(degrees, dtype=numpy.int_).reshape(-1, 2);
+	else:
+		degrees = array.array('l', degrees);
+		degrees = zip(degrees[0::2], degrees[1::2]);
+	return usermod.gather_batch(targetData, neighborDatas, edgeDatas, degrees);
+
 def apply(targetData, agg, numIn, numOut):
+	# returns the new vertex data, or None when the data is unchanged, which
+	# spares sending it to the mirrors of the vertex
 	return usermod.apply(targetData, agg, numIn, numOut);
 
 def scatter(srcData, targetData, edgeData, numIn, numOut):	
+	# returns (priority, edgeData, targetData[, delta]); a negative priority
+	# does not signal, None leaves the data unchanged and delta, an
+	# aggregatorClass, is added to the cached gather of the target
 	return usermod.scatter(srcData, targetData, edgeData, numIn, numOut);
         
+def shouldScatter(vertexData):
+	# False skips the scatter edges of the vertex altogether
+	return usermod.should_scatter(vertexData);
+
+def scatterBatch(srcData, neighborDatas, edgeDatas, numIn, numOut):
+	# replaces scatter: returns one priority per edge (e.g. a numpy array) or a
+	# single priority for all edges, negative priorities do not signal
+	return usermod.scatter_batch(srcData, neighborDatas, edgeDatas, numIn, numOut);
+
 def parseEdge(file, line):
 	return usermod.parseEdge(file, line);
+
+def parseEdges(file, chunk):
+	# chunk holds whole lines of file; parseEdges returns (src, dst) or
+	# (src, dst, payload) as parallel arrays
+	return edgeArrays(*usermod.parseEdges(file, chunk));
+
+def edgeArrays(src, dst, payload = None):
+	# normalizes edge arrays for the bridge: int64 ids and either None, a list
+	# of edge values or, with edgeDtype, contiguous packed records
+	if numpy is not None:
+		src = numpy.ascontiguousarray(src, dtype=numpy.int64);
+		dst = numpy.ascontiguousarray(dst, dtype=numpy.int64);
+		if payload is not None and edgeDtype is not None:
+			payload = numpy.ascontiguousarray(payload, dtype=edgeDtype);
+	else:
+		src = array.array('l', src);
+		dst = array.array('l', dst);
+	if payload is not None and edgeDtype is None:
+		payload = list(payload);
+	return (src, dst, payload);
+
+def vertexShard(ids, datas, fieldNames):
+	# one machine's part of vertex_data_to_arrays/get_vertex_data: ids are
+	# packed int64, datas a list of vertex values or packed vertexDtype records
+	ids = numpy.frombuffer(ids, dtype=numpy.int64);
+	if vertexDtype is not None:
+		datas = numpy.frombuffer(datas, dtype=vertexDtype);
+	if fieldNames is None:
+		values = datas;
+	elif vertexDtype is not None:
+		values = [numpy.array(datas[f]) for f in fieldNames];
+	else:
+		values = [numpy.array([getattr(d, f) for d in datas]) for f in fieldNames];
+	return cPickle.dumps((ids, values), cPickle.HIGHEST_PROTOCOL);
+
+def joinVertexShards(shards, ids, fieldNames):
+	shards = [cPickle.loads(s) for s in shards];
+	shards = [s for s in shards if len(s[0]) > 0];
+	if len(shards) == 0:
+		allIds = numpy.zeros(0, dtype=numpy.int64);
+	else:
+		allIds = numpy.concatenate([s[0] for s in shards]);
+
+	if ids is None:
+		# vertex_data_to_arrays: arrays ordered by vertex id
+		order = numpy.argsort(allIds, kind="mergesort");
+		result = {"id": allIds[order]};
+		for i, f in enumerate(fieldNames):
+			if len(shards) == 0:
+				result[f] = numpy.zeros(0);
+			else:
+				result[f] = numpy.concatenate([s[1][i] for s in shards])[order];
+		return result;
+
+	# get_vertex_data: values in the order of ids
+	values = [];
+	for s in shards:
+		values.extend(s[1]);
+	position = dict(zip(allIds.tolist(), range(len(values))));
+	return [values[position[i]] if i in position else None for i in ids];
+
+# the settings and functions initUserModule may replace, as defined above
+_moduleDefaults = dict((name, globals()[name]) for name in (
+	"gatherEdges", "scatterEdges", "parseBlockSize", "engineOptions", "aggregators", "kernels",
+	"vertexDtype", "edgeDtype", "storeVertex", "loadVertex", "storeEdge", "loadEdge", "storeAgg",
+	"loadAgg", "transformVertex", "transformEdge", "saveVertex", "saveEdge", "gather", "apply",
+	"scatter", "parseEdge", "shouldScatter", "scatterBatch"));
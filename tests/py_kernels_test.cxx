@@ -0,0 +1,211 @@
+/*
+ * Copyright (c) 2009 Carnegie Mellon University.
+ *     All rights reserved.
+ *
+ *  Licensed under the Apache License, Version 2.0 (the "License");
+ *  you may not use this file except in compliance with the License.
+ *  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *  Unless required by applicable law or agreed to in writing,
+ *  software distributed under the License is distributed on an "AS
+ *  IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+ *  express or implied.  See the License for the specific language
+ *  governing permissions and limitations under the License.
+ *
+ * For more about this software visit:
+ *
+ *      http://www.graphlab.ml.cmu.edu
+ *
+ */
+
+
+#include <cmath>
+#include <cstddef>
+#include <map>
+#include <string>
+
+#include <cxxtest/TestSuite.h>
+
+#include "../apps/py_graphlab/native_kernels.hpp"
+
+using namespace py_kernels;
+
+// records of the form {double pr; int32 count; uint8 flag} for vertices and
+// {float weight} for edges
+struct test_vertex {
+  double pr;
+  int32_t count;
+  uint8_t flag;
+};
+
+class test_py_kernels : public CxxTest::TestSuite {
+public:
+  layout_type vlayout, elayout;
+  std::map<std::string, double> constants;
+  test_vertex src, target;
+  float weight;
+
+  test_py_kernels() {
+    field_type pr = {offsetof(test_vertex, pr), 'f', 8};
+    field_type count = {offsetof(test_vertex, count), 'i', 4};
+    field_type flag = {offsetof(test_vertex, flag), 'b', 1};
+    field_type w = {0, 'f', 4};
+    vlayout["pr"] = pr;
+    vlayout["count"] = count;
+    vlayout["flag"] = flag;
+    elayout["weight"] = w;
+    constants["DAMPING"] = 0.85;
+    src.pr = 2.0; src.count = 4; src.flag = 1;
+    target.pr = 0.5; target.count = -3; target.flag = 0;
+    weight = 0.25;
+  }
+
+  double eval(const std::string &text, double total = 0.0) {
+    expression e;
+    std::string error;
+    TS_ASSERT(e.compile(text, vlayout, elayout, constants, error));
+    TS_ASSERT_EQUALS(error, "");
+    const kernel_args args = {(const char *)&src, (const char *)&target, (const char *)&weight,
+                              3.0, 5.0, total};
+    return e.eval(args);
+  }
+
+  std::string compile_error(const std::string &text) {
+    expression e;
+    std::string error;
+    TS_ASSERT(!e.compile(text, vlayout, elayout, constants, error));
+    TS_ASSERT(e.empty());
+    return error;
+  }
+
+  void test_parse() {
+    TS_ASSERT_EQUALS(eval("42"), 42.0);
+    TS_ASSERT_EQUALS(eval(" 1.5e1 "), 15.0);
+    TS_ASSERT_EQUALS(eval(".5"), 0.5);
+    TS_ASSERT_EQUALS(eval("numIn + numOut"), 8.0);
+    TS_ASSERT_EQUALS(eval("total", 7.0), 7.0);
+    TS_ASSERT_EQUALS(eval("DAMPING"), 0.85);
+    TS_ASSERT_EQUALS(eval("abs(-2) + sqrt(9) + exp(0) + log(1)"), 6.0);
+    TS_ASSERT_EQUALS(eval("min(3, 1) + max(3, 1) + pow(2, 3)"), 12.0);
+    expression e;
+    TS_ASSERT(e.empty());
+  }
+
+  void test_precedence() {
+    TS_ASSERT_EQUALS(eval("1 + 2 * 3"), 7.0);
+    TS_ASSERT_EQUALS(eval("(1 + 2) * 3"), 9.0);
+    TS_ASSERT_EQUALS(eval("8 - 4 - 2"), 2.0);
+    TS_ASSERT_EQUALS(eval("8 / 4 / 2"), 1.0);
+    // as in Python: ** binds tighter than unary minus and is right associative
+    TS_ASSERT_EQUALS(eval("-2 ** 2"), -4.0);
+    TS_ASSERT_EQUALS(eval("2 ** -1"), 0.5);
+    TS_ASSERT_EQUALS(eval("2 ** 3 ** 2"), 512.0);
+    TS_ASSERT_EQUALS(eval("1 + 1 > 1"), 1.0);
+    TS_ASSERT_EQUALS(eval("not 1 > 2"), 1.0);
+    TS_ASSERT_EQUALS(eval("1 or 0 and 0"), 1.0);
+    TS_ASSERT_EQUALS(eval("not 0 and 0"), 0.0);
+    TS_ASSERT_EQUALS(eval("2*(3 > 2)-1"), 1.0);
+    TS_ASSERT_EQUALS(eval("2*(3 < 2)-1"), -1.0);
+  }
+
+  void test_comparisons() {
+    TS_ASSERT_EQUALS(eval("1 < 2"), 1.0);
+    TS_ASSERT_EQUALS(eval("2 <= 2"), 1.0);
+    TS_ASSERT_EQUALS(eval("1 > 2"), 0.0);
+    TS_ASSERT_EQUALS(eval("1 >= 2"), 0.0);
+    TS_ASSERT_EQUALS(eval("2 == 2"), 1.0);
+    TS_ASSERT_EQUALS(eval("2 != 2"), 0.0);
+  }
+
+  void test_field_reads() {
+    TS_ASSERT_EQUALS(eval("src.pr"), 2.0);
+    TS_ASSERT_EQUALS(eval("target.pr"), 0.5);
+    TS_ASSERT_EQUALS(eval("src.count + target.count"), 1.0);
+    TS_ASSERT_EQUALS(eval("src.flag + target.flag"), 1.0);
+    TS_ASSERT_EQUALS(eval("edge.weight"), 0.25);
+    TS_ASSERT_DELTA(eval("DAMPING*src.pr/numOut"), 0.34, 1e-12);
+
+    expression e;
+    std::string error;
+    TS_ASSERT(e.compile("edge.weight + 1", vlayout, elayout, constants, error));
+    const kernel_args args = {(const char *)&src, (const char *)&target, NULL, 0.0, 0.0, 0.0};
+    TS_ASSERT_EQUALS(e.eval(args), 1.0);
+  }
+
+  void test_field_writes() {
+    test_vertex v = {0.0, 0, 0};
+    write_field((char *)&v, vlayout["pr"], 1.25);
+    write_field((char *)&v, vlayout["count"], -7.0);
+    write_field((char *)&v, vlayout["flag"], 3.0);
+    TS_ASSERT_EQUALS(v.pr, 1.25);
+    TS_ASSERT_EQUALS(v.count, -7);
+    TS_ASSERT_EQUALS(v.flag, 1);
+    TS_ASSERT_EQUALS(read_field((const char *)&v, vlayout["count"]), -7.0);
+
+    float w = 0;
+    write_field((char *)&w, elayout["weight"], 0.5);
+    TS_ASSERT_EQUALS(w, 0.5f);
+
+    uint16_t u = 0;
+    field_type ufield = {0, 'u', 2};
+    write_field((char *)&u, ufield, 65535.0);
+    TS_ASSERT_EQUALS(read_field((const char *)&u, ufield), 65535.0);
+  }
+
+  void test_assignments() {
+    std::string field, expr;
+    TS_ASSERT(split_assignment("pr = total+0.15", field, expr));
+    TS_ASSERT_EQUALS(field, "pr");
+    TS_ASSERT_EQUALS(expr, " total+0.15");
+    TS_ASSERT(split_assignment(" target.prDelta=1", field, expr));
+    TS_ASSERT_EQUALS(field, "prDelta");
+    TS_ASSERT_EQUALS(expr, "1");
+    TS_ASSERT(!split_assignment("pr == 1", field, expr));
+    TS_ASSERT(!split_assignment("pr <= 1", field, expr));
+    TS_ASSERT(!split_assignment("pr != 1", field, expr));
+    TS_ASSERT(!split_assignment("= 1", field, expr));
+    TS_ASSERT(!split_assignment("total", field, expr));
+  }
+
+  void test_merge() {
+    accumulator_type acc = {0.0, 0.0};
+    const accumulator_type a = {2.0, 1.0}, b = {3.0, 1.0}, empty = {5.0, 0.0};
+    merge(MERGE_SUM, acc, a);
+    merge(MERGE_SUM, acc, b);
+    merge(MERGE_SUM, acc, empty);
+    TS_ASSERT_EQUALS(acc.value, 5.0);
+    TS_ASSERT_EQUALS(acc.count, 2.0);
+    accumulator_type lo = a, hi = a;
+    merge(MERGE_MIN, lo, b);
+    merge(MERGE_MAX, hi, b);
+    TS_ASSERT_EQUALS(lo.value, 2.0);
+    TS_ASSERT_EQUALS(hi.value, 3.0);
+  }
+
+  void test_errors() {
+    TS_ASSERT_DIFFERS(compile_error("").find("unexpected end"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("1 +").find("unexpected end"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("(1 + 2").find("missing ')'"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("1 2").find("unexpected '2'"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("1 + * 2").find("unexpected '*'"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("src").find("expected a field of src"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("src.missing").find("unknown field src.missing"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("edge.pr").find("unknown field edge.pr"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("TOLERANCE").find("unknown name TOLERANCE"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("abs 1").find("expected '('"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("min(1)").find("takes two arguments"), std::string::npos);
+    TS_ASSERT_DIFFERS(compile_error("sqrt(1, 2)").find("missing ')'"), std::string::npos);
+    // errors name the expression
+    TS_ASSERT_EQUALS(compile_error("1 +").find("in '1 +': "), 0u);
+
+    // a failed compile leaves no expression behind, a later one succeeds
+    expression e;
+    std::string error;
+    TS_ASSERT(!e.compile("1 +", vlayout, elayout, constants, error));
+    TS_ASSERT(e.compile("1 + 1", vlayout, elayout, constants, error));
+    TS_ASSERT_EQUALS(error, "");
+    TS_ASSERT(!e.empty());
+  }
+};